@@ -0,0 +1,326 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import timeit
+
+import attr
+
+from core import bots
+from core import catalog
+from core import game_const
+from core import messages
+from core import solver
+from core.planner import PLANNER
+from core.client_boundary import Client
+from core.deduction import Knowledge
+from core.game import Game
+from server import clueless_db
+
+NUMBER = 100000
+
+
+def _report(name: str, seconds: float, number: int) -> None:
+    print(f'{name:<40} {seconds / number * 1e6:8.3f} us/op')
+
+
+def bench_messages(number: int = NUMBER) -> None:
+    """Compares the cached message codecs against attr.asdict/cls(**data)."""
+    game_state = messages.GameStateRequest(
+        game_id='game', client_id='client',
+        whereabouts={name: game_const.STUDY for name in game_const.CHARACTERS},
+        current_turn=game_const.PLUM,
+        player_cards=list(game_const.WEAPONS[:3]))
+    result = messages.PlayerSuggestionResult(
+        game_id='game', client_id='client', suspect=game_const.PLUM,
+        weapon=game_const.ROPE, room=game_const.HALL,
+        disproved_by=game_const.GREEN, disproved_card=game_const.ROPE,
+        suggested_by=game_const.WHITE)
+    for message in (game_state, result):
+        name = type(message).__name__
+        data = message.to_dict()
+        _report(f'{name} attr.asdict',
+                timeit.timeit(lambda: attr.asdict(message), number=number),
+                number)
+        _report(f'{name} to_dict',
+                timeit.timeit(message.to_dict, number=number), number)
+        _report(f'{name} cls(**data)',
+                timeit.timeit(lambda: type(message)(**data), number=number),
+                number)
+        _report(f'{name} from_dict',
+                timeit.timeit(lambda: type(message).from_dict(data),
+                              number=number),
+                number)
+
+
+def _legacy_disprover(game: Game, suggestion):
+    """The old disproval loop, a list scan of each player's hand in turn."""
+    for turn in range(game.turn + 1, game.turn + len(game.players)):
+        player_to_ask = game.players[turn % len(game.players)]
+        for card in suggestion:
+            if card in player_to_ask.cards:
+                return player_to_ask, card
+    return None, None
+
+
+def bench_suggestions(games: int = 2000, suggestions: int = 50) -> None:
+    """Compares finding the disprover against the old per-hand scan."""
+    all_games = []
+    for _ in range(games):
+        names = random.sample(game_const.CHARACTERS, random.randint(3, 6))
+        game = Game([Client(name, 'localhost') for name in names])
+        game.turn = random.randrange(len(names))
+        all_games.append(game)
+    cases = [(game, [random.choice(catalog.WEAPON_CARDS),
+                     random.choice(catalog.CHARACTER_CARDS),
+                     random.choice(catalog.ROOM_CARDS)])
+             for game in all_games for _ in range(suggestions)]
+    for game, suggestion in cases:
+        expected = _legacy_disprover(game, suggestion)
+        actual = game._find_disprover(suggestion)
+        assert expected == actual, (expected, actual)
+    number = len(cases)
+    _report('legacy hand scan',
+            timeit.timeit(lambda: [_legacy_disprover(game, suggestion)
+                                   for game, suggestion in cases], number=1),
+            number)
+    _report('card owner index',
+            timeit.timeit(lambda: [game._find_disprover(suggestion)
+                                   for game, suggestion in cases], number=1),
+            number)
+
+
+def bench_db(number: int = 5000) -> None:
+    """Compares pooled queries against a new connection per query.
+
+    Runs against the SQLite stand-in, so it understates the win over a
+    TCP connection to Postgres.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'clueless.sqlite')
+        db = clueless_db.Clueless_Database(
+            path, backend_factory=clueless_db.SQLiteBackend)
+        db.create_database()
+        db.start_game(1, 1, 'player', 1, 'started')
+
+        def connect_per_query():
+            connection = sqlite3.connect(path)
+            cursor = connection.cursor()
+            cursor.execute('SELECT * FROM "User"')
+            cursor.fetchall()
+            cursor.close()
+            connection.close()
+
+        _report('connect per query',
+                timeit.timeit(connect_per_query, number=number), number)
+        _report('pooled connection',
+                timeit.timeit(db.get_users, number=number), number)
+        db.disconnect()
+
+
+def bench_accusations(games: int = 20000, number: int = 20000) -> None:
+    """Load test of validate_accusation with many games stored.
+
+    Compares the old unkeyed scan of "MurderDeck" against the keyed
+    lookup, and against the in-memory murder deck cache.
+    """
+    decks = [(game_id, random.choice(game_const.CHARACTERS),
+              random.choice(game_const.WEAPONS), random.choice(game_const.ROOMS))
+             for game_id in range(1, games + 1)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'clueless.sqlite')
+        db = clueless_db.Clueless_Database(
+            path, backend_factory=clueless_db.SQLiteBackend)
+        db.create_database()
+        with db.transaction() as transaction:
+            transaction.execute_many('insert_user', [
+                (game_id, 'player', 1) for game_id, *_ in decks])
+            transaction.execute_many('insert_game', [
+                (game_id, game_id, 'started') for game_id, *_ in decks])
+            transaction.execute_many('insert_murder_deck', decks)
+        lookups = [random.choice(decks) for _ in range(number)]
+        # The games still in the murder deck cache after the cold pass
+        active = decks[-clueless_db.MURDER_DECK_CACHE_SIZE:]
+
+        connection = sqlite3.connect(path)
+
+        def legacy_scan(game_id, *accusation):
+            cursor = connection.cursor()
+            cursor.execute('SELECT "GameID", "SuspectCard", "WeaponCard", "RoomCard" '
+                           'FROM "MurderDeck"')
+            for row in cursor:
+                if row[0] == game_id:
+                    return row[1:] == accusation
+            return False
+
+        scans = lookups[:max(1, number // 100)]
+        _report(f'full scan ({games} games)',
+                timeit.timeit(lambda: [legacy_scan(*deck) for deck in scans],
+                              number=1), len(scans))
+        connection.close()
+        _report('keyed lookup, cold cache',
+                timeit.timeit(lambda: [db.validate_accusation(*deck)
+                                       for deck in decks], number=1), games)
+        hits = [random.choice(active) for _ in range(number)]
+        _report('cached murder deck',
+                timeit.timeit(lambda: [db.validate_accusation(*deck)
+                                       for deck in hits], number=1), number)
+        assert all(db.validate_accusation(*deck) for deck in lookups)
+        db.disconnect()
+
+
+def _legacy_strategize(player_deck, seen_cards, all_weapons, all_suspects,
+                       all_rooms):
+    """The old App.strategize_options, which only ruled out seen cards."""
+    weapons = [weapon for weapon in all_weapons
+               if weapon not in (player_deck + seen_cards)]
+    suspects = [suspect for suspect in all_suspects
+                if suspect not in (player_deck + seen_cards)]
+    rooms = [room for room in all_rooms
+             if room not in (player_deck + seen_cards)]
+    return weapons or all_weapons, suspects or all_suspects, rooms or all_rooms
+
+
+class _RecordingPolicy(bots.BotPolicy):
+    """Plays at random, keeping every suggestion result and whose turn it was."""
+
+    def __init__(self, player_name: str):
+        super().__init__(player_name)
+        self.current_turn = ''
+        self.hand = []
+        self.results = []
+
+    def on_game_state(self, game_state: messages.GameStateRequest) -> None:
+        self.current_turn = game_state.current_turn
+        self.hand = game_state.player_cards
+
+    def on_suggestion_result(self, result: messages.PlayerSuggestionResult) -> None:
+        self.results.append((self.current_turn, result))
+
+
+def bench_deduction(games: int = 200) -> None:
+    """Times Knowledge updates on the suggestion results of bot games."""
+    cases = []
+    for _ in range(games):
+        names = random.sample(game_const.CHARACTERS, random.randint(3, 6))
+        policy = _RecordingPolicy(names[0])
+        game = Game([bots.BotClient(names[0], policy)]
+                    + [bots.BotClient(name, bots.RandomPolicy(name))
+                       for name in names[1:]])
+        while not game.result and game.turn < 200:
+            game.take_turn()
+        cases.append((names, policy.hand, policy.results))
+    number = sum(len(results) for *_, results in cases)
+
+    def update():
+        for names, hand, results in cases:
+            knowledge = Knowledge(names[0], names, hand)
+            for current_turn, result in results:
+                knowledge.current_turn = current_turn
+                knowledge.on_suggestion_result(result)
+
+    def legacy():
+        for names, hand, results in cases:
+            seen = []
+            for _, result in results:
+                if result.disproved_card:
+                    seen.append(result.disproved_card)
+                _legacy_strategize(hand, seen, game_const.WEAPONS,
+                                   game_const.CHARACTERS, game_const.ROOMS)
+
+    _report('legacy strategize_options', timeit.timeit(legacy, number=1), number)
+    _report('Knowledge update + propagate', timeit.timeit(update, number=1),
+            number)
+
+
+def bench_solver(games: int = 10, budget: float = solver.SAMPLE_BUDGET) -> None:
+    """Times solver decisions through 6 player games, and how often they're right."""
+    decisions = []
+    for _ in range(games):
+        names = random.sample(game_const.CHARACTERS, 6)
+        policy = _RecordingPolicy(names[0])
+        others = [bots.RandomPolicy(name) for name in names[1:]]
+        for other in others:
+            other.accuse_chance = 0  # Play on, to decide with more to go on
+        game = Game([bots.BotClient(names[0], policy)]
+                    + [bots.BotClient(other.player_name, other)
+                       for other in others])
+        while game.turn < 60:
+            game.take_turn()
+        weapon, suspect, room = (card.name for card in game.murder_deck)
+        murder = (suspect, weapon, room)
+        knowledge = Knowledge(names[0], names, policy.hand)
+        for current_turn, result in policy.results:
+            knowledge.current_turn = current_turn
+            knowledge.on_suggestion_result(result)
+            start = timeit.default_timer()
+            probabilities = solver.estimate_solutions(knowledge, budget)
+            best, probability = solver.get_best_solution(
+                probabilities, *knowledge.get_candidates())
+            decisions.append((timeit.default_timer() - start, probability,
+                              best == murder))
+    seconds = [seconds for seconds, *_ in decisions]
+    _report('estimate_solutions (6 players)', sum(seconds), len(seconds))
+    print(f'{"slowest decision":<40} {max(seconds) * 1e6:8.3f} us')
+    for low, high in ((0, 0.5), (0.5, 0.9), (0.9, 1.01)):
+        hits = [correct for _, probability, correct in decisions
+                if low <= probability < high]
+        if hits:
+            print(f'{f"best at {low:.1f}-{min(high, 1):.1f} right":<40} '
+                  f'{sum(hits) / len(hits):8.3f} of {len(hits)}')
+
+
+def bench_planner(number: int = NUMBER) -> None:
+    """Times planned moves between random rooms, some hallways blocked."""
+    rooms = catalog.BOARD.rooms
+    hallways = [room.name for room in rooms
+                if catalog.BOARD.get_bit(room) & catalog.BOARD.hallway_mask]
+    cases = [(random.choice(rooms), random.choice(rooms),
+              PLANNER.get_blocked(random.sample(hallways, 3)))
+             for _ in range(1000)]
+    plans = [(source.name, random.sample(game_const.ROOMS, 4),
+              random.sample(hallways, 3))
+             for source, *_ in cases]
+
+    def next_move():
+        for source, target, blocked in cases:
+            PLANNER.get_next_move(source, target, blocked)
+
+    def plan_move():
+        for plan in plans:
+            PLANNER.plan_move(*plan)
+
+    repeat = max(1, number // len(cases))
+    _report('get_next_move', timeit.timeit(next_move, number=repeat),
+            repeat * len(cases))
+    _report('plan_move (4 targets, 3 blocked)',
+            timeit.timeit(plan_move, number=repeat), repeat * len(plans))
+
+
+BENCHMARKS = {
+    'messages': bench_messages,
+    'suggestions': bench_suggestions,
+    'db': bench_db,
+    'accusations': bench_accusations,
+    'deduction': bench_deduction,
+    'solver': bench_solver,
+    'planner': bench_planner,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Clue-Less micro-benchmarks')
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f'Any of {", ".join(BENCHMARKS)} (default: all)')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+    for name in args.benchmarks or list(BENCHMARKS):
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,64 @@ import json
 import logging
 import os
 import random
+from collections import OrderedDict
+from threading import Condition, Lock
 import time
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
+import uuid
 
-from flask import Flask, request, render_template, jsonify, redirect, url_for
+from flask import Flask, Response, request, render_template, jsonify, redirect, url_for
 
 from core.messages import PlayerMoveRequest, PlayerMoveResponse
 from core.server_boundary import Server
 from core.messages import GameStateRequest, ClientGameStateRequest
+from core.transport import HttpTransport, serve_sockets
 
+from core.deduction import Knowledge
+from core import solver
 from core.game import GameEncoder
+from core.planner import PLANNER
+from core import client_boundary
 from core import game_const
 from core import messages
-from time import sleep
+from core import wire
+from core.wire import read_message, send_message
 
 SERVER_IP = os.environ.get('SERVER_IP')
 SERVER_PORT = os.environ.get('SERVER_PORT')
 
+# Pooled connections to the server
+HTTP_TRANSPORT = HttpTransport(
+    pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10)),
+    keep_alive=os.environ.get('HTTP_KEEP_ALIVE', 'true') == 'true',
+    content_type=wire.CONTENT_TYPE)
+
+# Set to also answer the server's messages over a persistent socket
+SOCKET_PORT = os.environ.get('SOCKET_PORT')
+
+# Seconds a page render waits for the server before falling back to the
+# event stream
+PAGE_WAIT = float(os.environ.get('PAGE_WAIT', 2))
+# Seconds an /events request waits for a change before it's answered empty
+# (and the browser reconnects), so an open page doesn't hold a worker thread
+EVENT_WAIT = float(os.environ.get('EVENT_WAIT', 10))
+# Milliseconds the browser waits before reconnecting to /events
+EVENT_RETRY = 500
+# Seconds join_game waits on the server for enough players to start a game
+JOIN_WAIT = int(os.environ.get('JOIN_WAIT', 15))
+# Seconds a player gets to answer the server, it skips the turn after that
+TURN_TIMEOUT = float(os.environ.get('TURN_TIMEOUT',
+                                    client_boundary.TURN_TIMEOUT))
+
+# Most player sessions one client app holds, and seconds an idle one lives
+SESSION_LIMIT = int(os.environ.get('SESSION_LIMIT', 500))
+SESSION_TTL = float(os.environ.get('SESSION_TTL', 2 * 60 * 60))
+SESSION_COOKIE = 'clueless_session'
+
+# Seconds of sampling per automated decision, and the odds needed to accuse
+SAMPLE_BUDGET = float(os.environ.get('SAMPLE_BUDGET', solver.SAMPLE_BUDGET))
+ACCUSE_CONFIDENCE = float(os.environ.get('ACCUSE_CONFIDENCE', 0.9))
+
 DEBUG = False
 EMPTY_ACCUSATION_RESULT = messages.PlayerAccusationResult('', '', False,
                                                           '', '', '')
@@ -32,101 +73,277 @@ class Actions(Enum):
     ACCUSE = 3  # Client should display Accusation Page
 
 
+class Updates(object):
+    """Hands state changes between the /api handlers, forms and pages."""
+
+    def __init__(self):
+        self._condition = Condition()
+        self.version = 0
+
+    def notify(self) -> int:
+        """Records a state change and wakes everything waiting on one."""
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+            return self.version
+
+    def wait_for(self, predicate: Callable[[], bool],
+                 timeout: float = None) -> bool:
+        """Blocks until predicate() holds, re-checking on every change."""
+        with self._condition:
+            return bool(self._condition.wait_for(predicate, timeout))
+
+    def wait_for_change(self, version: int, timeout: float = None) -> int:
+        """Blocks until the version moves past the given one."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
 class AppData(object):
-    server = Server(SERVER_IP, SERVER_PORT)
-    next_action: Actions = Actions.WAIT
-    game_state: messages.GameStateRequest = GameStateRequest(
-        None, None, None, None, None)
-    move_request: messages.PlayerMoveRequest = None
-    move_response: messages.PlayerMoveResponse = None
-    suggest_request: messages.PlayerSuggestionRequest = None
-    suggest_response: messages.PlayerSuggestionResponse = None
-    suggest_results: messages.PlayerSuggestionResult = None
-    accuse_request: messages.PlayerAccusationRequest = None
-    accuse_response: messages.PlayerAccusationResponse = None
-    accuse_results: messages.PlayerAccusationResult = EMPTY_ACCUSATION_RESULT
-    game_id: str = ''
-    client_id: str = ''
-    seen_cards: List[str] = []
-    player_deck: List[str] = []
-    character: str = ''
-    whereabouts: Dict[str, str] = []
-    current_turn: str = ''
-    suggestion: bool = True
-    continue_game: bool = False
-    moved: bool = False
-    suggested: bool = False
-    accused: bool = False
+    """One player's session: their server connection, game and UI state."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.last_seen = time.time()
+        # Set once the session is evicted, to release any waiting handlers
+        self.evicted = False
+        self.server = Server(SERVER_IP, SERVER_PORT, transport=HTTP_TRANSPORT)
+        self.updates = Updates()
+        self.next_action: Actions = Actions.WAIT
+        self.game_state: messages.GameStateRequest = GameStateRequest(
+            None, None, None, None, None)
+        self.state_version: int = 0  # The server's Game.version of game_state
+        self.move_request: messages.PlayerMoveRequest = None
+        self.move_response: messages.PlayerMoveResponse = None
+        self.suggest_request: messages.PlayerSuggestionRequest = None
+        self.suggest_response: messages.PlayerSuggestionResponse = None
+        self.suggest_results: messages.PlayerSuggestionResult = None
+        self.accuse_request: messages.PlayerAccusationRequest = None
+        self.accuse_response: messages.PlayerAccusationResponse = None
+        self.accuse_results: messages.PlayerAccusationResult = EMPTY_ACCUSATION_RESULT
+        self.game_id: str = ''
+        self.client_id: str = ''
+        self.seen_cards: List[str] = []
+        self.player_deck: List[str] = []
+        self.character: str = ''
+        self.whereabouts: Dict[str, str] = {}
+        self.current_turn: str = ''
+        self.suggestion: bool = True
+        self.continue_game: bool = False
+        self.moved: bool = False
+        self.suggested: bool = False
+        self.accused: bool = False
+        # Built from the first game state, then fed every suggestion result
+        self.knowledge: Optional[Knowledge] = None
+
+    def narrow_options(self, weapons: List[str], suspects: List[str],
+                       rooms: List[str]):
+        """Narrows a request's options to the cards that could be the murder."""
+        if not self.knowledge:
+            return weapons, suspects, rooms
+        return self.knowledge.narrow_options(weapons, suspects, rooms)
+
+    def best_solution(self, weapons: List[str], suspects: List[str],
+                      rooms: List[str]):
+        """Returns the likeliest (suspect, weapon, room) of the options, and its odds.
+
+        Falls back to the first narrowed options, at no confidence, before
+        the first game state or if the sampler finds nothing.
+        """
+        if self.knowledge:
+            probabilities = solver.estimate_solutions(self.knowledge,
+                                                      SAMPLE_BUDGET)
+            best, probability = solver.get_best_solution(
+                probabilities, suspects, weapons, rooms)
+            if best:
+                return best, probability
+        weapons, suspects, rooms = self.narrow_options(weapons, suspects, rooms)
+        return (suspects[0], weapons[0], rooms[0]), 0.0
+
+    def get_move_hint(self, move_options: List[str]) -> Optional[str]:
+        """Returns the move toward the nearest room that could be the murder room."""
+        whereabouts = self.game_state.whereabouts
+        if not self.knowledge or not whereabouts or self.character not in whereabouts:
+            return None
+        _, _, rooms = self.knowledge.get_candidates()
+        occupied = [room for name, room in whereabouts.items()
+                    if name != self.character]
+        move = PLANNER.plan_move(whereabouts[self.character], rooms, occupied)
+        return move if move in move_options else None
+
+    def take_response(self, name: str, default: messages.Message,
+                      timeout: float = TURN_TIMEOUT) -> messages.Message:
+        """Blocks until the player fills in the named response, then takes it.
+
+        An evicted session, or a player who doesn't answer within timeout
+        (by when the server has skipped them), gets the default (a skip).
+        """
+        self.updates.wait_for(lambda: getattr(self, name) or self.evicted,
+                              timeout)
+        response = getattr(self, name) or default
+        setattr(self, name, None)
+        return response
+
+
+class SessionStore(object):
+    """A bounded store of AppData, keyed by session id and by client_id.
+
+    The least recently seen session is evicted once there are more than
+    limit, and any session left idle for longer than ttl.
+    """
+
+    def __init__(self, limit: int = SESSION_LIMIT, ttl: float = SESSION_TTL):
+        self._limit = limit
+        self._ttl = ttl
+        self._lock = Lock()
+        # Least recently seen first
+        self._sessions: Dict[str, AppData] = OrderedDict()
+        self._by_client_id: Dict[str, AppData] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self) -> AppData:
+        app_data = AppData(str(uuid.uuid4()))
+        with self._lock:
+            self._sessions[app_data.session_id] = app_data
+            self._evict()
+        return app_data
+
+    def get(self, session_id: Optional[str]) -> Optional[AppData]:
+        """Returns the session for a browser, marking it as recently seen."""
+        with self._lock:
+            app_data = self._sessions.get(session_id)
+            if app_data:
+                app_data.last_seen = time.time()
+                self._sessions.move_to_end(session_id)
+            self._evict()
+            return app_data
+
+    def get_by_client_id(self, client_id: str) -> Optional[AppData]:
+        """Returns the session the server's client_id was issued to."""
+        return self._by_client_id.get(client_id)
+
+    def set_client_id(self, app_data: AppData, client_id: str) -> None:
+        with self._lock:
+            self._by_client_id.pop(app_data.client_id, None)
+            app_data.client_id = client_id
+            self._by_client_id[client_id] = app_data
+
+    def _evict(self) -> None:
+        # Callers must hold self._lock
+        expired = time.time() - self._ttl
+        while self._sessions:
+            app_data = next(iter(self._sessions.values()))
+            if (len(self._sessions) <= self._limit
+                    and app_data.last_seen > expired):
+                break
+            logging.info('Evicting session %s', app_data.session_id)
+            del self._sessions[app_data.session_id]
+            if self._by_client_id.get(app_data.client_id) is app_data:
+                del self._by_client_id[app_data.client_id]
+            app_data.evicted = True
+            app_data.updates.notify()
 
 
 class App(Flask):
-    app_data: AppData = AppData()
+    sessions: SessionStore = SessionStore()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.json_encoder = GameEncoder
 
-    def strategize_options(self, all_weapons: List[str], all_suspects: List[str],
-                           all_rooms: List[str]):
-        """Automatically reduce options based on our hand and cards we've seen."""
-        # logging.info('Player Deck: %s', self.player_deck)
-        # logging.info('Seen Cards: %s', self.seen_cards)
-
-        weapons = [weapon for weapon in all_weapons
-                   if weapon not in (self.app_data.player_deck + self.app_data.seen_cards)]
-        suspects = [suspect for suspect in all_suspects
-                    if suspect not in (self.app_data.player_deck + self.app_data.seen_cards)]
-        rooms = [room for room in all_rooms
-                 if room not in (self.app_data.player_deck + self.app_data.seen_cards)]
-
-        if not weapons:
-            weapons = all_weapons
-        if not suspects:
-            suspects = all_suspects
-        if not rooms:
-            rooms = all_rooms
-        return weapons, suspects, rooms
-
 
 APP = App(__name__)
+APP.register_error_handler(wire.WireError, wire.on_wire_error)
+
+
+def get_session() -> Optional[AppData]:
+    """Returns the AppData for the browser making the current request."""
+    return APP.sessions.get(request.cookies.get(SESSION_COOKIE))
+
+
+def get_client_session(message: messages.Message) -> Optional[AppData]:
+    """Returns the AppData of the player a server message is addressed to."""
+    app_data = APP.sessions.get_by_client_id(message.client_id)
+    if not app_data:
+        logging.warning('No session for client %s', message.client_id)
+    return app_data
+
+
+def refresh_game_state(app_data: AppData, wait: int = 0) -> GameStateRequest:
+    """Brings game_state up to date with the changes since state_version."""
+    updates = app_data.server.get_game_updates(app_data.state_version, wait)
+    if updates.state:
+        app_data.game_state = GameStateRequest.from_dict(updates.state)
+    elif updates.changes:
+        game_state = app_data.game_state
+        whereabouts = dict(game_state.whereabouts)
+        current_turn = game_state.current_turn
+        for change in updates.changes:
+            if change['type'] == 'move':
+                whereabouts[change['player']] = change['room']
+            elif change['type'] == 'turn':
+                current_turn = change['current_turn']
+        app_data.game_state = GameStateRequest(
+            game_id=updates.game_id,
+            client_id=game_state.client_id,
+            whereabouts=whereabouts,
+            current_turn=current_turn,
+            player_cards=game_state.player_cards)
+    app_data.state_version = updates.version
+    return app_data.game_state
 
 
 @APP.route('/debug/app', methods=(['GET']))
 def debug_app():
-    app_dict = APP.app_data.__dict__.copy()
-    if APP.app_data.seen_cards:
-        app_dict.update(seen_cards=APP.app_data.seen_cards)
+    app_data = get_session()
+    if not app_data:
+        return jsonify(sessions=len(APP.sessions))
+    app_dict = {key: value for key, value in app_data.__dict__.items()
+                if key not in ('server', 'updates', 'knowledge')}
+    app_dict.update(next_action=app_data.next_action.name,
+                    sessions=len(APP.sessions))
+    if app_data.knowledge:
+        app_dict.update(candidates=app_data.knowledge.get_candidates())
     return jsonify(app_dict)
 
 
 @APP.route('/')
 def main():
-    return render_template('home.html',
-                           characters=list(game_const.CHARACTERS))
+    response = Response(render_template('home.html',
+                                        characters=list(game_const.CHARACTERS)))
+    if not get_session():
+        app_data = APP.sessions.create()
+        response.set_cookie(SESSION_COOKIE, app_data.session_id, httponly=True)
+    return response
 
 
 @APP.route('/join_game', methods=['POST'])
 def join_game():
+    app_data = get_session()
+    if not app_data:
+        return redirect(url_for('main'))
+
     # Player selects a character
-    APP.app_data.character = request.form.get('character')
-    logging.info('Selected character: %s', APP.app_data.character)
+    app_data.character = request.form.get('character')
+    logging.info('Selected character: %s', app_data.character)
 
     # Player get client id
-    join_response = APP.app_data.server.send_join_request(
-        APP.app_data.character)
+    join_response = app_data.server.send_join_request(
+        app_data.character)
     logging.info("Client ID: %s", join_response.client_id)
-    APP.app_data.client_id = join_response.client_id
+    APP.sessions.set_client_id(app_data, join_response.client_id)
 
     # Player get game id
-    game_response = APP.app_data.server.send_start_game_request()
+    game_response = app_data.server.send_start_game_request()
     logging.info("Game ID: %s", game_response.client_id)
-    APP.app_data.game_id = game_response.game_id
-
-    if not APP.app_data.game_id:
-        sleep(15)
+    app_data.game_id = game_response.game_id
 
-    # Player request game state
-    game_state_response = APP.app_data.server.get_game_state()
+    # Player request game state, the server holds it until a game starts
+    app_data.state_version = 0
+    game_state_response = refresh_game_state(app_data, wait=JOIN_WAIT)
     logging.info("Game State: %s", game_state_response.game_id)
 
     return redirect(url_for('game', game_id=game_state_response.game_id))
@@ -134,53 +351,71 @@ def join_game():
 
 @APP.route('/game/<game_id>', methods=['GET', 'POST'])
 def game(game_id):
-    APP.app_data.game_state = APP.app_data.server.get_game_state()
-    APP.app_data.current_turn = APP.app_data.game_state.current_turn
-    logging.info('current_turn: %s', APP.app_data.current_turn)
+    app_data = get_session()
+    if not app_data:
+        return redirect(url_for('main'))
+    version = app_data.updates.version
+    refresh_game_state(app_data)
+    app_data.current_turn = app_data.game_state.current_turn
+    logging.info('current_turn: %s', app_data.current_turn)
     rooms = list(game_const.ROOMS)
-
-    if APP.app_data.game_state.current_turn != APP.app_data.character:
-        APP.app_data.next_action = Actions.WAIT
-    elif APP.app_data.game_state.current_turn == APP.app_data.character and APP.app_data.next_action == Actions.WAIT:
-        APP.app_data.next_action = Actions.MOVE
-        while APP.app_data.move_request is None:
-            sleep(1)
-        rooms = APP.app_data.move_request.move_options
-        APP.app_data.moved = False
-        APP.app_data.suggested = False
-    elif APP.app_data.game_state.current_turn == APP.app_data.character and APP.app_data.next_action == Actions.MOVE and APP.app_data.moved:
-        APP.app_data.next_action = Actions.SUGGEST
+    move_hint = None
+    # Whether the page is waiting on the server, and so reloads on any
+    # change since version (even one made before its event stream opens)
+    waiting = False
+
+    if app_data.game_state.current_turn != app_data.character:
+        app_data.next_action = Actions.WAIT
+        waiting = True
+    elif app_data.game_state.current_turn == app_data.character and app_data.next_action == Actions.WAIT:
+        waiting = not app_data.updates.wait_for(
+            lambda: app_data.move_request is not None, PAGE_WAIT)
+        if not waiting:
+            app_data.next_action = Actions.MOVE
+            rooms = app_data.move_request.move_options
+            move_hint = app_data.get_move_hint(rooms)
+            app_data.moved = False
+            app_data.suggested = False
+    elif app_data.game_state.current_turn == app_data.character and app_data.next_action == Actions.MOVE and app_data.moved:
+        app_data.next_action = Actions.SUGGEST
 
         rooms.clear()
-        room = APP.app_data.game_state.whereabouts[APP.app_data.character]
+        room = app_data.game_state.whereabouts[app_data.character]
         if "Hallway" not in room:
             rooms.append(room)
         else:
             # Players shouldn't be allowed to move to make a suggestion from hallway
             rooms = []
-    elif APP.app_data.game_state.current_turn == APP.app_data.character and APP.app_data.next_action == Actions.SUGGEST and APP.app_data.suggested:
-        APP.app_data.next_action = Actions.ACCUSE
-        while APP.app_data.accuse_request is None:
-            sleep(1)
+    elif app_data.game_state.current_turn == app_data.character and app_data.next_action == Actions.SUGGEST and app_data.suggested:
+        waiting = not app_data.updates.wait_for(
+            lambda: app_data.accuse_request is not None, PAGE_WAIT)
+        if not waiting:
+            app_data.next_action = Actions.ACCUSE
 
     return render_template('game.html',
                            characters=list(game_const.CHARACTERS),
                            weapons=list(game_const.WEAPONS),
                            rooms=rooms,
+                           move_hint=move_hint,
                            room_layout=list(game_const.ROOMS_LAYOUT),
-                           suggestion=APP.app_data.suggestion,
-                           character=APP.app_data.character,
-                           game_state=APP.app_data.game_state,
-                           turn=APP.app_data.current_turn,
-                           continue_game=APP.app_data.continue_game,
+                           suggestion=app_data.suggestion,
+                           character=app_data.character,
+                           game_state=app_data.game_state,
+                           turn=app_data.current_turn,
+                           continue_game=app_data.continue_game,
                            action_options=Actions,
-                           next_action=APP.app_data.next_action,
-                           accuse_results=APP.app_data.accuse_results,
-                           suggest_results=APP.app_data.suggest_results)
+                           next_action=app_data.next_action,
+                           waiting=waiting,
+                           version=version,
+                           accuse_results=app_data.accuse_results,
+                           suggest_results=app_data.suggest_results)
 
 
 @APP.route('/submit', methods=['POST'])
 def accuse():
+    app_data = get_session()
+    if not app_data:
+        return redirect(url_for('main'))
 
     # Player suggests character/weapon/room
     suspect = request.form.get('character')
@@ -188,233 +423,303 @@ def accuse():
     room = request.form.get('room')
 
     if request.form['submit'] == "Make a Suggestion":
-        APP.app_data.suggest_response = messages.PlayerSuggestionResponse(
-            APP.app_data.game_id,
-            APP.app_data.client_id,
+        app_data.suggest_response = messages.PlayerSuggestionResponse(
+            app_data.game_id,
+            app_data.client_id,
             suspect,
             weapon,
             room
         )
 
-        APP.app_data.suggested = True
+        app_data.suggested = True
 
         # Once player made a suggestion, continue_game becomes True to display their next move
         # They can either make an accusation or make a move
-        APP.app_data.suggestion = False
-        APP.app_data.continue_game = True
+        app_data.suggestion = False
+        app_data.continue_game = True
 
     elif request.form['submit'] == "Make an Accusation":
 
-        APP.app_data.accuse_response = messages.PlayerAccusationResponse(
-            APP.app_data.game_id,
-            APP.app_data.client_id,
+        app_data.accuse_response = messages.PlayerAccusationResponse(
+            app_data.game_id,
+            app_data.client_id,
             suspect,
             weapon,
             room
 
         )
 
-        logging.info("Accuse Response %s", APP.app_data.accuse_response)
-
-        APP.app_data.continue_game = False
-        APP.app_data.suggestion = True
+        logging.info("Accuse Response %s", app_data.accuse_response)
 
-        while APP.app_data.move_request:
-            time.sleep(1)
+        app_data.continue_game = False
+        app_data.suggestion = True
 
-        APP.app_data.accused = True
+        app_data.accused = True
 
     elif request.form['submit'] == "Make a Move":
 
-        APP.app_data.move_response = messages.PlayerMoveResponse(
-            APP.app_data.game_id,
-            APP.app_data.client_id,
+        app_data.move_response = messages.PlayerMoveResponse(
+            app_data.game_id,
+            app_data.client_id,
             room
         )
 
-        APP.app_data.continue_game = False
-        APP.app_data.suggestion = True
-
-        while APP.app_data.move_request:
-            time.sleep(1)
+        app_data.continue_game = False
+        app_data.suggestion = True
 
-        APP.app_data.moved = True
+        app_data.moved = True
 
     elif request.form['submit'] == "Skip":
-        if APP.app_data.next_action == Actions.MOVE:
-            APP.app_data.move_response = messages.PlayerMoveResponse(
-                APP.app_data.game_id,
-                APP.app_data.client_id,
+        if app_data.next_action == Actions.MOVE:
+            app_data.move_response = messages.PlayerMoveResponse(
+                app_data.game_id,
+                app_data.client_id,
                 None
             )
-            APP.app_data.moved = True
-        elif APP.app_data.next_action == Actions.SUGGEST:
-            APP.app_data.suggest_response = messages.PlayerSuggestionResponse(
-                APP.app_data.game_id,
-                APP.app_data.client_id,
+            app_data.moved = True
+        elif app_data.next_action == Actions.SUGGEST:
+            app_data.suggest_response = messages.PlayerSuggestionResponse(
+                app_data.game_id,
+                app_data.client_id,
                 None,
                 None,
                 None
             )
-            APP.app_data.suggested = True
-        elif APP.app_data.next_action == Actions.ACCUSE:
-            APP.app_data.accuse_response = messages.PlayerAccusationResponse(
-                APP.app_data.game_id,
-                APP.app_data.client_id,
+            app_data.suggested = True
+        elif app_data.next_action == Actions.ACCUSE:
+            app_data.accuse_response = messages.PlayerAccusationResponse(
+                app_data.game_id,
+                app_data.client_id,
                 None,
                 None,
                 None
             )
-            APP.app_data.accused = True
-
-    time.sleep(1)
-
-    return redirect(url_for('game', game_id=APP.app_data.game_id))
-
-
-@APP.route('/api/game_state', methods=['GET'])
-def api_game_state():
-    logging.info('Received api_game_state Request: %s',
-                 request.args)
-    game_state = messages.GameStateRequest.from_dict(
-        request.args.to_dict(flat=False))
+            app_data.accused = True
+
+    # Hand the response to the waiting /api handler, then give the server
+    # a moment to act on it before re-rendering
+    version = app_data.updates.notify()
+    app_data.updates.wait_for_change(version, PAGE_WAIT)
+
+    return redirect(url_for('game', game_id=app_data.game_id))
+
+
+@APP.route('/events')
+def events():
+    """Server-sent events, long-polled: at most one change per request.
+
+    Each request waits up to EVENT_WAIT for a change and then ends, with
+    the event if there was one. The EventSource reconnects on its own.
+    """
+    app_data = get_session()
+    if not app_data:
+        return Response(status=204)  # Tells the EventSource not to reconnect
+
+    # A reconnecting EventSource sends the last id it saw, and a new one the
+    # version its page was rendered at, so changes made before it connected
+    # are sent right away
+    version = request.headers.get('Last-Event-ID',
+                                  request.args.get('version', ''))
+    version = (int(version) if version.isdigit()
+               else app_data.updates.version)
+    if app_data.client_id and not app_data.game_state.game_id:
+        # Still in the server's lobby, which drops players it doesn't hear from
+        app_data.server.send_player_count_request()
+    latest = app_data.updates.wait_for_change(version, EVENT_WAIT)
+    if app_data.evicted:
+        return Response(status=204)
+    body = f'retry: {EVENT_RETRY}\n\n'
+    if latest != version:
+        body += f'id: {latest}\ndata: {latest}\n\n'
+    return Response(body, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+# The handlers of the server's messages, shared by the /api routes and the
+# socket transport. Each takes the decoded message and returns the response.
+
+def on_game_state(game_state: messages.GameStateRequest) -> Dict:
     logging.info('Parsed Request: %s', game_state)
-    APP.app_data.game_state = game_state
-    APP.app_data.player_deck = game_state.player_cards
-    APP.app_data.game_id = game_state.game_id[0]
-    APP.next_action = Actions.WAIT
-    response = {'ack': True}
-    # logging.info('Sending Response: %s', response)
-    return jsonify(response)
-
-
-@APP.route('/api/suggest', methods=['GET'])
-def api_suggest():
-    logging.info('Received api_suggest Request: %s', request.args)
-    suggest_request = messages.PlayerSuggestionRequest.from_dict(
-        request.args.to_dict(flat=False))
+    app_data = get_client_session(game_state)
+    if not app_data:
+        return {'ack': False}
+    app_data.game_state = game_state
+    app_data.player_deck = game_state.player_cards
+    if app_data.knowledge is None or app_data.game_id != game_state.game_id:
+        # Whereabouts are in seat order, the order suggestions go around in
+        app_data.knowledge = Knowledge(app_data.character,
+                                       list(game_state.whereabouts),
+                                       game_state.player_cards)
+    app_data.knowledge.current_turn = game_state.current_turn
+    app_data.game_id = game_state.game_id
+    app_data.updates.notify()
+    return {'ack': True}
+
+
+def on_suggest(suggest_request: messages.PlayerSuggestionRequest) -> Dict:
     logging.info('Parsed Request: %s', suggest_request)
-    APP.app_data.suggest_request = suggest_request
-    APP.next_action = Actions.SUGGEST
+    skip = messages.PlayerSuggestionResponse(suggest_request.game_id,
+                                             suggest_request.client_id)
+    app_data = get_client_session(suggest_request)
+    if not app_data:
+        return skip.to_dict()
+    app_data.suggest_request = suggest_request
+    app_data.updates.notify()
 
     if DEBUG:
-        time.sleep(2)
-        weapons, suspects, rooms = APP.strategize_options(suggest_request.weapons,
-                                                          suggest_request.suspects,
-                                                          suggest_request.rooms)
-        logging.info('Weapons: %s, Suspects: %s, Rooms: %s',
-                     weapons, suspects, rooms)
-
-        response = messages.PlayerSuggestionResponse(game_id=APP.app_data.game_id,
-                                                     client_id=APP.app_data.client_id,
-                                                     room=APP.app_data.suggest_request.rooms,
-                                                     suspect=APP.app_data.suggest_request.suspects,
-                                                     weapon=APP.app_data.suggest_request.weapons)
+        (suspect, weapon, room), probability = app_data.best_solution(
+            suggest_request.weapons, suggest_request.suspects,
+            suggest_request.rooms)
+        logging.info('Suggesting %s, %s, %s at %.2f',
+                     suspect, weapon, room, probability)
+
+        response = messages.PlayerSuggestionResponse(game_id=app_data.game_id,
+                                                     client_id=app_data.client_id,
+                                                     room=room,
+                                                     suspect=suspect,
+                                                     weapon=weapon)
         logging.info('Sending Automated DEBUG Response: %s', response)
-        return jsonify(response.to_dict())
+        return response.to_dict()
 
-    while not APP.app_data.suggest_response:
-        time.sleep(1)
-    response = APP.app_data.suggest_response
-    APP.app_data.suggest_response = None
+    response = app_data.take_response('suggest_response', skip)
     logging.info('Sending Player Response: %s', response)
-    return jsonify(response.to_dict())
+    return response.to_dict()
 
 
-@APP.route('/api/player_move', methods=['GET'])
-def api_player_move():
-    # logging.info('Received api_player_move Request: %s', request.args)
-    move_request = messages.PlayerMoveRequest.from_dict(
-        request.args.to_dict(flat=False))
+def on_player_move(move_request: messages.PlayerMoveRequest) -> Dict:
     logging.info('Parsed Request: %s', move_request)
-    # APP.move_request = move_request
-    APP.app_data.move_request = move_request
-    APP.next_action = Actions.MOVE
+    skip = messages.PlayerMoveResponse(move_request.game_id,
+                                       move_request.client_id)
+    app_data = get_client_session(move_request)
+    if not app_data:
+        return skip.to_dict()
+    app_data.move_request = move_request
+    app_data.updates.notify()
 
     if DEBUG:
-        time.sleep(1)
-        move_selection = random.choice(move_request.move_options)
-        response = messages.PlayerMoveResponse(game_id=APP.app_data.game_id,
-                                               client_id=APP.app_data.client_id,
+        move_selection = (app_data.get_move_hint(move_request.move_options)
+                          or random.choice(move_request.move_options))
+        response = messages.PlayerMoveResponse(game_id=app_data.game_id,
+                                               client_id=app_data.client_id,
                                                move=move_selection)
 
         logging.info('Sending Automated DEBUG Response: %s', response)
-        return jsonify(response.to_dict())
+        return response.to_dict()
 
-    while not APP.app_data.move_response:
-        time.sleep(1)
+    response = app_data.take_response('move_response', skip)
 
-    APP.app_data.move_request = None
+    app_data.move_request = None
+    app_data.updates.notify()
 
-    response = APP.app_data.move_response
-    APP.app_data.move_response = None
     logging.info('Sending Player Response: %s', response)
-    return jsonify(response.to_dict())
+    return response.to_dict()
 
 
-@APP.route('/api/suggest_result', methods=['GET'])
-def api_suggest_result():
-    # logging.info('Received api_suggest_result Request: %s', request.args)
-    suggest_results = messages.PlayerSuggestionResult.from_dict(
-        request.args.to_dict(flat=False))
+def on_suggest_result(suggest_results: messages.PlayerSuggestionResult) -> Dict:
     logging.info('Parsing suggest results: %s', suggest_results)
-    APP.app_data.suggest_results = suggest_results
-    if suggest_results.disproved_card[0]:
-        APP.app_data.seen_cards.append(suggest_results.disproved_card[0])
-    logging.info(APP.app_data.seen_cards)
-    APP.next_action = Actions.WAIT
-    response = {'ack': True}
-    # logging.info('Sending Response: %s', response)
-    return jsonify(response)
-
-
-@APP.route('/api/accuse', methods=['GET'])
-def api_accuse():
-    # logging.info('Received api_accuse Request: %s', request.args)
-    accuse_request = messages.PlayerAccusationRequest.from_dict(
-        request.args.to_dict(flat=False))
+    app_data = get_client_session(suggest_results)
+    if not app_data:
+        return {'ack': False}
+    app_data.suggest_results = suggest_results
+    if suggest_results.disproved_card:
+        app_data.seen_cards.append(suggest_results.disproved_card)
+    logging.info(app_data.seen_cards)
+    if app_data.knowledge:
+        app_data.knowledge.on_suggestion_result(suggest_results)
+    app_data.updates.notify()
+    return {'ack': True}
+
+
+def on_accuse(accuse_request: messages.PlayerAccusationRequest) -> Dict:
     logging.info('Parsed Request: %s', accuse_request)
-    APP.app_data.accuse_request = accuse_request
-    APP.app_data.next_action = Actions.ACCUSE
+    skip = messages.PlayerAccusationResponse(accuse_request.game_id,
+                                             accuse_request.client_id)
+    app_data = get_client_session(accuse_request)
+    if not app_data:
+        return skip.to_dict()
+    app_data.accuse_request = accuse_request
+    app_data.next_action = Actions.ACCUSE
+    app_data.updates.notify()
 
     if DEBUG:
-        time.sleep(2)
-        weapons, suspects, rooms = APP.strategize_options(accuse_request.weapons,
-                                                          accuse_request.suspects,
-                                                          accuse_request.rooms)
-        logging.info('Weapons: %s, Suspects: %s, Rooms: %s',
-                     weapons, suspects, rooms)
-
-        response = messages.PlayerAccusationResponse(game_id=APP.app_data.game_id,
-                                                     client_id=APP.app_data.client_id,
-                                                     room=APP.app_data.suggest_request.rooms,
-                                                     suspect=APP.app_data.suggest_request.suspects,
-                                                     weapon=APP.app_data.suggest_request.weapons)
+        (suspect, weapon, room), probability = app_data.best_solution(
+            accuse_request.weapons, accuse_request.suspects,
+            accuse_request.rooms)
+        logging.info('Best accusation %s, %s, %s at %.2f',
+                     suspect, weapon, room, probability)
+
+        response = skip
+        if probability >= ACCUSE_CONFIDENCE:
+            response = messages.PlayerAccusationResponse(game_id=app_data.game_id,
+                                                         client_id=app_data.client_id,
+                                                         room=room,
+                                                         suspect=suspect,
+                                                         weapon=weapon)
         logging.info('Sending Automated DEBUG Response: %s', response)
-        return jsonify(response.to_dict())
+        return response.to_dict()
 
-    while not APP.app_data.accuse_response:
-        time.sleep(1)
+    response = app_data.take_response('accuse_response', skip)
 
-    APP.app_data.accuse_request = None
+    app_data.accuse_request = None
+    app_data.updates.notify()
 
-    response = APP.app_data.accuse_response
-    APP.app_data.accuse_response = None
     logging.info('Sending Player Response: %s', response)
-    return jsonify(response.to_dict())
+    return response.to_dict()
 
 
-@APP.route('/api/accuse_result', methods=['GET'])
-def api_accuse_result():
-    # logging.info('Received api_accuse_result Request: %s', request.args)
-    accuse_results = messages.PlayerAccusationResult.from_dict(
-        request.args.to_dict(flat=False))
+def on_accuse_result(accuse_results: messages.PlayerAccusationResult) -> Dict:
     logging.info('Parsed Request: %s', accuse_results)
-    APP.app_data.accuse_results = _clean_accuse_results(accuse_results)
-    APP.next_action = Actions.WAIT
-    response = {'ack': True}
-    # logging.info('Sending Response: %s', response)
-    return jsonify(response)
+    app_data = get_client_session(accuse_results)
+    if not app_data:
+        return {'ack': False}
+    app_data.accuse_results = accuse_results
+    app_data.updates.notify()
+    return {'ack': True}
+
+
+# route -> (the message it carries, its handler)
+API_HANDLERS = {
+    client_boundary.GAME_STATE_ROUTE: (messages.GameStateRequest, on_game_state),
+    client_boundary.SUGGESTION_ROUTE: (messages.PlayerSuggestionRequest, on_suggest),
+    client_boundary.PLAYER_MOVE_ROUTE: (messages.PlayerMoveRequest, on_player_move),
+    client_boundary.SUGGESTION_RESULT_ROUTE: (messages.PlayerSuggestionResult,
+                                              on_suggest_result),
+    client_boundary.ACCUSATION_ROUTE: (messages.PlayerAccusationRequest, on_accuse),
+    client_boundary.ACCUSATION_RESULT_ROUTE: (messages.PlayerAccusationResult,
+                                              on_accuse_result),
+}
+
+
+@APP.route('/api/game_state', methods=['POST'])
+def api_game_state():
+    return send_message(on_game_state(read_message(messages.GameStateRequest)))
+
+
+@APP.route('/api/suggest', methods=['POST'])
+def api_suggest():
+    return send_message(on_suggest(read_message(messages.PlayerSuggestionRequest)))
+
+
+@APP.route('/api/player_move', methods=['POST'])
+def api_player_move():
+    return send_message(on_player_move(read_message(messages.PlayerMoveRequest)))
+
+
+@APP.route('/api/suggest_result', methods=['POST'])
+def api_suggest_result():
+    return send_message(
+        on_suggest_result(read_message(messages.PlayerSuggestionResult)))
+
+
+@APP.route('/api/accuse', methods=['POST'])
+def api_accuse():
+    return send_message(on_accuse(read_message(messages.PlayerAccusationRequest)))
+
+
+@APP.route('/api/accuse_result', methods=['POST'])
+def api_accuse_result():
+    return send_message(
+        on_accuse_result(read_message(messages.PlayerAccusationResult)))
 
 
 @APP.template_filter('card_url')
@@ -465,16 +770,18 @@ def card_url(card_text):
         return ""
 
 
-def _clean_accuse_results(accuse_results):
-    accuse_results.correct = accuse_results.correct[0] == 'True'
-    accuse_results.weapon = accuse_results.weapon[0]
-    accuse_results.suspect = accuse_results.suspect[0]
-    accuse_results.room = accuse_results.room[0]
-    return accuse_results
+def dispatch_frame(route: str, message: Dict) -> Dict:
+    """Answers a socket frame with the same handler as its /api route."""
+    message_class, handler = API_HANDLERS[route]
+    return handler(message_class.from_dict(message))
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     APP.config.update(PROPAGATE_EXCEPTIONS=True)
+    # Only in the reloader's child, which is the process that serves
+    if SOCKET_PORT and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        serve_sockets(dispatch_frame, '0.0.0.0', int(SOCKET_PORT),
+                      content_type=HTTP_TRANSPORT.content_type)
     APP.run(debug=True, host='0.0.0.0')
     APP.secret_key == u'yolo'
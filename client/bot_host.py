@@ -0,0 +1,218 @@
+import argparse
+import logging
+import os
+import time
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional
+
+from flask import Flask, request
+
+from core import bots
+from core import client_boundary
+from core import game_const
+from core import messages
+from core import wire
+from core.client_boundary import ACK
+from core.metrics import METRICS
+from core.server_boundary import Server
+from core.transport import HttpTransport, serve_sockets
+
+SERVER_IP = os.environ.get('SERVER_IP')
+SERVER_PORT = os.environ.get('SERVER_PORT')
+# The server calls players back on this port, so it must match its CLIENT_PORT
+PORT = int(os.environ.get('PORT', 5000))
+# Set to also answer the server's messages over a persistent socket
+SOCKET_PORT = os.environ.get('SOCKET_PORT')
+
+# Pooled connections to the server
+HTTP_TRANSPORT = HttpTransport(
+    pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10)),
+    keep_alive=os.environ.get('HTTP_KEEP_ALIVE', 'true') == 'true',
+    content_type=wire.CONTENT_TYPE)
+
+# Tables kept running at once, players at each, and the policies they play
+# (cycled through the seats of a table)
+TABLES = int(os.environ.get('BOT_TABLES', 1))
+TABLE_SIZE = int(os.environ.get('BOT_TABLE_SIZE', 6))
+POLICIES = os.environ.get('BOT_POLICIES', 'deduction').split(',')
+# Games to play before exiting, 0 to keep the tables full forever
+GAMES = int(os.environ.get('BOT_GAMES', 0))
+# Seconds a table's game can go without calling any seat before it's given
+# up on (the server failed, killed or archived it without a winner)
+TABLE_IDLE_TIMEOUT = float(os.environ.get('BOT_TABLE_IDLE_TIMEOUT', 120))
+
+# The message each server callback carries, by route
+ROUTE_MESSAGES = {
+    client_boundary.GAME_STATE_ROUTE: messages.GameStateRequest,
+    client_boundary.PLAYER_MOVE_ROUTE: messages.PlayerMoveRequest,
+    client_boundary.SUGGESTION_ROUTE: messages.PlayerSuggestionRequest,
+    client_boundary.SUGGESTION_RESULT_ROUTE: messages.PlayerSuggestionResult,
+    client_boundary.ACCUSATION_ROUTE: messages.PlayerAccusationRequest,
+    client_boundary.ACCUSATION_RESULT_ROUTE: messages.PlayerAccusationResult,
+}
+
+
+class Table(object):
+    """The bot seats joined to one game, and whether that game is over."""
+
+    def __init__(self, seats: List[Server]):
+        self.seats = seats
+        self.game_id = ''
+        self.finished = Event()
+        # When the server last called one of the seats
+        self.last_heard = time.time()
+        self._wrong_accusations = 0
+        self._lock = Lock()
+
+    def on_accusation_result(self, result: messages.PlayerAccusationResult) -> None:
+        # Every seat hears every accusation, so only count the first seat's
+        if result.client_id != self.seats[0].client_id or not result.suspect:
+            return
+        with self._lock:
+            if not result.correct:
+                self._wrong_accusations += 1
+            if result.correct or self._wrong_accusations >= len(self.seats):
+                self.finished.set()
+
+
+class BotHost(object):
+    """Plays many bot seats on the server from one process.
+
+    Each seat joins the server like a client app would and gets its own
+    BotPolicy (and so its own Knowledge). The server calls every seat back
+    on this process, and handle routes each callback to its seat's
+    PolicyHandler by client_id.
+    """
+
+    def __init__(self, server_address: str, server_port: Optional[int] = None,
+                 policies: List[str] = POLICIES, table_size: int = TABLE_SIZE,
+                 idle_timeout: float = TABLE_IDLE_TIMEOUT):
+        self._server_address = server_address
+        self._server_port = server_port
+        self._policies = policies
+        self._table_size = table_size
+        self._idle_timeout = idle_timeout
+        self._lock = Lock()
+        self._handlers: Dict[str, bots.PolicyHandler] = {}
+        self._tables: Dict[str, Table] = {}
+        # Set whenever a table's game ends, so run can refill it right away
+        self._table_finished = Event()
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def add_table(self) -> Table:
+        """Joins a table's worth of seats, then asks the server for their game."""
+        table = Table([])
+        for index, player_name in enumerate(
+                game_const.CHARACTERS[:self._table_size]):
+            seat = Server(self._server_address, self._server_port,
+                          transport=HTTP_TRANSPORT)
+            policy_name = self._policies[index % len(self._policies)]
+            policy = bots.POLICIES[policy_name](player_name)
+            seat.send_join_request(player_name)
+            table.seats.append(seat)
+            with self._lock:
+                self._handlers[seat.client_id] = bots.PolicyHandler(policy)
+                self._tables[seat.client_id] = table
+        table.game_id = table.seats[-1].send_start_game_request().game_id
+        if not table.game_id:
+            logging.warning('Server did not start a game for %d seats',
+                            len(table.seats))
+            self.remove_table(table)
+            table.finished.set()
+        else:
+            METRICS.increment('bot_host.games')
+            logging.info('Started game %s with %d bots', table.game_id,
+                         len(table.seats))
+        return table
+
+    def remove_table(self, table: Table) -> None:
+        with self._lock:
+            for seat in table.seats:
+                self._handlers.pop(seat.client_id, None)
+                self._tables.pop(seat.client_id, None)
+
+    def handle(self, route: str, message: Dict) -> Dict:
+        """Answers a server callback for any seat, as a socket frame handler."""
+        message_class = ROUTE_MESSAGES.get(route)
+        client_id = message.get('client_id')
+        with self._lock:
+            handler = self._handlers.get(client_id)
+            table = self._tables.get(client_id)
+        if not message_class or not handler:
+            METRICS.increment('bot_host.unknown')
+            logging.warning('No bot seat for %s on %s', client_id, route)
+            return {'game_id': message.get('game_id', ''),
+                    'client_id': client_id, ACK: False}
+        parsed = message_class.from_dict(message)
+        METRICS.increment('bot_host.requests')
+        table.last_heard = time.time()
+        if route == client_boundary.ACCUSATION_RESULT_ROUTE:
+            table.on_accusation_result(parsed)
+            if table.finished.is_set():
+                self._table_finished.set()
+        return handler(route, parsed)
+
+    def run(self, tables: int = TABLES, games: int = GAMES) -> None:
+        """Keeps tables games going, until games have been started (0 forever)."""
+        started = 0
+        running: List[Table] = []
+        while not games or started < games or running:
+            while len(running) < tables and (not games or started < games):
+                running.append(self.add_table())
+                started += 1
+            self._table_finished.wait(1)
+            self._table_finished.clear()
+            self._finish_idle_tables(running)
+            for table in [table for table in running if table.finished.is_set()]:
+                running.remove(table)
+                self.remove_table(table)
+            METRICS.set_gauge('bot_host.seats', len(self))
+
+    def _finish_idle_tables(self, tables: List[Table]) -> None:
+        """Finishes the tables whose game ended without a correct accusation."""
+        idle_since = time.time() - self._idle_timeout
+        for table in tables:
+            if not table.finished.is_set() and table.last_heard < idle_since:
+                logging.warning('Game %s has not called its seats in %ds, '
+                                'giving up on it', table.game_id,
+                                self._idle_timeout)
+                METRICS.increment('bot_host.idle_tables')
+                table.finished.set()
+
+
+HOST = BotHost(SERVER_IP, SERVER_PORT)
+APP = Flask(__name__)
+APP.register_error_handler(wire.WireError, wire.on_wire_error)
+
+
+@APP.route('/api/<path:route>', methods=['POST'])
+def api(route: str):
+    message = wire.decode(request.get_data(), request.content_type)
+    return wire.send_message(HOST.handle(f'api/{route}', message))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Plays many Clue-Less bot seats on a server from one process')
+    parser.add_argument('--tables', type=int, default=TABLES,
+                        help='Games kept running at once')
+    parser.add_argument('--games', type=int, default=GAMES,
+                        help='Games to play before exiting, 0 to never stop')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if SOCKET_PORT:
+        serve_sockets(HOST.handle, '0.0.0.0', int(SOCKET_PORT),
+                      content_type=HTTP_TRANSPORT.content_type)
+    # The server's callbacks are answered while run fills the tables
+    server = Thread(target=APP.run, name='bot-host',
+                    kwargs={'host': '0.0.0.0', 'port': PORT, 'threaded': True},
+                    daemon=True)
+    server.start()
+    HOST.run(args.tables, args.games)
+
+
+if __name__ == '__main__':
+    main()
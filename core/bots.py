@@ -0,0 +1,220 @@
+from typing import Any, Dict, List, Optional, Set
+import random
+
+from core import client_boundary
+from core import messages
+from core import solver
+from core.client_boundary import Client, ACK
+from core.deduction import Knowledge
+from core.planner import PLANNER
+from core.transport import LocalTransport
+
+
+class BotPolicy(object):
+    """Decides a bot's moves, suggestions and accusations.
+
+    Subclass this and override the choose_* methods to change how a bot
+    plays, and the on_* methods to learn from what the server broadcasts.
+    """
+    name = 'base'
+
+    def __init__(self, player_name: str, rng: Optional[random.Random] = None):
+        self.player_name = player_name
+        self.rng = rng or random.Random()
+
+    def on_game_state(self, game_state: messages.GameStateRequest) -> None:
+        pass
+
+    def on_suggestion_result(self, result: messages.PlayerSuggestionResult) -> None:
+        pass
+
+    def on_accusation_result(self, result: messages.PlayerAccusationResult) -> None:
+        pass
+
+    def choose_move(self, request: messages.PlayerMoveRequest) -> str:
+        return self.rng.choice(request.move_options)
+
+    def choose_suggestion(self, request: messages.PlayerSuggestionRequest):
+        """Returns a (suspect, weapon, room) tuple, or None to skip."""
+        return (self.rng.choice(request.suspects),
+                self.rng.choice(request.weapons),
+                self.rng.choice(request.rooms))
+
+    def choose_accusation(self, request: messages.PlayerAccusationRequest):
+        """Returns a (suspect, weapon, room) tuple, or None to skip."""
+        return None
+
+
+class RandomPolicy(BotPolicy):
+    """Moves and suggests at random, and occasionally accuses at random."""
+    name = 'random'
+    accuse_chance = 0.02
+
+    def choose_accusation(self, request: messages.PlayerAccusationRequest):
+        if self.rng.random() >= self.accuse_chance:
+            return None
+        return (self.rng.choice(request.suspects),
+                self.rng.choice(request.weapons),
+                self.rng.choice(request.rooms))
+
+
+class EliminationPolicy(BotPolicy):
+    """Rules out its own hand and every card it's shown, accuses when sure."""
+    name = 'elimination'
+
+    def __init__(self, player_name: str, rng: Optional[random.Random] = None):
+        super().__init__(player_name, rng)
+        self.seen_cards: Set[str] = set()
+
+    def on_game_state(self, game_state: messages.GameStateRequest) -> None:
+        self.seen_cards.update(game_state.player_cards or [])
+
+    def on_suggestion_result(self, result: messages.PlayerSuggestionResult) -> None:
+        if result.disproved_card:
+            self.seen_cards.add(result.disproved_card)
+
+    def choose_suggestion(self, request: messages.PlayerSuggestionRequest):
+        return (self._pick(request.suspects),
+                self._pick(request.weapons),
+                self._pick(request.rooms))
+
+    def choose_accusation(self, request: messages.PlayerAccusationRequest):
+        suspects = self._unseen(request.suspects)
+        weapons = self._unseen(request.weapons)
+        rooms = self._unseen(request.rooms)
+        if len(suspects) == len(weapons) == len(rooms) == 1:
+            return suspects[0], weapons[0], rooms[0]
+        return None
+
+    def _unseen(self, options: List[str]) -> List[str]:
+        return [option for option in options if option not in self.seen_cards]
+
+    def _pick(self, options: List[str]) -> str:
+        return self.rng.choice(self._unseen(options) or options)
+
+
+class DeductionPolicy(BotPolicy):
+    """Deduces from every suggestion result with a Knowledge matrix."""
+    name = 'deduction'
+
+    def __init__(self, player_name: str, rng: Optional[random.Random] = None):
+        super().__init__(player_name, rng)
+        self.knowledge: Optional[Knowledge] = None
+        self.whereabouts: Dict[str, str] = {}
+
+    def on_game_state(self, game_state: messages.GameStateRequest) -> None:
+        self.whereabouts = dict(game_state.whereabouts or {})
+        if self.knowledge is None and game_state.whereabouts:
+            # Whereabouts are in seat order, the order cards are dealt and
+            # suggestions are disproved in
+            self.knowledge = Knowledge(self.player_name,
+                                       list(game_state.whereabouts),
+                                       game_state.player_cards or [])
+        if self.knowledge:
+            self.knowledge.current_turn = game_state.current_turn
+
+    def on_suggestion_result(self, result: messages.PlayerSuggestionResult) -> None:
+        if self.knowledge:
+            self.knowledge.on_suggestion_result(result)
+
+    def choose_move(self, request: messages.PlayerMoveRequest) -> str:
+        """Heads for the nearest room that could still be the murder room."""
+        room_name = self.whereabouts.get(self.player_name)
+        if not self.knowledge or not room_name:
+            return super().choose_move(request)
+        _, _, rooms = self.knowledge.get_candidates()
+        occupied = [room for name, room in self.whereabouts.items()
+                    if name != self.player_name]
+        move = PLANNER.plan_move(room_name, rooms, occupied)
+        if move not in request.move_options:
+            return super().choose_move(request)
+        return move
+
+    def choose_suggestion(self, request: messages.PlayerSuggestionRequest):
+        if not self.knowledge:
+            return super().choose_suggestion(request)
+        weapons, suspects, rooms = self.knowledge.narrow_options(
+            request.weapons, request.suspects, request.rooms)
+        return (self.rng.choice(suspects), self.rng.choice(weapons),
+                self.rng.choice(rooms))
+
+    def choose_accusation(self, request: messages.PlayerAccusationRequest):
+        return self.knowledge.get_solution() if self.knowledge else None
+
+
+class SolverPolicy(DeductionPolicy):
+    """Suggests the likeliest murder, and accuses once it's likely enough."""
+    name = 'solver'
+
+    def __init__(self, player_name: str, rng: Optional[random.Random] = None,
+                 budget: float = solver.SAMPLE_BUDGET,
+                 confidence: float = 0.9):
+        super().__init__(player_name, rng)
+        self.budget = budget
+        self.confidence = confidence
+
+    def _best_solution(self, request):
+        probabilities = solver.estimate_solutions(self.knowledge, self.budget)
+        return solver.get_best_solution(probabilities, request.suspects,
+                                        request.weapons, request.rooms)
+
+    def choose_suggestion(self, request: messages.PlayerSuggestionRequest):
+        if not self.knowledge:
+            return super().choose_suggestion(request)
+        best, _ = self._best_solution(request)
+        return best or super().choose_suggestion(request)
+
+    def choose_accusation(self, request: messages.PlayerAccusationRequest):
+        if not self.knowledge:
+            return None
+        best, probability = self._best_solution(request)
+        return best if probability >= self.confidence else None
+
+
+POLICIES = {policy.name: policy
+            for policy in (RandomPolicy, EliminationPolicy, DeductionPolicy,
+                           SolverPolicy)}
+
+
+class PolicyHandler(object):
+    """Answers Game requests with a BotPolicy, as a LocalTransport handler."""
+
+    def __init__(self, policy: BotPolicy):
+        self.policy = policy
+
+    def __call__(self, route: str, request: messages.Message) -> Dict[str, Any]:
+        policy = self.policy
+        if route == client_boundary.GAME_STATE_ROUTE:
+            policy.on_game_state(request)
+        elif route == client_boundary.SUGGESTION_RESULT_ROUTE:
+            policy.on_suggestion_result(request)
+        elif route == client_boundary.ACCUSATION_RESULT_ROUTE:
+            policy.on_accusation_result(request)
+        elif route == client_boundary.PLAYER_MOVE_ROUTE:
+            return {'game_id': request.game_id, 'client_id': request.client_id,
+                    'move': policy.choose_move(request)}
+        elif route == client_boundary.SUGGESTION_ROUTE:
+            return _get_choice(request, policy.choose_suggestion(request))
+        elif route == client_boundary.ACCUSATION_ROUTE:
+            return _get_choice(request, policy.choose_accusation(request))
+        return {ACK: True}
+
+
+def _get_choice(request: messages.Message, choice) -> Dict[str, Any]:
+    response = {'game_id': request.game_id, 'client_id': request.client_id}
+    if choice:
+        response.update(zip(('suspect', 'weapon', 'room'), choice))
+    return response
+
+
+class BotClient(Client):
+    """A Client whose player is a BotPolicy in this process.
+
+    It talks over a LocalTransport, so there's no network or encoding and
+    games run as fast as the engine allows.
+    """
+
+    def __init__(self, player_name: str, policy: BotPolicy, game_id: str = ''):
+        super().__init__(player_name, address='bot', game_id=game_id,
+                         transport=LocalTransport(PolicyHandler(policy)))
+        self.policy = policy
@@ -0,0 +1,61 @@
+# Process-wide, immutable game pieces shared by every Game.
+# The board topology and the cards never change, so they're built once at
+# import, and each Game only keeps its own positions, hands and murder deck.
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+
+from core import game_const
+from core.game_const import format_hallway_name
+from core.game_pieces import Board, Card, CardType, Room, RoomType
+
+WEAPON_CARDS: Tuple[Card, ...] = tuple(
+    Card(name, CardType.WEAPON) for name in game_const.WEAPONS)
+CHARACTER_CARDS: Tuple[Card, ...] = tuple(
+    Card(name, CardType.CHARACTER) for name in game_const.CHARACTERS)
+ROOM_CARDS: Tuple[Card, ...] = tuple(
+    Card(name, CardType.ROOM) for name in game_const.ROOMS)
+CARDS: Tuple[Card, ...] = WEAPON_CARDS + CHARACTER_CARDS + ROOM_CARDS
+
+_CARDS_BY_NAME: Dict[str, Card] = {card.name: card for card in CARDS}
+# A set of cards (e.g. a hand) is an int with bit (1 << index) set per card
+_CARD_BITS: Dict[str, int] = {card.name: 1 << index
+                              for index, card in enumerate(CARDS)}
+
+
+def get_card(card_name: str) -> Optional[Card]:
+    """Returns the interned Card instance by name, if there is one."""
+    return _CARDS_BY_NAME.get(card_name)
+
+
+def get_card_bit(card: Card) -> int:
+    return _CARD_BITS[card.name]
+
+
+def get_cards_mask(cards: Iterable[Card]) -> int:
+    """Returns the bitset of a collection of cards."""
+    mask = 0
+    for card in cards:
+        mask |= _CARD_BITS[card.name]
+    return mask
+
+
+def _build_board() -> Board:
+    """Builds the Rooms and the Game Board from the static adjacency graph."""
+    # First build up a list of Room instances based on constants
+    rooms = []
+    rooms.extend([Room(name=room, type=RoomType.REGULAR)
+                  for room in game_const.ROOMS])
+    rooms.extend(
+        [Room(name=format_hallway_name(hallway), type=RoomType.HALLWAY)
+         for hallway in game_const.HALLWAYS])
+
+    logging.info('Setting up the game Board...')
+    edges = []
+    for hallway in game_const.HALLWAYS:
+        for adjacent_room in hallway:
+            edges.append((adjacent_room, format_hallway_name(hallway)))
+    edges.extend(game_const.SECRET_PASSAGES)
+    return Board(rooms=rooms, edges=edges)
+
+
+BOARD: Board = _build_board()
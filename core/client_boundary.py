@@ -1,15 +1,16 @@
 from typing import Dict, List, Any, Tuple, Optional
 import logging
+import time
 import uuid
 
-import requests
-
 from core.game_const import format_hallway_name
 from core.game_pieces import Player, Card, CardType, Room, Board
 from core.messages import GameStateRequest
 from core.messages import PlayerMoveRequest, PlayerMoveResponse
 from core.messages import PlayerSuggestionRequest, PlayerSuggestionResponse, PlayerSuggestionResult
 from core.messages import PlayerAccusationRequest, PlayerAccusationResponse, PlayerAccusationResult
+from core.metrics import METRICS
+from core.transport import DEFAULT_TRANSPORT, DISCONNECT_ERRORS, REMOTE_ERRORS, Transport
 
 ACK = 'ack'
 
@@ -20,6 +21,23 @@ SUGGESTION_RESULT_ROUTE = 'api/suggest_result'
 ACCUSATION_ROUTE = 'api/accuse'
 ACCUSATION_RESULT_ROUTE = 'api/accuse_result'
 
+# The requests a player has to decide on, the rest only need an ack
+TURN_ROUTES = (PLAYER_MOVE_ROUTE, SUGGESTION_ROUTE, ACCUSATION_ROUTE)
+# Seconds a player gets to answer each request before it's skipped for them
+TURN_TIMEOUT = 120
+ACK_TIMEOUT = 10
+PHASE_TIMEOUTS = {
+    GAME_STATE_ROUTE: ACK_TIMEOUT,
+    PLAYER_MOVE_ROUTE: TURN_TIMEOUT,
+    SUGGESTION_ROUTE: TURN_TIMEOUT,
+    SUGGESTION_RESULT_ROUTE: ACK_TIMEOUT,
+    ACCUSATION_ROUTE: TURN_TIMEOUT,
+    ACCUSATION_RESULT_ROUTE: ACK_TIMEOUT,
+}
+# Seconds a disconnected player is still asked to take their turns. After
+# that they're skipped without asking, until a request gets through again
+RECONNECT_GRACE = 60
+
 
 def _sort_cards(cards: List[Card]) -> Tuple[List[str], List[str], List[str]]:
     # Sort the cards by type, so that we can abstract that for the client
@@ -34,16 +52,52 @@ def _sort_cards(cards: List[Card]) -> Tuple[List[str], List[str], List[str]]:
 
 
 class Client(object):
-    """A boundary object that represents the Client connection."""
+    """A boundary object that represents the Client connection.
+
+    A request the player doesn't answer within its phase's timeout, or
+    that fails, gets the default response (a skip, or no ack) so the game
+    carries on, and marks the client disconnected until one succeeds.
+    """
 
     def __init__(self, player_name: str,
                  address: str, port: Optional[int] = None,
-                 game_id: str = ''):
+                 game_id: str = '',
+                 transport: Transport = DEFAULT_TRANSPORT,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 reconnect_grace: float = RECONNECT_GRACE):
         self.player_name = player_name
         self.game_id = game_id
         self.address = address
         self._port = port
+        self._transport = transport
+        self._timeouts = dict(PHASE_TIMEOUTS, **(timeouts or {}))
+        self._reconnect_grace = reconnect_grace
         self.client_id = str(uuid.uuid4())
+        # When the client stopped answering (time.time()), None if it answers
+        self.disconnected_since: Optional[float] = None
+
+    @property
+    def is_remote(self) -> bool:
+        """Whether messages to this client go over the network."""
+        return self._transport.is_remote
+
+    @property
+    def connected(self) -> bool:
+        return self.disconnected_since is None
+
+    def mark_connected(self) -> None:
+        """Clears the disconnected marker, e.g. once the client is heard from."""
+        if self.disconnected_since is not None:
+            logging.info('%s reconnected after %.1fs', self.player_name,
+                         time.time() - self.disconnected_since)
+            METRICS.increment('client.reconnected')
+            self.disconnected_since = None
+
+    def mark_disconnected(self) -> None:
+        if self.disconnected_since is None:
+            logging.warning('%s is disconnected', self.player_name)
+            METRICS.increment('client.disconnected')
+            self.disconnected_since = time.time()
 
     def get_game_state(self, players: List[Player],
                         active_player: Player):
@@ -68,110 +122,243 @@ class Client(object):
             route=GAME_STATE_ROUTE, request=request)
         return response[ACK]
 
+    async def send_game_state_async(self, players: List[Player],
+                                    active_player: Player) -> bool:
+        logging.info('Sending Game State to %s', self.player_name)
+        request = self.get_game_state(players, active_player)
+        response = await self._post_request_async(
+            route=GAME_STATE_ROUTE, request=request)
+        return response[ACK]
+
     def send_move_request(self, valid_moves: List[Room]) -> Optional[Room]:
         logging.info('Sending Move Request to %s', self.player_name)
-        request = PlayerMoveRequest(
-            game_id=self.game_id,
-            client_id=self.client_id,
-            move_options=[room.name for room in valid_moves]
-        )
+        request = self._get_move_request(valid_moves)
         response = self._post_request(route=PLAYER_MOVE_ROUTE, request=request)
-        player_move = PlayerMoveResponse.from_dict(response)
-        move_room = next((room for room in valid_moves
-                          if room.name == player_move.move), None)
-        return move_room
+        return _parse_move_response(valid_moves, response)
+
+    async def send_move_request_async(self, valid_moves: List[Room]) -> Optional[Room]:
+        logging.info('Sending Move Request to %s', self.player_name)
+        request = self._get_move_request(valid_moves)
+        response = await self._post_request_async(route=PLAYER_MOVE_ROUTE,
+                                                  request=request)
+        return _parse_move_response(valid_moves, response)
 
     def send_suggestion_request(self, cards: List[Card]) -> List[Card]:
         logging.info('Sending Suggestion Request to %s', self.player_name)
-        suspect_cards, weapon_cards, room_cards = _sort_cards(cards)
-        logging.info('Sorted Cards: %s', _sort_cards(cards))
-        request = PlayerSuggestionRequest(game_id=self.game_id,
-                                          client_id=self.client_id,
-                                          suspects=suspect_cards,
-                                          weapons=weapon_cards,
-                                          rooms=room_cards)
+        request = self._get_suggestion_request(cards)
         response = self._post_request(route=SUGGESTION_ROUTE, request=request)
-        player_suggestion = PlayerSuggestionResponse.from_dict(response)
-        suggestion_cards = [card for card in cards
-                            if card.name == player_suggestion.weapon
-                            or card.name == player_suggestion.room
-                            or card.name == player_suggestion.suspect]
-        return suggestion_cards
+        return _parse_suggestion_response(cards, response)
+
+    async def send_suggestion_request_async(self, cards: List[Card]) -> List[Card]:
+        logging.info('Sending Suggestion Request to %s', self.player_name)
+        request = self._get_suggestion_request(cards)
+        response = await self._post_request_async(route=SUGGESTION_ROUTE,
+                                                  request=request)
+        return _parse_suggestion_response(cards, response)
 
     def send_suggestion_result(self, suggestion: List[Card],
                                disproved_by: Optional[Player],
                                disproved_card: Optional[Card],
                                suggested_by: Optional[str]):
         logging.info('Sending Suggestion Results to %s', self.player_name)
-        # logging.info('Suspects: %s, Weapons: %s, Rooms: %s',
-        #              suspect_cards, weapon_cards, room_cards)
-        suspect_cards, weapon_cards, room_cards = _sort_cards(suggestion)
-        request = PlayerSuggestionResult(
-            game_id=self.game_id,
-            client_id=self.client_id,
-            suspect=next(iter(suspect_cards), ''),
-            weapon=next(iter(weapon_cards), ''),
-            room=next(iter(room_cards), ''))
-        # Suggestion was not disproved
-        if not disproved_by:
-            logging.info('Suggestion not Disproved!')
-            response = self._post_request(
-                route=SUGGESTION_RESULT_ROUTE, request=request)
-            return response[ACK]
-
-        request = PlayerSuggestionResult(game_id=self.game_id,
-                                         client_id=self.client_id,
-                                         disproved_by=disproved_by.name,
-                                         disproved_card=disproved_card.name,
-                                         suggested_by=suggested_by,
-                                         suspect=suspect_cards[0],
-                                         weapon=weapon_cards[0],
-                                         room=room_cards[0])
+        request = self._get_suggestion_result(suggestion, disproved_by,
+                                              disproved_card, suggested_by)
         response = self._post_request(route=SUGGESTION_RESULT_ROUTE,
                                       request=request)
         return response[ACK]
 
+    async def send_suggestion_result_async(self, suggestion: List[Card],
+                                           disproved_by: Optional[Player],
+                                           disproved_card: Optional[Card],
+                                           suggested_by: Optional[str]):
+        logging.info('Sending Suggestion Results to %s', self.player_name)
+        request = self._get_suggestion_result(suggestion, disproved_by,
+                                              disproved_card, suggested_by)
+        response = await self._post_request_async(route=SUGGESTION_RESULT_ROUTE,
+                                                  request=request)
+        return response[ACK]
+
     def send_accusation_request(self, cards: List[Card]) -> List[Card]:
         logging.info('Sending Accusation Request to %s', self.player_name)
-        suspect_cards, weapon_cards, room_cards = _sort_cards(cards)
-        request = PlayerAccusationRequest(
-            game_id=self.game_id,
-            client_id=self.client_id,
-            suspects=suspect_cards,
-            weapons=weapon_cards,
-            rooms=room_cards)
+        request = self._get_accusation_request(cards)
         response = self._post_request(route=ACCUSATION_ROUTE, request=request)
-        player_accusation = PlayerAccusationResponse.from_dict(response)
-        if not player_accusation:
-            return []
-        accusation_cards = [card for card in cards
-                            if card.name == player_accusation.weapon
-                            or card.name == player_accusation.room
-                            or card.name == player_accusation.suspect]
-        return accusation_cards
+        return _parse_accusation_response(cards, response)
+
+    async def send_accusation_request_async(self, cards: List[Card]) -> List[Card]:
+        logging.info('Sending Accusation Request to %s', self.player_name)
+        request = self._get_accusation_request(cards)
+        response = await self._post_request_async(route=ACCUSATION_ROUTE,
+                                                  request=request)
+        return _parse_accusation_response(cards, response)
 
     def send_accusation_result(self, correct: bool,
                                murder_deck: List[Card]) -> bool:
         logging.info('Sending Accusation Results to %s', self.player_name)
-        suspect_cards, weapon_cards, room_cards = _sort_cards(murder_deck)
-        request = PlayerAccusationResult(game_id=self.game_id,
-                                         client_id=self.client_id,
-                                         correct=correct,
-                                         suspect=next(iter(suspect_cards), ''),
-                                         weapon=next(iter(weapon_cards), ''),
-                                         room=next(iter(room_cards), ''))
+        request = self._get_accusation_result(correct, murder_deck)
         response = self._post_request(route=ACCUSATION_RESULT_ROUTE,
                                       request=request)
         return response[ACK]
 
+    async def send_accusation_result_async(self, correct: bool,
+                                           murder_deck: List[Card]) -> bool:
+        logging.info('Sending Accusation Results to %s', self.player_name)
+        request = self._get_accusation_result(correct, murder_deck)
+        response = await self._post_request_async(route=ACCUSATION_RESULT_ROUTE,
+                                                  request=request)
+        return response[ACK]
+
+    def _get_move_request(self, valid_moves: List[Room]) -> PlayerMoveRequest:
+        return PlayerMoveRequest(
+            game_id=self.game_id,
+            client_id=self.client_id,
+            move_options=[room.name for room in valid_moves]
+        )
+
+    def _get_suggestion_request(self, cards: List[Card]) -> PlayerSuggestionRequest:
+        suspect_cards, weapon_cards, room_cards = _sort_cards(cards)
+        logging.info('Sorted Cards: %s', (suspect_cards, weapon_cards, room_cards))
+        return PlayerSuggestionRequest(game_id=self.game_id,
+                                       client_id=self.client_id,
+                                       suspects=suspect_cards,
+                                       weapons=weapon_cards,
+                                       rooms=room_cards)
+
+    def _get_suggestion_result(self, suggestion: List[Card],
+                               disproved_by: Optional[Player],
+                               disproved_card: Optional[Card],
+                               suggested_by: Optional[str]) -> PlayerSuggestionResult:
+        suspect_cards, weapon_cards, room_cards = _sort_cards(suggestion)
+        # Suggestion was not disproved
+        if not disproved_by:
+            logging.info('Suggestion not Disproved!')
+            return PlayerSuggestionResult(
+                game_id=self.game_id,
+                client_id=self.client_id,
+                suspect=next(iter(suspect_cards), ''),
+                weapon=next(iter(weapon_cards), ''),
+                room=next(iter(room_cards), ''))
+
+        return PlayerSuggestionResult(game_id=self.game_id,
+                                      client_id=self.client_id,
+                                      disproved_by=disproved_by.name,
+                                      disproved_card=(disproved_card.name
+                                                      if disproved_card else ''),
+                                      suggested_by=suggested_by,
+                                      suspect=suspect_cards[0],
+                                      weapon=weapon_cards[0],
+                                      room=room_cards[0])
+
+    def _get_accusation_request(self, cards: List[Card]) -> PlayerAccusationRequest:
+        suspect_cards, weapon_cards, room_cards = _sort_cards(cards)
+        return PlayerAccusationRequest(
+            game_id=self.game_id,
+            client_id=self.client_id,
+            suspects=suspect_cards,
+            weapons=weapon_cards,
+            rooms=room_cards)
+
+    def _get_accusation_result(self, correct: bool,
+                               murder_deck: List[Card]) -> PlayerAccusationResult:
+        suspect_cards, weapon_cards, room_cards = _sort_cards(murder_deck)
+        return PlayerAccusationResult(game_id=self.game_id,
+                                      client_id=self.client_id,
+                                      correct=correct,
+                                      suspect=next(iter(suspect_cards), ''),
+                                      weapon=next(iter(weapon_cards), ''),
+                                      room=next(iter(room_cards), ''))
+
+    def _get_address(self) -> str:
+        return f'{self.address}:{self._port}' if self._port else self.address
+
+    def _is_gone(self, route: str) -> bool:
+        """Whether to skip a turn without asking, the grace period is over."""
+        return (route in TURN_ROUTES and self.disconnected_since is not None
+                and time.time() - self.disconnected_since > self._reconnect_grace)
+
+    def _on_request_failed(self, route: str, request, error: Exception) -> Dict[str, Any]:
+        logging.warning('No %s response from %s: %r',
+                        route, self.player_name, error)
+        METRICS.increment(f'client.failed.{route}')
+        self.mark_disconnected()
+        return _get_default_response(request)
+
+    def _on_request_rejected(self, route: str, request, error: Exception) -> Dict[str, Any]:
+        # The client is there, so it isn't disconnected, it just skips this one
+        logging.warning('Bad %s response from %s: %r',
+                        route, self.player_name, error)
+        METRICS.increment(f'client.rejected.{route}')
+        return _get_default_response(request)
+
     def _post_request(self, route, request) -> Dict[str, Any]:
-        port = f':{self._port}' if self._port else ''
-        url = f'http://{self.address}{port}/{route}'
-        # This sends the request to the client and blocks till we get a response
-        # TODO(ahammer): Add a timeout here and declare the client disconnected
-        # TODO(ahammer): Do literally ANY error handling here
-        logging.info('Sending request to %s', url)
-        logging.info('Contents: %s', request.to_dict())
-        response = requests.get(url, params=request.to_dict())
-        # logging.info('Response: %s', response.__dict__)
-        return response.json()
\ No newline at end of file
+        address = self._get_address()
+        if self._is_gone(route):
+            METRICS.increment(f'client.skipped.{route}')
+            return _get_default_response(request)
+        # This sends the request to the client and blocks till we get a
+        # response, or the phase's timeout
+        logging.info('Sending request to %s/%s', address, route)
+        logging.info('Contents: %s', request)
+        try:
+            response = self._transport.request(address, route, request,
+                                               self._timeouts.get(route))
+        except DISCONNECT_ERRORS as error:
+            return self._on_request_failed(route, request, error)
+        except REMOTE_ERRORS as error:
+            return self._on_request_rejected(route, request, error)
+        self.mark_connected()
+        return response
+
+    async def _post_request_async(self, route, request) -> Dict[str, Any]:
+        address = self._get_address()
+        if self._is_gone(route):
+            METRICS.increment(f'client.skipped.{route}')
+            return _get_default_response(request)
+        # Same as _post_request, but yields to the event loop while we wait
+        logging.info('Sending request to %s/%s', address, route)
+        logging.info('Contents: %s', request)
+        try:
+            response = await self._transport.request_async(
+                address, route, request, self._timeouts.get(route))
+        except DISCONNECT_ERRORS as error:
+            return self._on_request_failed(route, request, error)
+        except REMOTE_ERRORS as error:
+            return self._on_request_rejected(route, request, error)
+        self.mark_connected()
+        return response
+
+
+def _get_default_response(request) -> Dict[str, Any]:
+    """What a player that didn't answer says: skip the phase, or no ack."""
+    return {'game_id': request.game_id, 'client_id': request.client_id,
+            ACK: False}
+
+
+def _parse_move_response(valid_moves: List[Room],
+                         response: Dict[str, Any]) -> Optional[Room]:
+    player_move = PlayerMoveResponse.from_dict(response)
+    move_room = next((room for room in valid_moves
+                      if room.name == player_move.move), None)
+    return move_room
+
+
+def _parse_suggestion_response(cards: List[Card],
+                               response: Dict[str, Any]) -> List[Card]:
+    player_suggestion = PlayerSuggestionResponse.from_dict(response)
+    suggestion_cards = [card for card in cards
+                        if card.name == player_suggestion.weapon
+                        or card.name == player_suggestion.room
+                        or card.name == player_suggestion.suspect]
+    return suggestion_cards
+
+
+def _parse_accusation_response(cards: List[Card],
+                               response: Dict[str, Any]) -> List[Card]:
+    player_accusation = PlayerAccusationResponse.from_dict(response)
+    if not player_accusation:
+        return []
+    accusation_cards = [card for card in cards
+                        if card.name == player_accusation.weapon
+                        or card.name == player_accusation.room
+                        or card.name == player_accusation.suspect]
+    return accusation_cards
+
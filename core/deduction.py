@@ -0,0 +1,168 @@
+# Card deduction for a single player, from everything the server broadcasts.
+from typing import Iterable, List, Optional, Tuple
+
+from core import catalog
+from core.messages import PlayerSuggestionResult
+
+ALL_CARDS = catalog.get_cards_mask(catalog.CARDS)
+CHARACTERS_MASK = catalog.get_cards_mask(catalog.CHARACTER_CARDS)
+WEAPONS_MASK = catalog.get_cards_mask(catalog.WEAPON_CARDS)
+ROOMS_MASK = catalog.get_cards_mask(catalog.ROOM_CARDS)
+TYPE_MASKS = (CHARACTERS_MASK, WEAPONS_MASK, ROOMS_MASK)
+# Cards dealt to the players, the rest go to the murder deck
+DEALT_CARDS = len(catalog.CARDS) - len(TYPE_MASKS)
+
+
+def get_bit(card_name: str) -> int:
+    return catalog.get_card_bit(catalog.get_card(card_name))
+
+
+def get_names(mask: int, cards: Iterable = catalog.CARDS) -> List[str]:
+    """Returns the names of the cards in a bitset, in catalog order."""
+    return [card.name for card in cards if mask & catalog.get_card_bit(card)]
+
+
+def get_hand_sizes(player_count: int) -> List[int]:
+    """Returns each seat's hand size, the cards are dealt round-robin."""
+    size, extra = divmod(DEALT_CARDS, player_count)
+    return [size + (seat < extra) for seat in range(player_count)]
+
+
+class Knowledge(object):
+    """What one player can deduce about who holds each card.
+
+    Every owner (each player in seat order, then the murder deck) has a
+    bitset of the cards it's known to hold and of those it's known not to
+    hold. Each suggestion result adds facts (who showed a card, who
+    couldn't) and is propagated right away, so get_candidates is always
+    current and never has to re-derive anything.
+    """
+
+    def __init__(self, player_name: str, players: List[str],
+                 hand: Iterable[str]):
+        self.player_name = player_name
+        self.players = list(players)
+        # The player whose suggestion the next result is for, if it
+        # doesn't say (the server only names the suggester when disproved)
+        self.current_turn = ''
+        self.envelope = len(self.players)
+        owners = len(self.players) + 1
+        self.has = [0] * owners
+        self.lacks = [0] * owners
+        self.sizes = get_hand_sizes(len(self.players)) + [len(TYPE_MASKS)]
+        # (owner, cards): the owner holds at least one of the cards
+        self.clauses: List[Tuple[int, int]] = []
+
+        seat = self.players.index(player_name)
+        hand_mask = 0
+        for card_name in hand:
+            hand_mask |= get_bit(card_name)
+        self.has[seat] = hand_mask
+        self.lacks[seat] = ALL_CARDS & ~hand_mask
+        self._propagate()
+
+    def get_seat(self, player_name: str) -> int:
+        return self.players.index(player_name)
+
+    def on_card_shown(self, player_name: str, card_name: str) -> None:
+        self.has[self.get_seat(player_name)] |= get_bit(card_name)
+        self._propagate()
+
+    def on_suggestion_result(self, result: PlayerSuggestionResult) -> None:
+        if not result.suspect:
+            return  # The suggestion was skipped
+        cards = (get_bit(result.suspect) | get_bit(result.weapon)
+                 | get_bit(result.room))
+        suggested_by = result.suggested_by or self.current_turn
+        suggester = (self.get_seat(suggested_by)
+                     if suggested_by in self.players else None)
+        if result.disproved_by:
+            disprover = self.get_seat(result.disproved_by)
+            if result.disproved_card:
+                self.has[disprover] |= get_bit(result.disproved_card)
+            else:
+                self.clauses.append((disprover, cards))
+        else:
+            disprover = suggester
+        # Everyone asked before the disprover couldn't show any of the cards
+        if suggester is not None:
+            seat = (suggester + 1) % len(self.players)
+            while seat != disprover and seat != suggester:
+                self.lacks[seat] |= cards
+                seat = (seat + 1) % len(self.players)
+        self._propagate()
+
+    def get_candidates(self) -> Tuple[List[str], List[str], List[str]]:
+        """Returns the (suspects, weapons, rooms) that could be the murder."""
+        possible = ALL_CARDS & ~self.lacks[self.envelope]
+        return (get_names(possible, catalog.CHARACTER_CARDS),
+                get_names(possible, catalog.WEAPON_CARDS),
+                get_names(possible, catalog.ROOM_CARDS))
+
+    def get_solution(self) -> Optional[Tuple[str, str, str]]:
+        """Returns the (suspect, weapon, room) once it's certain."""
+        suspects, weapons, rooms = self.get_candidates()
+        if len(suspects) == len(weapons) == len(rooms) == 1:
+            return suspects[0], weapons[0], rooms[0]
+        return None
+
+    def narrow_options(self, weapons: List[str], suspects: List[str],
+                       rooms: List[str]) -> Tuple[List[str], List[str], List[str]]:
+        """Filters a request's options down to the possible murder cards.
+
+        Each list falls back to every option when none of them is possible.
+        """
+        possible = ALL_CARDS & ~self.lacks[self.envelope]
+        return tuple(
+            [option for option in options if get_bit(option) & possible]
+            or options
+            for options in (weapons, suspects, rooms))
+
+    def _propagate(self) -> None:
+        """Applies every rule until none of them learns anything new."""
+        has = self.has
+        lacks = self.lacks
+        sizes = self.sizes
+        owners = range(len(has))
+        envelope = self.envelope
+        while True:
+            before = (tuple(has), tuple(lacks), len(self.clauses))
+            # Each card has one owner: held by one means lacked by the rest,
+            # and lacked by all but one means held by that one
+            for owner in owners:
+                held_elsewhere = 0
+                lacked_elsewhere = ALL_CARDS
+                for other in owners:
+                    if other != owner:
+                        held_elsewhere |= has[other]
+                        lacked_elsewhere &= lacks[other]
+                lacks[owner] |= held_elsewhere
+                has[owner] |= lacked_elsewhere & ~lacks[owner]
+            # The murder deck holds exactly one card of each type
+            for type_mask in TYPE_MASKS:
+                if has[envelope] & type_mask:
+                    lacks[envelope] |= type_mask & ~has[envelope]
+                possible = type_mask & ~lacks[envelope]
+                if possible & (possible - 1) == 0:
+                    has[envelope] |= possible
+            # A full hand lacks everything else, and a hand with only as many
+            # possible cards as its size holds all of them
+            for owner in owners:
+                if bin(has[owner]).count('1') == sizes[owner]:
+                    lacks[owner] |= ALL_CARDS & ~has[owner]
+                possible = ALL_CARDS & ~lacks[owner]
+                if bin(possible).count('1') == sizes[owner]:
+                    has[owner] |= possible
+            # Drop satisfied clauses, and resolve those down to one card
+            clauses = []
+            for owner, cards in self.clauses:
+                if has[owner] & cards:
+                    continue
+                possible = cards & ~lacks[owner]
+                if possible & (possible - 1) == 0:
+                    has[owner] |= possible
+                else:
+                    clauses.append((owner, possible))
+            self.clauses = clauses
+            if before == (tuple(has), tuple(lacks), len(clauses)):
+                return
@@ -1,18 +1,40 @@
-from typing import List, Tuple, Dict, Optional
+from typing import Any, Awaitable, Callable, List, Tuple, Dict, Optional
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from enum import Enum
 from json import JSONEncoder
+from itertools import islice
+from threading import Condition, Lock
+import asyncio
 import random
 import logging
+import time
 import uuid
 
 import attr
-import networkx as nx
 
 from core.client_boundary import Client
+from core import catalog
 from core import game_const
 from core.messages import Message
 from core.game_pieces import CardType, Card, RoomType, Room, Board, Player
 from core.game_const import format_hallway_name
+from core.metrics import METRICS
+
+# Seconds to wait on each client's ack, from when its send starts, before
+# giving up on it. Clients also time their acks out (client_boundary's
+# ACK_TIMEOUT), so a send never holds a worker for much longer than this
+BROADCAST_TIMEOUT = 10
+# Shared by every game, so a broadcast costs the slowest client, not the sum.
+# Sends beyond this many queue, and their timeout only starts once they run
+BROADCAST_WORKERS = 64
+BROADCAST_EXECUTOR = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS,
+                                        thread_name_prefix='broadcast')
+# Most state changes a game keeps for clients catching up with get_changes
+CHANGE_LOG_SIZE = 256
+
+# Persists a game's events: (game_id, sequence, event_type, data)
+EventSink = Callable[[str, int, str, Dict[str, Any]], Any]
 
 # Module-level helper functions
 
@@ -21,65 +43,176 @@ class GameEncoder(JSONEncoder):
     def default(self, obj):  # pylint: disable=E0202
         if isinstance(obj, (CardType, RoomType)):
             return str(obj)
-        if isinstance(obj, (Card, Player, Room, Message)):
+        if isinstance(obj, (Message,)):
+            return obj.to_dict()
+        if isinstance(obj, (Card, Player, Room)):
             return attr.asdict(obj)
         if isinstance(obj, (Board,)):
             return obj._rooms_dict
         if isinstance(obj, (Client, Game)):
-            return obj.__dict__
+            # Skip private attributes (e.g. Locks, transports), they aren't JSON
+            return {key: value for key, value in obj.__dict__.items()
+                    if not key.startswith('_')}
         return JSONEncoder.default(self, obj)
 
+def _get_ack(phase: str, client: Client, future) -> bool:
+    if not future.done():
+        logging.warning('No %s ack from %s: timed out after %ss',
+                        phase, client.player_name, BROADCAST_TIMEOUT)
+        return False
+    if future.exception():
+        logging.warning('No %s ack from %s: %r',
+                        phase, client.player_name, future.exception())
+        return False
+    return future.result()
+
+
+def _get_shown_card(client: Client, disproved_by: Optional[Player],
+                    disproved_card: Optional[Card],
+                    suggested_by: Optional[str]) -> Optional[Card]:
+    """The disproving card, for the suggester and the disprover only."""
+    if client.player_name == suggested_by or (
+            disproved_by and client.player_name == disproved_by.name):
+        return disproved_card
+    return None
+
+
 class Game(object):
     """Class representing the game instance."""
 
-    def __init__(self, clients: List[Client]):
+    def __init__(self, clients: List[Client],
+                 event_log: Optional[EventSink] = None):
         """Initialize the Game, given a list of clients"""
         self.game_id = str(uuid.uuid4())
 
+        # Every event (public or not) is also handed to event_log, in order
+        self._event_log = event_log
+        self._event_count = 0
+
         self.clients = clients
         # Attaches the clients to the Game (for upstream client management)
         for client in self.clients:
             client.game_id = self.game_id
 
-        # First initialize the board, and the contained Room instances
-        self.board = self._init_board()
+        # The board and its Room instances are shared by every game
+        self.board = catalog.BOARD
 
         # Next initialize the list of players, and their start_room
         self.players = self._init_players(
             [client.player_name for client in clients])
+        self._players_by_name = {player.name: player for player in self.players}
+        self._clients_by_name = {client.player_name: client
+                                 for client in self.clients}
+        # Players in each room (by board index), and the bitmask of occupied rooms
+        self._room_counts = [0] * len(self.board.rooms)
+        self._occupied = 0
+        for player in self.players:
+            self._enter_room(player.room)
 
         # Now deal the cards to the murder_deck, and to each player
         self.murder_deck = []
-        self.cards = []
+        self.cards = catalog.CARDS
+        # Filled in by _deal_cards: card name -> owner's index in self.players
+        self._card_owners: Dict[str, int] = {}
         self._deal_cards()
 
         self.turn = 0
         self.result = ''
 
+        # Bumped on every state change (move, turn, suggestion, accusation),
+        # so clients can ask for just the changes since the version they have.
+        # Starts at 1, clients use 0 for 'no state yet'
+        self.version = 1
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self._changed = Condition()
+
+        self._log_event('deal', {
+            'murder_deck': [card.name for card in self.murder_deck],
+            'hands': {player.name: [card.name for card in player.cards]
+                      for player in self.players}})
+
+        # Each game serializes its own turns, so games don't block each other
+        self._lock = Lock()
+        self.paused = False
+        self.killed = False
+
+    @property
+    def lock(self) -> Lock:
+        """The Lock held while this game takes a turn."""
+        return self._lock
+
+    def pause(self) -> None:
+        """Stops this game from being scheduled once the current turn finishes."""
+        self.paused = True
+
+    def resume(self) -> None:
+        """Lets a paused game be scheduled again."""
+        self.paused = False
+
+    def kill(self) -> None:
+        """Ends this game before its next turn."""
+        self.killed = True
+
     @property
     def active_player(self) -> Player:
         # Modulo the turn index so the active player auto-loops
         return self.players[self.turn % len(self.players)]
 
     def get_player(self, player_name: str) -> Player:
-        return next((player for player in self.players
-                     if player.name == player_name), None)
+        return self._players_by_name.get(player_name)
 
     @property
     def active_client(self) -> Client:
         return self.get_client(self.active_player.name)
 
     def get_client(self, player_name: str) -> Client:
-        return next((client for client in self.clients
-                     if client.player_name == player_name), None)
+        return self._clients_by_name.get(player_name)
 
     def get_card(self, card_name: str) -> Card:
-        return next((card for card in self.cards
-                     if card.name == card_name), None)
+        return catalog.get_card(card_name)
+
+    def get_changes(self, version: int) -> Tuple[int, Optional[List[Dict[str, Any]]]]:
+        """Returns the current version, and the changes made since version.
+
+        The changes are None if version has already fallen off the change
+        log, and the caller needs to fetch the full state instead.
+        """
+        with self._changed:
+            if version >= self.version:
+                return self.version, []
+            if not self._changes or self._changes[0]['version'] > version + 1:
+                return self.version, None
+            start = version + 1 - self._changes[0]['version']
+            return self.version, list(islice(self._changes, start, None))
+
+    def wait_for_changes(self, version: int, timeout: Optional[float] = None
+                         ) -> Tuple[int, Optional[List[Dict[str, Any]]]]:
+        """Same as get_changes, but first blocks until there are some."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.version > version or self.killed, timeout)
+            return self.get_changes(version)
+
+    def _record_change(self, change_type: str, **change) -> None:
+        """Appends a change to the log, and wakes anyone waiting on one."""
+        with self._changed:
+            self.version += 1
+            change.update(version=self.version, type=change_type)
+            self._changes.append(change)
+            self._changed.notify_all()
+        self._log_event(change_type, change)
+
+    def _log_event(self, event_type: str, data: Dict[str, Any]) -> None:
+        """Hands an event to the event log, if the game has one."""
+        if self._event_log is None:
+            return
+        self._event_count += 1
+        self._event_log(self.game_id, self._event_count, event_type, data)
 
     def take_turn(self) -> str:
         if not any(player.playing for player in self.players):
             self.result = 'No one'
+            self._record_change('result', winner=self.result)
             return
         if self.active_player.playing:
             # First send out a game update to all players
@@ -93,103 +226,281 @@ class Game(object):
             self._player_accuse()
         # Finally, increment turn
         self.turn += 1
+        self._record_change('turn', current_turn=self.active_player.name)
 
-    def _broadcast_game_status(self) -> None:
-        for client in self.clients:
-            client.send_game_state(self.players, self.active_player)
+    async def take_turn_async(self) -> str:
+        """Same as take_turn, but awaits the client I/O of each phase."""
+        if not any(player.playing for player in self.players):
+            self.result = 'No one'
+            self._record_change('result', winner=self.result)
+            return
+        if self.active_player.playing:
+            await self._broadcast_game_status_async()
+            logging.info('It is %s''s turn to go!', self.active_player.name)
+            await self._player_move_async()
+            await self._player_suggest_async()
+            await self._player_accuse_async()
+        self.turn += 1
+        self._record_change('turn', current_turn=self.active_player.name)
+
+    def _broadcast(self, phase: str,
+                   send: Callable[[Client], bool]) -> Dict[str, bool]:
+        """Calls send for every client in parallel, returns acks by player."""
+        acks = {}
+        # When each client's send was picked up by a worker
+        started: Dict[str, float] = {}
+
+        def timed_send(client: Client) -> bool:
+            started[client.client_id] = time.monotonic()
+            return send(client)
+
+        with METRICS.timer(f'broadcast.{phase}'):
+            futures = {BROADCAST_EXECUTOR.submit(timed_send, client): client
+                       for client in self.clients if client.is_remote}
+            # In-process clients answer immediately, no need for a thread
+            for client in self.clients:
+                if not client.is_remote:
+                    acks[client.player_name] = send(client)
+            pending = set(futures)
+            while pending:
+                # Sends still queued behind other games' keep their full
+                # timeout, so only those running for too long are given up
+                now = time.monotonic()
+                deadlines = [started.get(futures[future].client_id, now)
+                             + BROADCAST_TIMEOUT for future in pending]
+                if min(deadlines) <= now:
+                    pending = {future for future, deadline
+                               in zip(pending, deadlines) if deadline > now}
+                    continue
+                _, pending = wait(pending, timeout=min(deadlines) - now,
+                                  return_when=FIRST_COMPLETED)
+        for future, client in futures.items():
+            acks[client.player_name] = _get_ack(phase, client, future)
+        return acks
+
+    async def _broadcast_async(self, phase: str,
+                               send: Callable[[Client], Awaitable[bool]]) -> Dict[str, bool]:
+        """Awaits send for every client concurrently, returns acks by player."""
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(asyncio.wait_for(send(client), BROADCAST_TIMEOUT)
+              for client in self.clients),
+            return_exceptions=True)
+        METRICS.record_time(f'broadcast.{phase}', time.monotonic() - start)
+        acks = {}
+        for client, result in zip(self.clients, results):
+            if isinstance(result, Exception):
+                logging.warning('No %s ack from %s: %r',
+                                phase, client.player_name, result)
+                result = False
+            acks[client.player_name] = result
+        return acks
+
+    def _broadcast_game_status(self) -> Dict[str, bool]:
+        return self._broadcast('game_status', lambda client: client.send_game_state(
+            self.players, self.active_player))
+
+    async def _broadcast_game_status_async(self) -> Dict[str, bool]:
+        return await self._broadcast_async(
+            'game_status', lambda client: client.send_game_state_async(
+                self.players, self.active_player))
 
     def _broadcast_suggestion_results(self, suggestion: List[Card] = [],
                                       disproved_by: Optional[Player] = None,
                                       disproved_card: Optional[Card] = None,
-                                      suggested_by: Optional[str] = None) -> None:
-        for client in self.clients:
-            client.send_suggestion_result(suggestion,
-                                          disproved_by, disproved_card, suggested_by)
+                                      suggested_by: Optional[str] = None) -> Dict[str, bool]:
+        return self._broadcast(
+            'suggestion_results', lambda client: client.send_suggestion_result(
+                suggestion, disproved_by,
+                _get_shown_card(client, disproved_by, disproved_card, suggested_by),
+                suggested_by))
+
+    async def _broadcast_suggestion_results_async(self, suggestion: List[Card] = [],
+                                                  disproved_by: Optional[Player] = None,
+                                                  disproved_card: Optional[Card] = None,
+                                                  suggested_by: Optional[str] = None) -> Dict[str, bool]:
+        return await self._broadcast_async(
+            'suggestion_results', lambda client: client.send_suggestion_result_async(
+                suggestion, disproved_by,
+                _get_shown_card(client, disproved_by, disproved_card, suggested_by),
+                suggested_by))
 
     def _broadcast_accusation_results(self, accusation: List[Card],
-                                      correct: bool, ) -> None:
-        for client in self.clients:
-            client.send_accusation_result(accusation, correct)
+                                      correct: bool, ) -> Dict[str, bool]:
+        return self._broadcast(
+            'accusation_results', lambda client: client.send_accusation_result(
+                accusation, correct))
+
+    async def _broadcast_accusation_results_async(self, accusation: List[Card],
+                                                  correct: bool, ) -> Dict[str, bool]:
+        return await self._broadcast_async(
+            'accusation_results', lambda client: client.send_accusation_result_async(
+                accusation, correct))
 
     def _player_move(self) -> None:
-        current_room = self.active_player.room
-        adjacent_rooms = self.board.get_adj_rooms(current_room)
-        valid_rooms = [
-            room for room in adjacent_rooms
-            if self._is_valid_move(room)] + [current_room]
+        valid_rooms = self._get_valid_moves()
         new_room = self.active_client.send_move_request(valid_rooms)
+        self._move_active_player(new_room)
+
+    async def _player_move_async(self) -> None:
+        valid_rooms = self._get_valid_moves()
+        new_room = await self.active_client.send_move_request_async(valid_rooms)
+        self._move_active_player(new_room)
+
+    def _get_valid_moves(self) -> List[Room]:
+        current_room = self.active_player.room
+        # Adjacent rooms, minus the hallways someone is already standing in
+        blocked = self._occupied & self.board.hallway_mask
+        valid_mask = self.board.get_adj_mask(current_room) & ~blocked
+        return self.board.get_rooms(valid_mask) + [current_room]
+
+    def _move_active_player(self, new_room: Optional[Room]) -> None:
         if new_room:
-            self.active_player.room = new_room
+            self._move_player(self.active_player, new_room)
         # TODO(ahammer): Should probably handle 'null room' as an error
 
-    def _is_valid_move(self, room: Room) -> bool:
-        if room.type == RoomType.HALLWAY and self._is_room_occupied(room):
-            return False
-        return True
+    def _move_player(self, player: Player, new_room: Room) -> None:
+        """Moves a player, keeping the occupancy bitmask up to date.
 
-    def _is_room_occupied(self, room: Room) -> bool:
-        return any(player.room.name == room.name
-                   for player in self.players)
+        Always move players through here, rather than setting Player.room.
+        """
+        self._leave_room(player.room)
+        player.room = new_room
+        self._enter_room(new_room)
+        self._record_change('move', player=player.name, room=new_room.name)
+
+    def _enter_room(self, room: Room) -> None:
+        index = self.board.get_index(room)
+        self._room_counts[index] += 1
+        self._occupied |= 1 << index
+
+    def _leave_room(self, room: Room) -> None:
+        index = self.board.get_index(room)
+        self._room_counts[index] -= 1
+        if not self._room_counts[index]:
+            self._occupied &= ~(1 << index)
 
     def _player_suggest(self) -> None:
+        valid_cards = self._get_suggestion_options()
+        if not valid_cards:
+            self._broadcast_suggestion_results()
+            return
+        suggestion = self.active_client.send_suggestion_request(valid_cards)
+        self._broadcast_suggestion_results(*self._resolve_suggestion(suggestion))
+
+    async def _player_suggest_async(self) -> None:
+        valid_cards = self._get_suggestion_options()
+        if not valid_cards:
+            await self._broadcast_suggestion_results_async()
+            return
+        suggestion = await self.active_client.send_suggestion_request_async(
+            valid_cards)
+        await self._broadcast_suggestion_results_async(
+            *self._resolve_suggestion(suggestion))
+
+    def _get_suggestion_options(self) -> List[Card]:
         # You can only suggest based on the room you are in
         room_card = self.get_card(self.active_player.room.name)
         if not room_card:
             logging.info('%s cant make a Suggetion, not in a Room!',
                          self.active_player.name)
-            self._broadcast_suggestion_results()
-            return
+            return []
 
         # Request a suggestion, given valid options
         # Eliminate cards in your hand as valid options... since they cant be
         valid_cards = [card for card in self.cards
                        if card.type != CardType.ROOM] + [room_card]
         logging.info('Valid Cards for Suggestion: %s', valid_cards)
-        suggestion = self.active_client.send_suggestion_request(valid_cards)
+        return valid_cards
 
+    def _resolve_suggestion(self, suggestion: List[Card]) -> Tuple:
+        """Returns the _broadcast_suggestion_results args for a suggestion."""
         # If they didn't want to make a suggestion, exit
         if not suggestion:
-            self._broadcast_suggestion_results()
-            return
+            return ()
 
         # Move the suspect (if they're playing) to the accuser's room
         suspect_card = next((card for card in suggestion
                              if card.type == CardType.CHARACTER))
         suspect_player = self.get_player(suspect_card.name)
         if suspect_player:
-            suspect_player.room = self.active_player.room
-
-        # Loop through the players **IN ORDER** to see who can disprove the suggestion
-        for turn in range(self.turn + 1, self.turn + len(self.players)):
-            player_to_ask = self.players[turn % len(self.players)]
-            for card in suggestion:
-                if card in player_to_ask.cards:
-                    logging.info('DEBUG_SUG: player %s, card %s, from: %s', player_to_ask, card, self.active_client.player_name)
-                    self._broadcast_suggestion_results(
-                        suggestion, player_to_ask, card, self.active_client.player_name)
-                    return
+            self._move_player(suspect_player, self.active_player.room)
+
+        player_to_ask, disproved_card = self._find_disprover(suggestion)
+        # Everyone sees who disproved it, but not with which card
+        self._record_change('suggestion',
+                            suggested_by=self.active_player.name,
+                            suggestion=[card.name for card in suggestion],
+                            disproved_by=player_to_ask.name if player_to_ask else None)
+        if player_to_ask:
+            # Only the suggester and disprover see the card (see _get_shown_card),
+            # so it's not a public change
+            self._log_event('disproval', {'suggested_by': self.active_player.name,
+                                          'player': player_to_ask.name,
+                                          'card': disproved_card.name})
+            logging.info('DEBUG_SUG: player %s, card %s, from: %s', player_to_ask, disproved_card, self.active_client.player_name)
+            return (suggestion, player_to_ask, disproved_card,
+                    self.active_client.player_name)
 
         # If no one was able to disprove the suggestion, broadcast that
-        self._broadcast_suggestion_results(suggestion, None, None, None)
+        return (suggestion, None, None, None)
+
+    def _find_disprover(self, suggestion: List[Card]) -> Tuple[Optional[Player], Optional[Card]]:
+        """Returns the first player **IN ORDER** who can disprove, and the card.
+
+        Looks up each suggested card's owner, rather than walking the hand
+        of every player in turn.
+        """
+        player_count = len(self.players)
+        active_index = self.turn % player_count
+        disprover_index = None
+        disproved_card = None
+        distance = player_count
+        for card in suggestion:
+            owner_index = self._card_owners.get(card.name)
+            if owner_index is None or owner_index == active_index:
+                continue
+            owner_distance = (owner_index - active_index) % player_count
+            if owner_distance < distance:
+                distance = owner_distance
+                disprover_index = owner_index
+                disproved_card = card
+        if disprover_index is None:
+            return None, None
+        return self.players[disprover_index], disproved_card
 
     def _player_accuse(self):
         valid_cards = [card for card in self.cards]
         accusation = self.active_client.send_accusation_request(valid_cards)
+        correct = self._resolve_accusation(accusation)
+        self._broadcast_accusation_results(correct, accusation)
+
+    async def _player_accuse_async(self):
+        valid_cards = [card for card in self.cards]
+        accusation = await self.active_client.send_accusation_request_async(
+            valid_cards)
+        correct = self._resolve_accusation(accusation)
+        await self._broadcast_accusation_results_async(correct, accusation)
+
+    def _resolve_accusation(self, accusation: List[Card]) -> bool:
+        """Applies an accusation to the game, returns whether it was correct."""
         logging.info('Accusation from %s: ', accusation)
         if accusation:
-            if all(card in self.murder_deck for card in accusation):
+            correct = all(card in self.murder_deck for card in accusation)
+            if correct:
                 logging.info('Accusation Correct! %s Wins!',
                              self.active_player.name)
-                self._broadcast_accusation_results(True, accusation)
                 self.result = self.active_player.name
-                return
-            logging.info('Accusation Incorrect! %s is OUT!',
-                         self.active_player)
-            self._broadcast_accusation_results(False, accusation)
-            self.active_player.playing = False
-            return
+            else:
+                logging.info('Accusation Incorrect! %s is OUT!',
+                             self.active_player)
+                self.active_player.playing = False
+            self._record_change('accusation', player=self.active_player.name,
+                                accusation=[card.name for card in accusation],
+                                correct=correct)
+            return correct
         logging.info('%s made no suggestion.', self.active_player)
-        self._broadcast_accusation_results(False, accusation)
+        return False
 
     def _deal_cards(self):
         """Deals out the cards in the deck to start the game.
@@ -199,21 +510,17 @@ class Game(object):
           - Loops through Game.players and appends Card instances to the Player.card attribute
         """
 
-        # First Initialize the cards from constants)
+        # First copy the shared cards, so we can shuffle them
         logging.info('Shuffling the deck...')
-        weapons = [Card(name, CardType.WEAPON) for name in game_const.WEAPONS]
-        characters = [Card(name, CardType.CHARACTER)
-                      for name in game_const.CHARACTERS]
-        rooms = [Card(name, CardType.ROOM) for name in game_const.ROOMS]
+        weapons = list(catalog.WEAPON_CARDS)
+        characters = list(catalog.CHARACTER_CARDS)
+        rooms = list(catalog.ROOM_CARDS)
 
         # Shuffle each deck, and pop a random card for the murder deck
         random.shuffle(weapons)
         random.shuffle(characters)
         random.shuffle(rooms)
 
-        # These are all cards, we'll keep the seperate from the deal
-        self.cards = weapons + characters + rooms
-
         logging.info('Dealing out the Murder Deck...')
         weapon = weapons.pop()
         character = characters.pop()
@@ -225,32 +532,11 @@ class Game(object):
         logging.info('Dealing the cards to Players...')
         remaining_cards = weapons + characters + rooms
         random.shuffle(remaining_cards)
-        while len(remaining_cards) > 0:
-            for player in self.players:
-                player.cards.append(remaining_cards.pop())
-
-    def _init_board(self):
-        """Initializes the Rooms and the Game Board."""
-        # First build up a list of Room instances based on constants
-        rooms = []
-        rooms.extend([Room(name=room, type=RoomType.REGULAR)
-                      for room in game_const.ROOMS])
-        rooms.extend(
-            [Room(name=format_hallway_name(hallway), type=RoomType.HALLWAY)
-             for hallway in game_const.HALLWAYS])
-
-        logging.info('Setting up the game Board...')
-        # Then use the static adjacency graph to generate a Board and return it
-        board = Board(rooms=rooms)
-        for room in game_const.ROOMS:
-            board.add_node(room)
-        for hallway in game_const.HALLWAYS:
-            board.add_node(format_hallway_name(hallway))
-            for adjacent_room in hallway:
-                board.add_edge(adjacent_room, format_hallway_name(hallway))
-        for secret_passage in game_const.SECRET_PASSAGES:
-            board.add_edge(*secret_passage)
-        return board
+        # Round-robin, so uneven hands (4 or 5 players) don't run dry mid-loop
+        for index, card in enumerate(remaining_cards):
+            owner_index = index % len(self.players)
+            self.players[owner_index].cards.append(card)
+            self._card_owners[card.name] = owner_index
 
     def _init_players(self, player_names: List[str]):
         """Initializes the players in the Game."""
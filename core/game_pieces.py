@@ -1,7 +1,6 @@
 from enum import Enum
-from typing import List
+from typing import Dict, Iterable, List, Tuple
 
-import networkx as nx
 import attr
 
 
@@ -11,7 +10,7 @@ class CardType(Enum):
     CHARACTER = 3
 
 
-@attr.s(auto_attribs=True, slots=True)
+@attr.s(auto_attribs=True, slots=True, frozen=True)
 class Card(object):
     """Class representing a single card."""
     name: str
@@ -23,32 +22,82 @@ class RoomType(Enum):
     HALLWAY = 2
 
 
-@attr.s(auto_attribs=True, slots=True)
+@attr.s(auto_attribs=True, slots=True, frozen=True)
 class Room(object):
     """Class representing a room on the Game Board."""
     name: str
     type: RoomType
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(attr.asdict(self))
 
 
-class Board(nx.Graph):
-    """Subclass of a NetworkX Graph that adds Room Instance lookup."""
+class Board(object):
+    """The Game Board, with Room instance lookup and bitmask adjacency.
 
-    def __init__(self, *args, rooms: List[Room], **kwargs):
-        """Overloaded __init__ method adds _rooms_dict as a kwarg and stores it."""
-        super().__init__(*args, **kwargs)
-        self._rooms_dict = {room.name: room for room in rooms}
+    Each Room gets an index, and a set of Rooms is an int with bit
+    (1 << index) set for each one, so adjacency and occupancy checks are
+    single bit operations.
+    """
 
-    def get_adj_rooms(self, room: Room) -> List[Room]:
-        """Returns the list of adj Room instances"""
-        return [self._rooms_dict[adj_room] for adj_room in self.neighbors(room.name)]
+    def __init__(self, rooms: List[Room], edges: Iterable[Tuple[str, str]]):
+        self._rooms: Tuple[Room, ...] = tuple(rooms)
+        self._rooms_dict = {room.name: room for room in rooms}
+        self._index = {room.name: index for index, room in enumerate(rooms)}
+        self._edges = tuple(edges)
+
+        adj_masks = [0] * len(self._rooms)
+        for room_a, room_b in self._edges:
+            index_a, index_b = self._index[room_a], self._index[room_b]
+            adj_masks[index_a] |= 1 << index_b
+            adj_masks[index_b] |= 1 << index_a
+        self._adj_masks: Tuple[int, ...] = tuple(adj_masks)
+        self._adj_rooms: Tuple[Tuple[Room, ...], ...] = tuple(
+            tuple(self.get_rooms(mask)) for mask in self._adj_masks)
+        self.hallway_mask = sum(1 << index for index, room in enumerate(rooms)
+                                if room.type == RoomType.HALLWAY)
+
+    def get_index(self, room: Room) -> int:
+        """Returns the index of a room, its bit is (1 << index)."""
+        return self._index[room.name]
+
+    def get_bit(self, room: Room) -> int:
+        return 1 << self._index[room.name]
+
+    def get_adj_mask(self, room: Room) -> int:
+        """Returns the bitmask of the rooms adjacent to room."""
+        return self._adj_masks[self._index[room.name]]
+
+    def get_adj_rooms(self, room: Room) -> Tuple[Room, ...]:
+        """Returns the adj Room instances"""
+        return self._adj_rooms[self._index[room.name]]
+
+    def get_rooms(self, mask: int) -> List[Room]:
+        """Returns the Room instances whose bits are set in mask."""
+        rooms = []
+        while mask:
+            lowest_bit = mask & -mask
+            rooms.append(self._rooms[lowest_bit.bit_length() - 1])
+            mask ^= lowest_bit
+        return rooms
 
     def get_room(self, room_name: str) -> Room:
         """Return a room instance by name."""
         return self._rooms_dict[room_name]
 
+    @property
+    def rooms(self) -> Tuple[Room, ...]:
+        """All the Room instances, in index order."""
+        return self._rooms
+
+    def to_networkx(self):
+        """Builds a NetworkX Graph of the board, for visualization/debug only."""
+        import networkx as nx  # Kept out of the import path of the game
+        graph = nx.Graph()
+        graph.add_nodes_from(self._rooms_dict)
+        graph.add_edges_from(self._edges)
+        return graph
+
 
 @attr.s(auto_attribs=True, slots=True)
 class Player(object):
@@ -1,19 +1,121 @@
 import uuid
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Tuple
 
 import attr
 
 
+def _to_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def _to_bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.lower() in ('true', '1', 'yes')
+    return bool(value)
+
+
+def _to_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    return int(value)
+
+
+def _to_list(value):
+    if value is None:
+        return value
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def _to_dict(value):
+    if value is None:
+        return value
+    return dict(value)
+
+
+def _get_coercer(field_type) -> str:
+    """Returns the name of the _to_* function for an annotated field type."""
+    if field_type is str:
+        return '_to_str'
+    if field_type is bool:
+        return '_to_bool'
+    if field_type is int:
+        return '_to_int'
+    origin = getattr(field_type, '__origin__', None)
+    if origin in (list, List):
+        return '_to_list'
+    if origin in (dict, Dict):
+        return '_to_dict'
+    return ''
+
+
+def _compile_codec(cls) -> Tuple[Callable, Callable]:
+    """Generates an (encode, decode) pair specialized to cls's fields.
+
+    Unlike attr.asdict and cls(**data), the generated functions don't
+    inspect the class on every call, and decode coerces each field to its
+    annotated type (e.g. 'True' -> True for a bool).
+    """
+    fields = attr.fields(cls)
+    namespace = {'cls': cls, '_to_str': _to_str, '_to_bool': _to_bool,
+                 '_to_int': _to_int, '_to_list': _to_list,
+                 '_to_dict': _to_dict}
+    encode_items = []
+    decode_args = []
+    for field in fields:
+        coercer = _get_coercer(field.type)
+        # Copy containers, so the dict never aliases the message
+        if coercer in ('_to_list', '_to_dict'):
+            encode_items.append(f'{field.name!r}: {coercer}(obj.{field.name})')
+        else:
+            encode_items.append(f'{field.name!r}: obj.{field.name}')
+        if field.default is attr.NOTHING:
+            value = f'data[{field.name!r}]'
+        elif isinstance(field.default, attr.Factory):
+            namespace[f'_factory_{field.name}'] = field.default.factory
+            value = (f'data[{field.name!r}] if {field.name!r} in data '
+                     f'else _factory_{field.name}()')
+        else:
+            namespace[f'_default_{field.name}'] = field.default
+            value = f'data.get({field.name!r}, _default_{field.name})'
+        decode_args.append(f'{coercer}({value})' if coercer else value)
+    source = (
+        'def encode(obj):\n'
+        f'    return {{{", ".join(encode_items)}}}\n'
+        'def decode(data):\n'
+        f'    return cls({", ".join(decode_args)})\n')
+    exec(compile(source, f'<{cls.__name__} codec>', 'exec'), namespace)
+    return namespace['encode'], namespace['decode']
+
+
+_CODECS: Dict[type, Tuple[Callable, Callable]] = {}
+
+
+def _get_codec(cls) -> Tuple[Callable, Callable]:
+    codec = _CODECS.get(cls)
+    if codec is None:
+        codec = _CODECS[cls] = _compile_codec(cls)
+    return codec
+
+
 @attr.s(auto_attribs=True, slots=True)
 class Message(object):
     """Generic message template with built-in classmethods, functions etc."""
 
     @classmethod
-    def from_dict(cls, data):
-        return cls(**data)
+    def from_dict(cls, data: Dict[str, Any]):
+        try:
+            return _get_codec(cls)[1](data)
+        except KeyError as error:
+            raise TypeError(f'{cls.__name__} is missing {error}') from error
 
-    def to_dict(self):
-        return attr.asdict(self)
+    def to_dict(self) -> Dict[str, Any]:
+        return _get_codec(type(self))[0](self)
 
 
 @attr.s(auto_attribs=True, slots=True)
@@ -21,9 +123,9 @@ class PlayerSuggestionRequest(Message):
     """This is a Server request for a client to make a Suggestion"""
     game_id: str
     client_id: str
-    suspects: str
-    weapons: str
-    rooms: str
+    suspects: List[str]
+    weapons: List[str]
+    rooms: List[str]
 
 
 @attr.s(auto_attribs=True, slots=True)
@@ -112,10 +214,29 @@ class ClientGameStateRequest(Message):
     client_id: str
 
 
+@attr.s(auto_attribs=True, slots=True)
+class GameUpdatesRequest(Message):
+    """This is the client long-polling for game changes since a version."""
+    client_id: str
+    version: int = 0  # The last Game.version the client has, 0 for none
+    wait: int = 0  # Seconds to wait for a change before replying empty
+
+
+@attr.s(auto_attribs=True, slots=True)
+class GameUpdatesResponse(Message):
+    """This is the server's reply with the changes since that version."""
+    game_id: str
+    version: int
+    changes: List[Dict[str, Any]]
+    # The full GameStateRequest, when the changes alone can't catch up
+    state: Dict[str, Any] = attr.Factory(dict)
+
+
 @attr.s(auto_attribs=True, slots=True)
 class JoinGameRequest(Message):
     """This is the client request asking to join a game"""
     player: str
+    client_id: str = ''  # Set to rejoin as an existing client
 
 
 @attr.s(auto_attribs=True, slots=True)
@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict
+import time
+
+
+class Metrics(object):
+    """Thread-safe counters, gauges and timings for the debug endpoints."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def record_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+            timing['last'] = seconds
+
+    @contextmanager
+    def timer(self, name: str):
+        """Records the wall time of the with-block under name."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.monotonic() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {name: dict(timing, mean=timing['total'] / timing['count'])
+                       for name, timing in self._timings.items()}
+            return {'counters': dict(self._counters),
+                    'gauges': dict(self._gauges),
+                    'timings': timings}
+
+
+METRICS = Metrics()
@@ -0,0 +1,110 @@
+# Shortest paths over the board, for bots and move hints.
+# The board never changes, so every distance and next hop is worked out
+# once at import, and planning a move is a table lookup.
+from typing import Iterable, List, Optional, Tuple
+
+from core import catalog
+from core.game_pieces import Board, Room
+
+
+class Planner(object):
+    """All-pairs distances and next hops over a Board.
+
+    Distances count moves (one per hallway or secret passage step). For
+    every (source, target) pair, the neighbours of source that are one
+    move closer to target are kept as (bit, index) pairs, so the best move
+    that isn't into a blocked hallway is the first one whose bit isn't set
+    in the blocked mask.
+    """
+
+    def __init__(self, board: Board):
+        self.board = board
+        rooms = board.rooms
+        self._distances: Tuple[Tuple[int, ...], ...] = tuple(
+            self._get_distances(source) for source in rooms)
+        self._next_hops: Tuple[Tuple[Tuple[Tuple[int, int], ...], ...], ...] = tuple(
+            tuple(self._get_next_hops(source, target) for target in rooms)
+            for source in rooms)
+
+    def get_distance(self, source: Room, target: Room) -> int:
+        """Returns the least number of moves from source to target."""
+        return self._distances[self.board.get_index(source)][
+            self.board.get_index(target)]
+
+    def get_next_move(self, source: Room, target: Room,
+                      blocked: int = 0) -> Room:
+        """Returns the first move of a shortest path from source to target.
+
+        blocked is a bitmask of the hallways that can't be entered (see
+        get_blocked). Stays in source once there, or while every move
+        that gets closer is blocked.
+        """
+        next_hops = self._next_hops[self.board.get_index(source)][
+            self.board.get_index(target)]
+        for bit, index in next_hops:
+            if not blocked & bit:
+                return self.board.rooms[index]
+        return source
+
+    def get_nearest(self, source: Room, targets: Iterable[Room]) -> Optional[Room]:
+        """Returns the target fewest moves from source, None without targets."""
+        distances = self._distances[self.board.get_index(source)]
+        return min(targets, default=None,
+                   key=lambda target: distances[self.board.get_index(target)])
+
+    def plan_move(self, room_name: str, target_names: Iterable[str],
+                  occupied_names: Iterable[str] = ()) -> str:
+        """Returns the move toward the nearest target room, all by name.
+
+        The room a player is already in only counts as a target if it's
+        the only one, so a player keeps visiting new rooms.
+        """
+        source = self.board.get_room(room_name)
+        targets = [self.board.get_room(name) for name in target_names]
+        target = self.get_nearest(
+            source, [room for room in targets if room != source] or targets)
+        if not target:
+            return room_name
+        return self.get_next_move(source, target,
+                                  self.get_blocked(occupied_names)).name
+
+    def get_blocked(self, room_names: Iterable[str]) -> int:
+        """Returns the bitmask of the hallways among the occupied rooms."""
+        mask = 0
+        for room_name in room_names:
+            mask |= self.board.get_bit(self.board.get_room(room_name))
+        return mask & self.board.hallway_mask
+
+    def _get_distances(self, source: Room) -> Tuple[int, ...]:
+        """Breadth-first search from source, a frontier bitmask per step."""
+        distances: List[int] = [-1] * len(self.board.rooms)
+        frontier = self.board.get_bit(source)
+        seen = frontier
+        distance = 0
+        while frontier:
+            reached = 0
+            for room in self.board.get_rooms(frontier):
+                distances[self.board.get_index(room)] = distance
+                reached |= self.board.get_adj_mask(room)
+            frontier = reached & ~seen
+            seen |= frontier
+            distance += 1
+        return tuple(distances)
+
+    def _get_next_hops(self, source: Room,
+                       target: Room) -> Tuple[Tuple[int, int], ...]:
+        distance = self._distances[self.board.get_index(source)][
+            self.board.get_index(target)]
+        next_hops = []
+        for room in self.board.get_adj_rooms(source):
+            index = self.board.get_index(room)
+            if self._distances[index][self.board.get_index(target)] == distance - 1:
+                next_hops.append((1 << index, index))
+        # Prefer stepping straight into a room (by secret passage), as
+        # rooms are never blocked
+        next_hops.sort(key=lambda hop: (bool(hop[0] & self.board.hallway_mask),
+                                        hop[1]))
+        return tuple(next_hops)
+
+
+PLANNER: Planner = Planner(catalog.BOARD)
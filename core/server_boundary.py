@@ -1,32 +1,35 @@
 from typing import Dict, List, Any, Tuple, Optional
 import logging
 
-import requests
-
 from core.game_pieces import Player, Card, CardType, Room, Board
 from core.messages import JoinGameRequest, JoinGameResponse
 from core.messages import StartGameRequest, StartGameResponse
 from core.messages import PlayerCountRequest, PlayerCountResponse
 from core.messages import PlayerCountUpdateRequest, PlayerCountUpdateResponse
 from core.messages import GameStateRequest, ClientGameStateRequest
+from core.messages import GameUpdatesRequest, GameUpdatesResponse
+from core.transport import DEFAULT_TRANSPORT, Transport
 
 JOIN_GAME_ROUTE = 'api/join_game'
 REQUEST_GAME_ROUTE = 'api/request_game'
 PLAYER_COUNT_REQUEST_ROUTE = 'api/player_count'
 PLAYER_COUNT_UPDATE_ROUTE = 'join'
 GAME_STATE_ROUTE = 'api/game_state'
+GAME_UPDATES_ROUTE = 'api/game_updates'
 
 
 class Server(object):
     """A boundary object that represents the Server connection."""
 
-    def __init__(self, address: str, port: Optional[int] = None):
+    def __init__(self, address: str, port: Optional[int] = None,
+                 transport: Transport = DEFAULT_TRANSPORT):
         self._address = address
         self._port = port
+        self._transport = transport
         self.client_id = ''
 
     def send_join_request(self, player_name) -> JoinGameResponse:
-        request = JoinGameRequest(player=player_name)
+        request = JoinGameRequest(player=player_name, client_id=self.client_id)
         response = self._post_request(route=JOIN_GAME_ROUTE, request=request)
         join_response = JoinGameResponse.from_dict(response)
         self.client_id = join_response.client_id
@@ -59,14 +62,19 @@ class Server(object):
         response = self._post_request(route=GAME_STATE_ROUTE, request=request)
         return GameStateRequest.from_dict(response)
 
+    def get_game_updates(self, version: int = 0,
+                         wait: int = 0) -> GameUpdatesResponse:
+        """Returns the game's changes since version, waiting up to wait secs."""
+        request = GameUpdatesRequest(client_id=self.client_id,
+                                     version=version, wait=wait)
+        response = self._post_request(route=GAME_UPDATES_ROUTE, request=request)
+        return GameUpdatesResponse.from_dict(response)
+
     def _post_request(self, route, request) -> Dict[str, Any]:
-        port = f':{self._port}' if self._port else ''
-        url = f'http://{self._address}{port}/{route}'
+        address = f'{self._address}:{self._port}' if self._port else self._address
         # This sends the request to the client and blocks till we get a response
         # TODO(ahammer): Add a timeout here and declare the client disconnected
         # TODO(ahammer): Do literally ANY error handling here
-        logging.info('Sending request to %s', url)
-        logging.info('Contents: %s', request.to_dict())
-        response = requests.get(url, params=request.to_dict())
-        # logging.info('Response: %s', response.headers)
-        return response.json()
\ No newline at end of file
+        logging.info('Sending request to %s/%s', address, route)
+        logging.info('Contents: %s', request)
+        return self._transport.request(address, route, request)
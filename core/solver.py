@@ -0,0 +1,148 @@
+# Monte Carlo estimates of the murder deck, on top of core.deduction.
+from itertools import product
+from typing import Dict, Iterable, Optional, Tuple
+import time
+
+try:
+    import numpy as np
+except ImportError:  # Falls back to a uniform guess over the candidates
+    np = None
+
+from core import catalog
+from core.deduction import TYPE_MASKS, Knowledge
+
+# Seconds of sampling per decision, and hands sampled per vectorized batch
+SAMPLE_BUDGET = 0.05
+BATCH_SIZE = 1024
+
+Solution = Tuple[str, str, str]
+
+_CARD_NAMES = [card.name for card in catalog.CARDS]
+_CARD_COUNT = len(_CARD_NAMES)
+
+
+def estimate_solutions(knowledge: Knowledge, budget: float = SAMPLE_BUDGET,
+                       batch_size: int = BATCH_SIZE,
+                       rng=None) -> Dict[Solution, float]:
+    """Returns the probability of each (suspect, weapon, room) murder deck.
+
+    Samples whole deals consistent with everything the Knowledge knows
+    (held and lacked cards, hand sizes, and unresolved disprovals) until
+    the time budget runs out. Unknown cards are dealt one at a time to a
+    player with room for them and who doesn't lack them, so samples are
+    rarely wasted; each is weighted by the inverse of its probability of
+    being drawn, which makes every consistent deal count equally.
+    """
+    if np is None:
+        return _estimate_uniform(knowledge)
+    rng = rng or np.random.default_rng()
+    sampler = _Sampler(knowledge)
+    deadline = time.monotonic() + budget
+    codes = []
+    log_weights = []
+    while True:
+        batch_codes, batch_log_weights = sampler.sample(batch_size, rng)
+        codes.append(batch_codes)
+        log_weights.append(batch_log_weights)
+        if time.monotonic() >= deadline:
+            break
+    codes = np.concatenate(codes)
+    log_weights = np.concatenate(log_weights)
+    if not len(codes):
+        # Nothing consistent was drawn in time, fall back to the deductions
+        return _estimate_uniform(knowledge)
+    weights = np.exp(log_weights - log_weights.max())
+    totals = np.bincount(codes, weights=weights,
+                         minlength=_CARD_COUNT ** 3) / weights.sum()
+    probabilities = {}
+    for code in np.flatnonzero(totals):
+        suspect, rest = divmod(int(code), _CARD_COUNT ** 2)
+        weapon, room = divmod(rest, _CARD_COUNT)
+        probabilities[(_CARD_NAMES[suspect], _CARD_NAMES[weapon],
+                       _CARD_NAMES[room])] = float(totals[code])
+    return probabilities
+
+
+def get_best_solution(probabilities: Dict[Solution, float],
+                      suspects: Iterable[str], weapons: Iterable[str],
+                      rooms: Iterable[str]) -> Tuple[Optional[Solution], float]:
+    """Returns the likeliest solution made of the given options, and its odds."""
+    suspects, weapons, rooms = set(suspects), set(weapons), set(rooms)
+    best, best_probability = None, 0.0
+    for solution, probability in probabilities.items():
+        suspect, weapon, room = solution
+        if (probability > best_probability and suspect in suspects
+                and weapon in weapons and room in rooms):
+            best, best_probability = solution, probability
+    return best, best_probability
+
+
+def _estimate_uniform(knowledge: Knowledge) -> Dict[Solution, float]:
+    suspects, weapons, rooms = knowledge.get_candidates()
+    solutions = list(product(suspects, weapons, rooms))
+    return {solution: 1 / len(solutions) for solution in solutions}
+
+
+class _Sampler(object):
+    """The fixed parts of a Knowledge, as arrays for vectorized sampling."""
+
+    def __init__(self, knowledge: Knowledge):
+        players = len(knowledge.players)
+        envelope = knowledge.envelope
+        bits = [1 << index for index in range(_CARD_COUNT)]
+        held = 0
+        for mask in knowledge.has:
+            held |= mask
+        self.players = players
+        self.lacks = np.array([[bool(knowledge.lacks[player] & bit) for bit in bits]
+                               for player in range(players)])
+        self.capacity = np.array(
+            [knowledge.sizes[player] - bin(knowledge.has[player]).count('1')
+             for player in range(players)])
+        # The owner of every known card, -1 if unknown, players for the deck
+        self.owners = np.full(_CARD_COUNT, -1)
+        for owner, mask in enumerate(knowledge.has):
+            for index, bit in enumerate(bits):
+                if mask & bit:
+                    self.owners[index] = owner
+        # Per card type, the cards the murder deck could hold
+        self.envelope_options = [
+            np.array([index for index, bit in enumerate(bits)
+                      if type_mask & bit and not knowledge.lacks[envelope] & bit])
+            for type_mask in TYPE_MASKS]
+        self.unknown = np.array([index for index, bit in enumerate(bits)
+                                 if not held & bit])
+        self.clauses = [(owner, np.array([index for index, bit in enumerate(bits)
+                                          if cards & bit]))
+                        for owner, cards in knowledge.clauses]
+
+    def sample(self, size: int, rng) -> Tuple:
+        """Returns the solution codes and log weights of the accepted samples."""
+        rows = np.arange(size)
+        owners = np.tile(self.owners, (size, 1))
+        picks = [rng.choice(options, size) for options in self.envelope_options]
+        for pick in picks:
+            owners[rows, pick] = self.players
+        capacity = np.tile(self.capacity, (size, 1))
+        log_weights = np.zeros(size)
+        alive = np.ones(size, dtype=bool)
+        for card in self.unknown:
+            dealing = alive & (owners[:, card] < 0)
+            choices = capacity * ~self.lacks[:, card]
+            totals = choices.sum(axis=1)
+            alive &= ~(dealing & (totals == 0))
+            dealing &= alive
+            if not dealing.any():
+                continue
+            cumulative = choices[dealing].cumsum(axis=1)
+            draws = rng.random(dealing.sum()) * totals[dealing]
+            owner = (cumulative <= draws[:, None]).sum(axis=1)
+            dealt = rows[dealing]
+            # The chance of this pick was choices / totals, weight by 1 / that
+            log_weights[dealt] += np.log(totals[dealing] / choices[dealt, owner])
+            capacity[dealt, owner] -= 1
+            owners[dealt, card] = owner
+        for owner, cards in self.clauses:
+            alive &= (owners[:, cards] == owner).any(axis=1)
+        codes = (picks[0] * _CARD_COUNT ** 2 + picks[1] * _CARD_COUNT + picks[2])
+        return codes[alive], log_weights[alive]
@@ -0,0 +1,315 @@
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import weakref
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from core import wire
+from core.messages import Message
+
+# Connections kept open per host, shared by every boundary object
+POOL_SIZE = 100
+# Seconds to wait for a TCP connection to be established
+CONNECT_TIMEOUT = 5
+# Seconds an async request waits for a free connection to its host, on top
+# of CONNECT_TIMEOUT, before it fails rather than queueing indefinitely
+POOL_TIMEOUT = 5
+# Seconds to wait for a response, None waits on the player indefinitely
+READ_TIMEOUT = None
+# Seconds an idle keep-alive connection is held open
+KEEP_ALIVE_TIMEOUT = 30
+
+# What a request raises when the other end is slow or gone
+DISCONNECT_ERRORS = (ConnectionError, socket.timeout, asyncio.TimeoutError,
+                     requests.ConnectionError, requests.Timeout,
+                     aiohttp.ClientConnectionError)
+
+
+# Big-endian frame length prefix used by SocketTransport
+_FRAME_HEADER = struct.Struct('>I')
+# The only key of the frame serve_sockets answers with when it can't
+# decode or handle a frame
+ERROR_KEY = 'error'
+
+# Handles a (route, message) in-process, returns the response dict
+Handler = Callable[[str, Any], Dict[str, Any]]
+
+
+class RemoteError(Exception):
+    """The other end got the request, but failed to decode or handle it."""
+
+
+# What a request raises when the other end is there, but answered with an
+# error or something that isn't a message
+REMOTE_ERRORS = (RemoteError, wire.WireError)
+
+
+class Transport(object):
+    """How a boundary object delivers a message to the other side.
+
+    Client and Server only call request/request_async, so the Game doesn't
+    care whether a player is reached over HTTP, in-process, or a socket.
+    A timeout (seconds to wait for the response) overrides the transport's
+    read_timeout for one request, and going over it (or losing the
+    connection) raises one of DISCONNECT_ERRORS. An answer that's an error
+    or can't be decoded raises one of REMOTE_ERRORS.
+    """
+    is_remote = True
+
+    def request(self, address: str, route: str, message: Message,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def request_async(self, address: str, route: str, message: Message,
+                            timeout: Optional[float] = None) -> Dict[str, Any]:
+        # Transports without native async I/O block a default executor thread
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.request, address, route, message, timeout)
+
+
+class LocalTransport(Transport):
+    """Calls a handler directly, for bots and tests in the same process.
+
+    The Message instance is handed over as-is, no encoding or network.
+    """
+    is_remote = False
+
+    def __init__(self, handler: Handler):
+        self._handler = handler
+
+    def request(self, address: str, route: str, message: Message,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self._handler(route, message)
+
+    async def request_async(self, address: str, route: str, message: Message,
+                            timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self._handler(route, message)
+
+
+class HttpTransport(Transport):
+    """Pooled, keep-alive HTTP connections for Client and Server messages.
+
+    One instance is meant to be shared by every boundary object in a
+    process, so messages reuse open sockets instead of connecting each time.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, keep_alive: bool = True,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: Optional[float] = READ_TIMEOUT,
+                 content_type: str = wire.JSON):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.content_type = content_type
+        self._headers = {'Content-Type': content_type, 'Accept': content_type}
+
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        if not keep_alive:
+            self._session.headers['Connection'] = 'close'
+        # aiohttp sessions are bound to the event loop they were made on
+        self._async_sessions = weakref.WeakKeyDictionary()
+
+    def request(self, address: str, route: str, message: Message,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self.post(f'http://{address}/{route}', message.to_dict(),
+                         timeout)
+
+    async def request_async(self, address: str, route: str, message: Message,
+                            timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self.post_async(f'http://{address}/{route}',
+                                     message.to_dict(), timeout)
+
+    def post(self, url: str, message: Dict[str, Any],
+             timeout: Optional[float] = None) -> Dict[str, Any]:
+        read_timeout = self.read_timeout if timeout is None else timeout
+        response = self._session.post(
+            url, data=wire.encode(message, self.content_type),
+            headers=self._headers,
+            timeout=(self.connect_timeout, read_timeout))
+        if not response.ok:
+            raise RemoteError(f'{url}: HTTP {response.status_code}')
+        return wire.decode(response.content,
+                           response.headers.get('Content-Type'))
+
+    async def post_async(self, url: str, message: Dict[str, Any],
+                         timeout: Optional[float] = None) -> Dict[str, Any]:
+        session = self._get_async_session()
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = self._get_async_timeout(timeout)
+        async with session.post(url, data=wire.encode(message, self.content_type),
+                                headers=self._headers, **kwargs) as response:
+            if not response.ok:
+                raise RemoteError(f'{url}: HTTP {response.status}')
+            return wire.decode(await response.read(), response.content_type)
+
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            logging.info('Opening HTTP connection pool of %s per host',
+                         self.pool_size)
+            # Every game on the loop shares this pool, and a turn holds its
+            # connection until the player answers, so only bound it per
+            # host: players waiting on one host don't starve the others
+            if self.keep_alive:
+                connector = aiohttp.TCPConnector(
+                    limit=0, limit_per_host=self.pool_size,
+                    keepalive_timeout=KEEP_ALIVE_TIMEOUT)
+            else:
+                connector = aiohttp.TCPConnector(
+                    limit=0, limit_per_host=self.pool_size, force_close=True)
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._get_async_timeout(self.read_timeout))
+            self._async_sessions[loop] = session
+        return session
+
+    def _get_async_timeout(self, read_timeout: Optional[float]) -> aiohttp.ClientTimeout:
+        # connect covers waiting for a pooled connection, and making one
+        return aiohttp.ClientTimeout(connect=self.connect_timeout + POOL_TIMEOUT,
+                                     sock_connect=self.connect_timeout,
+                                     sock_read=read_timeout)
+
+
+class SocketTransport(Transport):
+    """One persistent TCP connection per address, with length-prefixed frames.
+
+    Each frame is a wire-encoded {'route', 'message'} dict, answered by one
+    response frame. It saves HTTP's per-message headers and parsing, and the
+    connection stays open for the whole game. The other end is serve_sockets.
+    """
+
+    def __init__(self, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: Optional[float] = READ_TIMEOUT,
+                 content_type: str = wire.JSON):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.content_type = content_type
+        self._lock = threading.Lock()
+        self._connections: Dict[str, socket.socket] = {}
+        # One request in flight per connection
+        self._connection_locks: Dict[str, threading.Lock] = {}
+
+    def request(self, address: str, route: str, message: Message,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._lock:
+            connection_lock = self._connection_locks.setdefault(
+                address, threading.Lock())
+        with connection_lock:
+            with self._lock:
+                connection = self._connections.get(address)
+            if connection is None:
+                connection = self._connect(address)
+            connection.settimeout(self.read_timeout if timeout is None
+                                  else timeout)
+            try:
+                _send_frame(connection, wire.encode(
+                    {'route': route, 'message': message.to_dict()},
+                    self.content_type))
+                response = wire.decode(_recv_frame(connection),
+                                       self.content_type)
+            except (OSError, wire.WireError):
+                # Don't reuse a connection that's in an unknown state
+                self.close(address)
+                raise
+        if list(response) == [ERROR_KEY]:
+            raise RemoteError(f'{address}/{route}: {response[ERROR_KEY]}')
+        return response
+
+    def close(self, address: str) -> None:
+        with self._lock:
+            connection = self._connections.pop(address, None)
+        if connection:
+            connection.close()
+
+    def _connect(self, address: str) -> socket.socket:
+        host, _, port = address.rpartition(':')
+        logging.info('Opening socket connection to %s', address)
+        try:
+            connection = socket.create_connection(
+                (host, int(port)), timeout=self.connect_timeout)
+        except socket.timeout:
+            raise
+        except OSError as error:
+            # Unreachable hosts and failed lookups are plain OSErrors
+            raise ConnectionError(f'Connecting to {address}: {error}') from error
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Connected outside the lock, so a slow address doesn't hold up others
+        with self._lock:
+            self._connections[address] = connection
+        return connection
+
+
+def _send_frame(connection: socket.socket, body: bytes) -> None:
+    connection.sendall(_FRAME_HEADER.pack(len(body)) + body)
+
+
+def _recv_exactly(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Socket closed mid-frame')
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _recv_frame(connection: socket.socket) -> bytes:
+    size, = _FRAME_HEADER.unpack(_recv_exactly(connection, _FRAME_HEADER.size))
+    return _recv_exactly(connection, size)
+
+
+def serve_sockets(handler: Handler, host: str, port: int,
+                  content_type: str = wire.JSON) -> socketserver.ThreadingTCPServer:
+    """Answers SocketTransport frames with handler(route, message_dict).
+
+    Runs in a daemon thread, one more thread per open connection. A frame
+    that can't be decoded or handled is logged and answered with an
+    {ERROR_KEY: reason} frame, and the connection carries on.
+    """
+    class _FrameHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    body = _recv_frame(self.request)
+                except ConnectionError:
+                    return
+                _send_frame(self.request,
+                            wire.encode(self._answer(body), content_type))
+
+        def _answer(self, body: bytes) -> Dict[str, Any]:
+            try:
+                frame = wire.decode(body, content_type)
+                route, message = frame['route'], frame['message']
+            except (wire.WireError, KeyError, TypeError) as error:
+                logging.warning('Bad frame from %s: %r',
+                                self.client_address, error)
+                return {ERROR_KEY: f'Bad frame: {error!r}'}
+            try:
+                return handler(route, message)
+            except Exception as error:
+                logging.exception('Failed handling %s from %s',
+                                  route, self.client_address)
+                return {ERROR_KEY: f'Failed handling {route}: {error!r}'}
+
+    server = socketserver.ThreadingTCPServer((host, port), _FrameHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='socket-server',
+                     daemon=True).start()
+    return server
+
+
+DEFAULT_TRANSPORT = HttpTransport()
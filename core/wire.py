@@ -0,0 +1,95 @@
+# Versioned wire format for the messages sent between server and clients.
+# Every body is an envelope, {'version': WIRE_VERSION, 'message': {...}},
+# encoded as JSON by default, or msgpack when it's installed and asked for.
+# Both keep the message's types exactly (bools, lists, dicts, None).
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+
+from flask import Response, request
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON is always available
+    msgpack = None
+
+WIRE_VERSION = 1
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CONTENT_TYPES = {'json': JSON, 'msgpack': MSGPACK}
+
+
+class WireError(ValueError):
+    """Raised for a body that can't be decoded as a supported message."""
+
+
+def get_format_content_type(wire_format: str) -> str:
+    """Returns the content type of a WIRE_FORMAT, if it can be used here."""
+    content_type = CONTENT_TYPES.get(wire_format.strip().lower())
+    if not content_type:
+        raise ValueError(f'Unknown WIRE_FORMAT {wire_format!r}, '
+                         f'expected one of {", ".join(CONTENT_TYPES)}')
+    if content_type == MSGPACK and msgpack is None:
+        raise ValueError('WIRE_FORMAT is msgpack, but msgpack is not installed')
+    return content_type
+
+
+# What every transport in the process sends, set by the WIRE_FORMAT env var
+CONTENT_TYPE = get_format_content_type(os.environ.get('WIRE_FORMAT', 'json'))
+
+
+def get_content_type(content_type: Optional[str]) -> str:
+    """Normalizes a Content-Type header into one of the supported formats."""
+    mimetype = (content_type or JSON).split(';')[0].strip().lower()
+    if mimetype == MSGPACK:
+        return MSGPACK
+    return JSON
+
+
+def encode(message: Dict[str, Any], content_type: str = JSON) -> bytes:
+    envelope = {'version': WIRE_VERSION, 'message': message}
+    if get_content_type(content_type) == MSGPACK:
+        if msgpack is None:
+            raise WireError('msgpack is not installed')
+        return msgpack.packb(envelope, use_bin_type=True)
+    return json.dumps(envelope, separators=(',', ':')).encode('utf-8')
+
+
+def decode(body: bytes, content_type: Optional[str] = JSON) -> Dict[str, Any]:
+    try:
+        if get_content_type(content_type) == MSGPACK:
+            if msgpack is None:
+                raise WireError('msgpack is not installed')
+            envelope = msgpack.unpackb(body, raw=False)
+        else:
+            envelope = json.loads(body)
+    except (ValueError, TypeError) as error:
+        raise WireError(f'Malformed message body: {error}') from error
+    if not isinstance(envelope, dict) or 'message' not in envelope:
+        raise WireError(f'Not a message envelope: {envelope!r}')
+    if envelope.get('version') != WIRE_VERSION:
+        raise WireError(f'Unsupported wire version: {envelope.get("version")}')
+    return envelope['message']
+
+
+def read_message(message_class):
+    """Decodes the current Flask request's body into a Message instance."""
+    message = decode(request.get_data(), request.content_type)
+    try:
+        return message_class.from_dict(message)
+    except TypeError as error:
+        raise WireError(f'Bad {message_class.__name__}: {error}') from error
+
+
+def send_message(message: Dict[str, Any]) -> Response:
+    """Encodes a response in the same wire format as the request."""
+    content_type = get_content_type(request.content_type)
+    return Response(encode(message, content_type), mimetype=content_type)
+
+
+def on_wire_error(error: WireError) -> Response:
+    """Flask error handler, a body that isn't a message is a bad request."""
+    logging.warning('Bad request to %s: %s', request.path, error)
+    return Response(str(error), status=400, mimetype='text/plain')
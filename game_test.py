@@ -1,12 +1,149 @@
 import logging
+import socket
 
 from core.game import Game
+from core import catalog
 from core import game_const as g
 from core import client_boundary as c
+from core import messages
+from core import wire
+from core.deduction import Knowledge
+from core.transport import RemoteError, Transport
+
+
+class _FailingTransport(Transport):
+    """Raises error for every request, like a client that never answers."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def request(self, address, route, message, timeout=None):
+        raise self.error
+
+
+def _get_cards(*names):
+    return [catalog.get_card(name) for name in names]
+
+
+def _get_result(suggested_by, disproved_by='', disproved_card=''):
+    return messages.PlayerSuggestionResult(
+        game_id='game', client_id='client', suspect=g.PLUM, weapon=g.ROPE,
+        room=g.HALL, disproved_by=disproved_by, disproved_card=disproved_card,
+        suggested_by=suggested_by)
+
+
+def test_disprover_order():
+    game = Game([c.Client(name, 'localhost')
+                 for name in (g.PLUM, g.WHITE, g.MUSTARD, g.SCARLET)])
+    suggestion = _get_cards(g.PLUM, g.ROPE, g.HALL)
+    # The active player's own cards don't count, the next seat that has
+    # one of the cards does
+    game.turn = 0
+    game._card_owners = {g.PLUM: 0, g.ROPE: 2, g.HALL: 1}
+    player, card = game._find_disprover(suggestion)
+    assert (player.name, card.name) == (g.WHITE, g.HALL)
+    # Seats are asked in order from the active player, wrapping around
+    game.turn = 2
+    game._card_owners = {g.PLUM: 1, g.ROPE: 3, g.HALL: 0}
+    player, card = game._find_disprover(suggestion)
+    assert (player.name, card.name) == (g.SCARLET, g.ROPE)
+    game._card_owners = {g.PLUM: 2}
+    assert game._find_disprover(suggestion) == (None, None)
+
+
+def test_knowledge_shown_card():
+    players = [g.PLUM, g.WHITE, g.MUSTARD]
+    knowledge = Knowledge(g.PLUM, players, [g.REVOLVER, g.DAGGER, g.STUDY,
+                                            g.LOUNGE, g.WHITE, g.GREEN])
+    knowledge.on_suggestion_result(_get_result(g.PLUM, g.MUSTARD, g.ROPE))
+    # White was asked first and couldn't disprove
+    suspects, weapons, rooms = knowledge.get_candidates()
+    assert g.ROPE not in weapons
+    assert g.PLUM in suspects and g.HALL in rooms
+    seat = knowledge.get_seat(g.WHITE)
+    for card_name in (g.PLUM, g.ROPE, g.HALL):
+        assert knowledge.lacks[seat] & catalog.get_card_bit(
+            catalog.get_card(card_name))
+
+
+def test_knowledge_resolves_clauses():
+    players = [g.PLUM, g.WHITE, g.MUSTARD]
+    knowledge = Knowledge(g.PLUM, players, [g.REVOLVER, g.DAGGER, g.STUDY,
+                                            g.LOUNGE, g.WHITE, g.GREEN])
+    # Mustard disproved White's suggestion with a card Plum didn't see...
+    knowledge.on_suggestion_result(_get_result(g.WHITE, g.MUSTARD))
+    seat = knowledge.get_seat(g.MUSTARD)
+    assert knowledge.clauses
+    assert not knowledge.has[seat] & catalog.get_card_bit(
+        catalog.get_card(g.HALL))
+    # ...and then couldn't disprove Prof. Plum or the Rope, so it was the Hall
+    knowledge.on_suggestion_result(messages.PlayerSuggestionResult(
+        game_id='game', client_id='client', suspect=g.PLUM, weapon=g.ROPE,
+        room=g.STUDY, disproved_by=g.PLUM, disproved_card=g.STUDY,
+        suggested_by=g.WHITE))
+    assert knowledge.has[seat] & catalog.get_card_bit(catalog.get_card(g.HALL))
+    assert not knowledge.clauses
+
+
+def test_knowledge_solution():
+    players = [g.PLUM, g.WHITE, g.MUSTARD]
+    knowledge = Knowledge(g.PLUM, players, [g.REVOLVER, g.DAGGER, g.STUDY,
+                                            g.LOUNGE, g.WHITE, g.GREEN])
+    assert knowledge.get_solution() is None
+    # Nobody could disprove Plum's suggestion, and Plum holds none of it
+    knowledge.on_suggestion_result(_get_result(g.PLUM))
+    assert knowledge.get_solution() == (g.PLUM, g.ROPE, g.HALL)
+
+
+def test_wire_round_trip():
+    message = messages.GameStateRequest(
+        game_id='game', client_id='client',
+        whereabouts={g.PLUM: g.STUDY}, current_turn=g.PLUM,
+        player_cards=[g.ROPE, g.HALL]).to_dict()
+    content_types = [wire.JSON] + ([wire.MSGPACK] if wire.msgpack else [])
+    for content_type in content_types:
+        body = wire.encode(message, content_type)
+        assert wire.decode(body, content_type) == message
+        decoded = messages.GameStateRequest.from_dict(
+            wire.decode(body, content_type))
+        assert decoded.to_dict() == message
+
+
+def test_wire_rejects_bad_bodies():
+    for body in (b'<html>oops', b'{"version": 2, "message": {}}',
+                 b'{"message": {}}', b'[1, 2]'):
+        try:
+            wire.decode(body, wire.JSON)
+        except wire.WireError:
+            continue
+        raise AssertionError(f'Decoded {body!r}')
+
+
+def test_timeout_default_response():
+    rooms = [catalog.BOARD.get_room(g.STUDY)]
+    client = c.Client(g.PLUM, 'localhost',
+                      transport=_FailingTransport(socket.timeout()))
+    assert client.send_move_request(rooms) is None
+    assert client.send_accusation_request(_get_cards(g.PLUM, g.ROPE)) == []
+    assert not client.connected
+    # A client that answers with an error skips the phase, but is there
+    client = c.Client(g.PLUM, 'localhost',
+                      transport=_FailingTransport(RemoteError('HTTP 500')))
+    assert client.send_move_request(rooms) is None
+    assert client.connected
+    client = c.Client(g.PLUM, 'localhost',
+                      transport=_FailingTransport(wire.WireError('garbage')))
+    assert client.send_suggestion_request(_get_cards(g.PLUM, g.ROPE)) == []
+    assert client.connected
 
 
 def main():
     logging.basicConfig()
+    for check in (test_disprover_order, test_knowledge_shown_card,
+                  test_knowledge_resolves_clauses, test_knowledge_solution,
+                  test_wire_round_trip, test_wire_rejects_bad_bodies,
+                  test_timeout_default_response):
+        check()
     client1 = c.Client(g.MUSTARD, 'www.mocky.io/v2', '')
     client2 = c.Client(g.SCARLET, 'www.mocky.io/v2', '')
     client3 = c.Client(g.WHITE, 'www.mocky.io/v2', '')
@@ -1,95 +1,171 @@
 from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 import logging
 import os
-import time
-from threading import Lock
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 
 from flask import Flask, request, jsonify, render_template
 import attr
 
+from core import catalog
+from core import client_boundary
+from core import wire
 from core.client_boundary import Client
 from core.game import Game, GameEncoder
+from core.metrics import METRICS
+from core.transport import HttpTransport, SocketTransport
 from core.messages import JoinGameRequest, JoinGameResponse
 from core.messages import StartGameRequest, StartGameResponse
 from core.messages import PlayerCountRequest, PlayerCountResponse
 from core.messages import ClientGameStateRequest, GameStateRequest
+from core.messages import GameUpdatesRequest, GameUpdatesResponse
+from core.wire import read_message, send_message
+from server.clueless_db import Clueless_Database
+from server.event_log import EventLog
+from server.registry import Registry
+from server.scheduler import GameScheduler, AsyncGameScheduler
 
 CLIENT_PORT = 5000
 
+# Pooled connections to the clients, shared by every Client
+HTTP_TRANSPORT = HttpTransport(
+    pool_size=int(os.environ.get('HTTP_POOL_SIZE', 100)),
+    keep_alive=os.environ.get('HTTP_KEEP_ALIVE', 'true') == 'true',
+    content_type=wire.CONTENT_TYPE)
+
+# 'http' reaches clients on CLIENT_PORT, 'socket' over a persistent
+# SocketTransport connection on CLIENT_SOCKET_PORT
+CLIENT_TRANSPORT = os.environ.get('CLIENT_TRANSPORT', 'http')
+CLIENT_SOCKET_PORT = int(os.environ.get('CLIENT_SOCKET_PORT', 5100))
+SOCKET_TRANSPORT = SocketTransport(
+    content_type=wire.CONTENT_TYPE)
+
+# Seconds players get for each phase of their turn, and for acks, before
+# it's skipped for them; and to come back once they stop answering
+TURN_TIMEOUT = float(os.environ.get('TURN_TIMEOUT',
+                                    client_boundary.TURN_TIMEOUT))
+ACK_TIMEOUT = float(os.environ.get('ACK_TIMEOUT', client_boundary.ACK_TIMEOUT))
+CLIENT_TIMEOUTS = {
+    route: float(os.environ.get(f'{name}_TIMEOUT', TURN_TIMEOUT))
+    for name, route in (('MOVE', client_boundary.PLAYER_MOVE_ROUTE),
+                        ('SUGGEST', client_boundary.SUGGESTION_ROUTE),
+                        ('ACCUSE', client_boundary.ACCUSATION_ROUTE))}
+CLIENT_TIMEOUTS.update(
+    (route, ACK_TIMEOUT) for route in client_boundary.PHASE_TIMEOUTS
+    if route not in client_boundary.TURN_ROUTES)
+RECONNECT_GRACE = float(os.environ.get('RECONNECT_GRACE',
+                                       client_boundary.RECONNECT_GRACE))
+
+# 'thread' runs each turn on the executor, 'async' on a shared event loop
+GAME_RUNNER = os.environ.get('GAME_RUNNER', 'thread')
+
+EMPTY_GAME_STATE = GameStateRequest(None, None, None, None, None)
+
+# Longest a /api/game_updates long-poll is held open, in seconds
+LONG_POLL_TIMEOUT = 30
+
+# Game events are written behind to Postgres, when DB_ADDRESS is set
+DB_SETTINGS = {
+    'host': os.environ.get('DB_ADDRESS'),
+    'dbname': os.environ.get('DB_NAME', 'postgres'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'connect_timeout': 5,
+}
+
 MIN_PLAYERS = 3
 MAX_PLAYERS = 6
 
 
+def get_event_log() -> Optional[EventLog]:
+    """Returns the EventLog for DB_SETTINGS, or None without a database."""
+    if not DB_SETTINGS['host']:
+        return None
+    db = Clueless_Database(DB_SETTINGS)
+    if not db.connect():
+        logging.warning('Could not reach the database at %s, game events '
+                        'will not be saved', DB_SETTINGS['host'])
+        return None
+    return EventLog(db)
+
+
 class App(Flask):
     hostID: str = str(uuid.uuid4())
-    clients: List[Client] = []
-    games: List[Game] = []
-    futures: List[Future] = []
+    registry: Registry = Registry(
+        archive_ttl=float(os.environ.get('ARCHIVE_TTL', 24 * 60 * 60)),
+        archive_size=int(os.environ.get('ARCHIVE_SIZE', 1000)),
+        lobby_ttl=float(os.environ.get('LOBBY_TTL', 2 * 60)))
+    futures: Dict[str, Future] = {}
     executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=5)
-    lock: Lock = Lock()
-    lock.acquire
-    paused: bool = False
-    kill: bool = False
+    scheduler: GameScheduler = (AsyncGameScheduler() if GAME_RUNNER == 'async'
+                                else GameScheduler(executor))
+    # Opened by __main__, so importing this module doesn't reach for the DB
+    event_log: Optional[EventLog] = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.json_encoder = GameEncoder
 
+    @property
+    def clients(self) -> List[Client]:
+        return self.registry.clients
+
+    @property
+    def games(self) -> List[Game]:
+        return self.registry.games
+
     @property
     def waiting_clients(self) -> List[Client]:
-        return [client for client in self.clients
-                if not client.game_id]
+        return self.registry.waiting_clients
 
     def get_client(self, client_id: str) -> Optional[Client]:
-        return next((client for client in self.clients
-                     if client.client_id == client_id), None)
-
-    def get_client_by_ip(self, ip: str) -> Optional[Client]:
-        return next((client for client in self.clients
-                     if client.address == ip), None)
+        return self.registry.get_client(client_id)
 
     def get_game(self, game_id: str) -> Game:
-        return next((game for game in self.games
-                     if game.game_id == game_id), None)
+        return self.registry.get_game(game_id)
 
     def get_game_clients(self, game_id: str) -> List[Client]:
-        return [client for client in self.clients
-                if client.game_id == game_id]
+        game = self.get_game(game_id)
+        return list(game.clients) if game else []
+
+    def get_target_games(self, game_id: str = '') -> List[Game]:
+        """Returns the game matching game_id, or every game if it's empty."""
+        if not game_id:
+            return list(self.games)
+        game = self.get_game(game_id)
+        return [game] if game else []
 
     def start_game(self, game_id: str) -> bool:
         game = self.get_game(game_id)
         if not game:
             return False
-        game_thread = self.executor.submit(self.run_game, game)
-        game_thread.add_done_callback(end_game)
-        self.futures.append(game_thread)
+        game_future = self.scheduler.start(game)
+        # Stored first, as a game can end before add_done_callback returns
+        self.futures[game.game_id] = game_future
+        game_future.add_done_callback(partial(end_game, game.game_id))
         return True
 
-    def run_game(self, game: Game) -> str:
-        game_result = ''
-        # Wait a second for startup
-        time.sleep(1)
-        while not game_result:
-            time.sleep(1)  # Give other threads a chance
-            with self.lock:
-                game.take_turn()
-                game_result = game.result
-            if self.kill == True:
-                return self, game.game_id
-        return self, game.game_id
-
 
-def end_game(future: Future):
-    app, game_id = future.result()
-    logging.info('Game Over: %s Wins!', app.get_game(game_id).result)
-    # for client in clients:
-    #     app.remove_client(client.client_id)
-    # app.remove_game(game_id)
+def end_game(game_id: str, future: Future):
+    try:
+        error = future.exception()
+        if error:
+            logging.error('Game Failed: %s: %r', game_id, error)
+            return
+        game = future.result()
+        if game.killed:
+            logging.info('Game Killed: %s', game_id)
+        else:
+            logging.info('Game Over: %s Wins!', game.result)
+    finally:
+        # The game and its clients are done (or failed), keep only a summary
+        APP.futures.pop(game_id, None)
+        APP.registry.archive_game(game_id)
 
 
 APP = App(__name__)
+APP.register_error_handler(wire.WireError, wire.on_wire_error)
 
 
 @APP.route('/')
@@ -107,23 +183,36 @@ def debug_games():
     return jsonify(APP.games)
 
 
+@APP.route('/debug/board')
+def debug_board():
+    import networkx as nx  # Only needed here, keep it out of startup
+    return jsonify(nx.node_link_data(catalog.BOARD.to_networkx()))
+
+
+@APP.route('/debug/archive')
+def debug_archive():
+    return jsonify([attr.asdict(summary) for summary in APP.registry.archive])
+
+
+@APP.route('/debug/metrics')
+def debug_metrics():
+    return jsonify(METRICS.snapshot())
+
+
 @APP.route('/debug/pause', methods=['POST', 'GET'])
 def debug_pause():
     if request.method == 'POST':
         logging.info(request.form)
-        if request.form.get('pause'):
-            APP.paused = True
-            APP.lock.acquire()
-        if request.form.get('resume'):
-            APP.paused = False
-            APP.lock.release()
-        if request.form.get('kill'):
-            APP.kill = True
-            if APP.lock.locked():
-                APP.lock.release()
-            APP.paused = False
-            APP.kill = False
-    return render_template('pause.html.jinja', paused=APP.paused)
+        # An empty game_id targets every game on the server
+        games = APP.get_target_games(request.form.get('game_id', ''))
+        for game in games:
+            if request.form.get('pause'):
+                APP.scheduler.pause(game)
+            if request.form.get('resume'):
+                APP.scheduler.resume(game)
+            if request.form.get('kill'):
+                APP.scheduler.kill(game)
+    return render_template('pause.html.jinja', games=APP.games)
 
 
 @APP.route('/debug/clear')
@@ -131,55 +220,65 @@ def debug_clear():
     return 'NotImplemented'
 
 
-@APP.route('/api/join_game', methods=['GET'])
+@APP.route('/api/join_game', methods=['POST'])
 def join():
     # parse input params
-    # logging.info('Received join request: %s', request.args)
-    join_request = JoinGameRequest.from_dict(dict(request.args))
+    # logging.info('Received join request: %s', request.get_data())
+    join_request = read_message(JoinGameRequest)
     logging.info('Parsed Request: %s', join_request)
     src_ip = request.remote_addr
-    existing = APP.get_client_by_ip(src_ip)
+    # One client app can host many players, so rejoin by client_id, not IP
+    existing = APP.get_client(join_request.client_id)
 
     if existing:
-        logging.info('Client already exists for this IP. ')
+        logging.info('Client already exists for this client_id. ')
+        existing.mark_connected()
+        APP.registry.touch(existing.client_id)
         response = JoinGameResponse(client_id=existing.client_id,
                                     player=existing.player_name)
-        return jsonify(response.to_dict())
+        return send_message(response.to_dict())
 
     player = join_request.player
     # TODO(ahammer): Check this character against existing client's characters
-    new_client = Client(player, src_ip, CLIENT_PORT)
-    APP.clients.append(new_client)
+    if CLIENT_TRANSPORT == 'socket':
+        new_client = Client(player, src_ip, CLIENT_SOCKET_PORT,
+                            transport=SOCKET_TRANSPORT,
+                            timeouts=CLIENT_TIMEOUTS,
+                            reconnect_grace=RECONNECT_GRACE)
+    else:
+        new_client = Client(player, src_ip, CLIENT_PORT,
+                            transport=HTTP_TRANSPORT,
+                            timeouts=CLIENT_TIMEOUTS,
+                            reconnect_grace=RECONNECT_GRACE)
+    APP.registry.add_client(new_client)
     logging.info('Added a new client: %s', new_client.__dict__)
 
     response = JoinGameResponse(player=player,
                                 client_id=new_client.client_id)
     logging.info('Response to client: %s', response)
-    return jsonify(response.to_dict())
+    return send_message(response.to_dict())
 
 
-@APP.route('/api/request_game', methods=['GET'])
+@APP.route('/api/request_game', methods=['POST'])
 def request_game():
-    start_request = StartGameRequest.from_dict(dict(request.args))
-
-    player_count = len(APP.waiting_clients)
-    if player_count < MIN_PLAYERS:
+    start_request = read_message(StartGameRequest)
+    APP.registry.touch(start_request.client_id)
+
+    game = APP.registry.add_waiting_game(
+        start_request.client_id,
+        lambda clients: Game(
+            clients, event_log=APP.event_log.append if APP.event_log else None),
+        MIN_PLAYERS, MAX_PLAYERS)
+    if not game:
         response = StartGameResponse(client_id=start_request.client_id,
                                      game_id='')
-        return jsonify(response.to_dict())
+        return send_message(response.to_dict())
 
-    if player_count > MAX_PLAYERS:
-        game_clients = APP.waiting_clients[:MAX_PLAYERS - 2]
-        game_clients.append(APP.get_client(start_request.client_id))
-    else:
-        game_clients = APP.waiting_clients
-    game = Game(game_clients)
-    APP.games.append(game)
     APP.start_game(game.game_id)
 
     response = StartGameResponse(client_id=start_request.client_id,
                                  game_id=game.game_id)
-    return jsonify(response.to_dict())
+    return send_message(response.to_dict())
 
 
 @APP.route('/api/start_game', methods=['GET'])
@@ -187,33 +286,82 @@ def start_game():
     return 'NotImplemented'
 
 
-@APP.route('/api/player_count', methods=['GET'])
+@APP.route('/api/player_count', methods=['POST'])
 def player_count():
-    # logging.info('Received player_count request: %s', request.args)
-    player_count_request = PlayerCountRequest.from_dict(dict(request.args))
+    # logging.info('Received player_count request: %s', request.get_data())
+    player_count_request = read_message(PlayerCountRequest)
     logging.info('Parsed request: %s', player_count_request)
+    APP.registry.touch(player_count_request.client_id)
     response = PlayerCountResponse(client_id=player_count_request.client_id,
-                                   count=len(APP.waiting_clients))
-    return jsonify(response.to_dict())
+                                   count=APP.registry.waiting_count)
+    return send_message(response.to_dict())
 
 
-@APP.route('/api/game_state', methods=['GET'])
+@APP.route('/api/game_state', methods=['POST'])
 def game_state():
-    client_state_request = ClientGameStateRequest.from_dict(dict(request.args))
+    client_state_request = read_message(ClientGameStateRequest)
     logging.info('Parsed request: %s', client_state_request)
     client = APP.get_client(client_state_request.client_id)
     logging.info('client: %s', client)
-    if not client.game_id:
-        return jsonify(GameStateRequest(None, None, None, None, None))
+    APP.registry.touch(client_state_request.client_id)
+    if not client or not client.game_id:
+        return send_message(EMPTY_GAME_STATE.to_dict())
+    client.mark_connected()
     game_id = client.game_id
     game = APP.get_game(game_id)
+    if not game:
+        return send_message(EMPTY_GAME_STATE.to_dict())
     game_state = client.get_game_state(game.players, game.active_player)
-    return jsonify(game_state)
+    return send_message(game_state.to_dict())
+
+
+@APP.route('/api/game_updates', methods=['POST'])
+def game_updates():
+    """Long-polls for the changes to a client's game since a version."""
+    updates_request = read_message(GameUpdatesRequest)
+    client = APP.get_client(updates_request.client_id)
+    if not client:
+        # The game may have ended (and been archived) since the last poll
+        final_update = APP.registry.get_final_update(updates_request.client_id)
+        if not final_update:
+            return send_message(GameUpdatesResponse('', 0, []).to_dict())
+        if final_update.version == updates_request.version:
+            final_update = GameUpdatesResponse(final_update.game_id,
+                                               final_update.version, [])
+        return send_message(final_update.to_dict())
+    # Anything still polling is back, so its turns are no longer skipped
+    client.mark_connected()
+    APP.registry.touch(client.client_id)
+    wait = min(updates_request.wait, LONG_POLL_TIMEOUT)
+    if not client.game_id:
+        APP.registry.wait_for_game(client, wait)
+    game = APP.get_game(client.game_id)
+    if not game:
+        return send_message(GameUpdatesResponse('', 0, []).to_dict())
+
+    if updates_request.version:
+        version, changes = game.wait_for_changes(updates_request.version, wait)
+    else:
+        version, changes = game.version, None
+    if changes is None:
+        # New subscriber, or too far behind the change log: send everything.
+        # Changes only set absolute values, so state newer than version is fine
+        METRICS.increment('game_updates.full')
+        state = client.get_game_state(game.players, game.active_player)
+        response = GameUpdatesResponse(game.game_id, version, [],
+                                       state.to_dict())
+    else:
+        METRICS.increment('game_updates.delta')
+        response = GameUpdatesResponse(game.game_id, version, changes)
+    return send_message(response.to_dict())
 
 
 # Define all @APP.routes above this line.
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     APP.config['PROPAGATE_EXCEPTIONS'] = True
+    # Only in the reloader's child, which is the process that serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        APP.event_log = get_event_log()
     APP.secret_key == u'yolo'
     APP.run(debug=True, host='0.0.0.0')
@@ -1,33 +1,285 @@
-import psycopg2 as database
-import traceback
-import socket
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 import logging
+import re
+import sqlite3
+import time
+import traceback
 import uuid
-from socket import SHUT_RDWR
+
+try:
+    import psycopg2 as database
+except ImportError:  # Only the SQLite stand-in is available
+    database = None
+
+from core.metrics import METRICS
+
+# Most connections the pool keeps open, and seconds a caller waits for one
+POOL_SIZE = 10
+POOL_TIMEOUT = 5
+# Most murder decks kept in memory, enough for every game that's running
+MURDER_DECK_CACHE_SIZE = 10000
+
+SCHEMA_PATH = 'server/database_setup.postgres'
+
+# Every query the server runs, by name. Written with Postgres' $n
+# parameters, so they can be PREPAREd once per connection
+STATEMENTS = {
+    'select_users': 'SELECT * FROM "User"',
+    'insert_user': """INSERT INTO "User"("UserID", "Name", "CountryCode")
+                      VALUES ($1, $2, $3)""",
+    'insert_game': """INSERT INTO "Game"("GameID", "UserID", "Status")
+                      VALUES ($1, $2, $3)""",
+    'insert_murder_deck': """INSERT INTO "MurderDeck"("GameID", "SuspectCard", "WeaponCard", "RoomCard")
+                             VALUES ($1, $2, $3, $4)""",
+    'select_murder_deck': """SELECT "SuspectCard", "WeaponCard", "RoomCard"
+                             FROM "MurderDeck" WHERE "GameID" = $1""",
+    'insert_game_event': """INSERT INTO "GameEvent"("GameID", "Sequence", "Type", "Data", "CreatedAt")
+                            VALUES ($1, $2, $3, $4, $5)""",
+}
+
+
+class DatabaseError(Exception):
+    """Raised when the pool can't hand out a working connection."""
+
+
+class PostgresBackend(object):
+    """Connects with psycopg2, and runs STATEMENTS as prepared statements."""
+
+    def __init__(self, settings: Dict[str, Any]):
+        if database is None:
+            raise DatabaseError('psycopg2 is not installed')
+        self.settings = settings
+        # Statement names already PREPAREd, by connection
+        self._prepared: Dict[int, set] = {}
+
+    def connect(self):
+        return database.connect(**self.settings)
+
+    def close(self, connection) -> None:
+        self._prepared.pop(id(connection), None)
+        connection.close()
+
+    def execute(self, cursor, name: str, params: Sequence[Any]) -> None:
+        prepared = self._prepared.setdefault(id(cursor.connection), set())
+        if name not in prepared:
+            cursor.execute(f'PREPARE {name} AS {STATEMENTS[name]}')
+            prepared.add(name)
+        if params:
+            placeholders = ', '.join(['%s'] * len(params))
+            cursor.execute(f'EXECUTE {name} ({placeholders})', params)
+        else:
+            cursor.execute(f'EXECUTE {name}')
+
+    def execute_many(self, cursor, name: str,
+                     rows: Iterable[Sequence[Any]]) -> None:
+        for params in rows:
+            self.execute(cursor, name, params)
+
+    def run_script(self, cursor, script: str) -> None:
+        cursor.execute(script)
+
+
+class SQLiteBackend(object):
+    """A stand-in for Postgres, for tests and running without a database.
+
+    sqlite3 keeps its own cache of compiled statements per connection, so
+    executing the same SQL text again skips the parse like a PREPARE would.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        # Every pooled connection has to see the same in-memory database
+        self._memory_uri = f'file:clueless-{uuid.uuid4()}?mode=memory&cache=shared'
+        self._statements = {name: re.sub(r'\$(\d+)', r'?\1', sql)
+                            for name, sql in STATEMENTS.items()}
+
+    def connect(self):
+        if self.path == ':memory:':
+            return sqlite3.connect(self._memory_uri, uri=True,
+                                   check_same_thread=False)
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def close(self, connection) -> None:
+        connection.close()
+
+    def execute(self, cursor, name: str, params: Sequence[Any]) -> None:
+        cursor.execute(self._statements[name], params)
+
+    def execute_many(self, cursor, name: str,
+                     rows: Iterable[Sequence[Any]]) -> None:
+        cursor.executemany(self._statements[name], rows)
+
+    def run_script(self, cursor, script: str) -> None:
+        # SQLite has no schemas (everything lives in "main"), and its
+        # DROP TABLE has no CASCADE
+        cursor.executescript(script.replace('"public".', '')
+                             .replace(' CASCADE;', ';'))
+
+
+class ConnectionPool(object):
+    """Reuses up to size open connections, instead of one per query."""
+
+    def __init__(self, backend, size: int = POOL_SIZE,
+                 timeout: float = POOL_TIMEOUT):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self._lock = Lock()
+        # Most recently returned first, so idle connections stay warm
+        self._idle = LifoQueue()
+        self._opened = 0
+        self._in_use = 0
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the with-block."""
+        connection = self._checkout()
+        try:
+            yield connection
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                # Don't hand a broken connection to the next caller
+                self._discard(connection)
+                raise
+            self._checkin(connection)
+            raise
+        else:
+            self._checkin(connection)
+
+    def close(self) -> None:
+        """Closes every idle connection, checked out ones close on return."""
+        with self._lock:
+            self.size = 0
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(connection, in_use=False)
+
+    def _checkout(self):
+        start = time.monotonic()
+        connection = None
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                self._opened += 1
+                opening = True
+            else:
+                opening = False
+        if opening:
+            try:
+                connection = self.backend.connect()
+            except Exception as error:
+                with self._lock:
+                    self._opened -= 1
+                raise DatabaseError(str(error)) from error
+            METRICS.increment('db.pool.opened')
+        else:
+            if self._idle.empty():
+                METRICS.increment('db.pool.waits')
+            try:
+                connection = self._idle.get(timeout=self.timeout)
+            except Empty:
+                raise DatabaseError('Timed out waiting for a connection')
+        with self._lock:
+            self._in_use += 1
+            self._update_metrics()
+        METRICS.record_time('db.pool.checkout', time.monotonic() - start)
+        return connection
+
+    def _checkin(self, connection) -> None:
+        with self._lock:
+            self._in_use -= 1
+            keep = self._opened <= self.size
+            self._update_metrics()
+        if keep:
+            self._idle.put(connection)
+        else:
+            self._discard(connection, in_use=False)
+
+    def _discard(self, connection, in_use: bool = True) -> None:
+        with self._lock:
+            self._opened -= 1
+            if in_use:
+                self._in_use -= 1
+            self._update_metrics()
+        try:
+            self.backend.close(connection)
+        except Exception:
+            logging.warning('Failed closing a connection: %s',
+                            traceback.format_exc())
+
+    def _update_metrics(self) -> None:
+        # Callers must hold self._lock
+        METRICS.set_gauge('db.pool.open', self._opened)
+        METRICS.set_gauge('db.pool.in_use', self._in_use)
+        METRICS.set_gauge('db.pool.utilization',
+                          self._in_use / self.size if self.size else 0.0)
+
+
+class Transaction(object):
+    """Runs named STATEMENTS on one connection, committed together."""
+
+    def __init__(self, backend, connection):
+        self._backend = backend
+        self._cursor = connection.cursor()
+        self._on_commit: List[Callable[[], None]] = []
+
+    def execute(self, name: str, params: Sequence[Any] = ()) -> None:
+        logging.debug('%s %s', name, params)
+        self._backend.execute(self._cursor, name, params)
+
+    def execute_many(self, name: str, rows: Iterable[Sequence[Any]]) -> None:
+        self._backend.execute_many(self._cursor, name, rows)
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Runs callback once this transaction commits, and not if it fails."""
+        self._on_commit.append(callback)
+
+    def committed(self) -> None:
+        for callback in self._on_commit:
+            callback()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self) -> List[Any]:
+        return self._cursor.fetchall()
+
+    def close(self) -> None:
+        self._cursor.close()
 
 
 class Clueless_Database:
 
-    connection = None
+    pool: Optional[ConnectionPool] = None
     settings = None
 
-    def __init__(self, settings):
+    def __init__(self, settings, pool_size: int = POOL_SIZE,
+                 backend_factory: Callable[[Dict[str, Any]], Any] = PostgresBackend):
         self.settings = settings
+        self.pool_size = pool_size
+        self.backend_factory = backend_factory
+        # GameID -> (suspect, weapon, room), least recently used first.
+        # Filled on write and on first read, so accusations skip the database
+        self._murder_decks: Dict[int, Tuple[str, str, str]] = OrderedDict()
+        self._murder_decks_lock = Lock()
         return
 
     def connect(self, settings = None):
-        # Check if connection exists and is open
-        if self.connection != None and self.connection == 0:
-            # If we have new settings
-            if settings != self.settings and settings != None:
-                # Close old connection
-                self.disconnect()
-                # New connection opened later
-            else:
-                # connection is good
+        # Keep the pool unless we've been handed new settings
+        if self.pool is not None:
+            if settings is None or settings == self.settings:
                 return True
-        
-        # Check to make sure we have settings to create the connection
+            self.disconnect()
+
+        # Check to make sure we have settings to create the pool
         if self.settings == None and settings == None:
             return False
 
@@ -35,38 +287,68 @@ class Clueless_Database:
         if settings != None:
             self.settings = settings
 
-        # Try creating a new connection
         try:
-            self.connection = database.connect(**self.settings)
+            self.pool = ConnectionPool(self.backend_factory(self.settings),
+                                       size=self.pool_size)
+            # Open the first connection now, so bad settings fail here
+            with self.pool.connection():
+                pass
             return True
-        except:
-            # .connect throws if it fails.
+        except DatabaseError:
             # print(traceback.format_exc())
+            self.pool = None
             return False
-        
+
     def disconnect(self):
-        self.connection.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
         return
-    
+
     def db_error(self):
         return not self.connect()
 
+    @contextmanager
+    def transaction(self):
+        """Batches every statement in the with-block into one commit.
+
+        Pass the yielded Transaction to the methods below to join it.
+        """
+        with self.pool.connection() as connection:
+            transaction = Transaction(self.pool.backend, connection)
+            try:
+                yield transaction
+                connection.commit()
+                transaction.committed()
+            finally:
+                transaction.close()
+
+    @contextmanager
+    def _transaction(self, transaction: Optional[Transaction]):
+        # Joins the caller's transaction, or runs in a new one
+        if transaction is not None:
+            yield transaction
+        else:
+            with self.transaction() as new_transaction:
+                yield new_transaction
+
     def create_database(self):
             if self.db_error():
                 return "Database Error"
 
             try:
-                cursor = self.connection.cursor()
-                cursor.execute(open("server/database_setup.postgres","r").read())
-                cursor.close()
-                self.connection.commit()
+                with self.pool.connection() as connection:
+                    cursor = connection.cursor()
+                    self.pool.backend.run_script(
+                        cursor, open(SCHEMA_PATH, "r").read())
+                    cursor.close()
+                    connection.commit()
                 return str("Success")
             except:
                 return traceback.format_exc()
 
-# Note on cursors: in general, create a new one for each command, 
-#   and close them when the result data is no longer necessary.
-# Only reuse cursors when doing a bunch of updates or inserts.
+# Note on transactions: pass one to each call that should commit together,
+#   e.g. start_game and set_murder_deck for a new game.
 
     def generate_uuid(self) -> int:
         return uuid.uuid4().fields[1]
@@ -75,56 +357,74 @@ class Clueless_Database:
         if self.db_error():
             return "Database Error"
 
-        cursor = self.connection.cursor()
-        cursor.execute('SELECT * FROM "User"')
-        result = cursor.fetchall()
-        cursor.close()
-        return result
+        with self.transaction() as transaction:
+            transaction.execute('select_users')
+            return transaction.fetchall()
 
     def start_game(self, game_id: int, user_id: int, user_name: str,
-                   country_code: int, status: str):
+                   country_code: int, status: str,
+                   transaction: Optional[Transaction] = None):
         if self.db_error():
             return 'Database Error'
 
-        cursor = self.connection.cursor()
-        insert_user = """INSERT INTO "User"("UserID", "Name", "CountryCode")
-                         VALUES (%s, %s, %s)"""
-        logging.info(insert_user, user_id, user_name, country_code)
-        cursor.execute(insert_user, (user_id, user_name, country_code))
-
-        insert_game = """INSERT INTO "Game"("GameID", "UserID", "Status")
-                         VALUES (%s, %s, %s)"""
-        logging.info(insert_game, game_id, user_id, status)
-        cursor.execute(insert_game, (game_id, user_id, status))
-        self.connection.commit()
-        cursor.close()
-        return 'Success'        
+        with self._transaction(transaction) as transaction:
+            transaction.execute('insert_user', (user_id, user_name, country_code))
+            transaction.execute('insert_game', (game_id, user_id, status))
+        return 'Success'
 
     def set_murder_deck(self, game_id: int, suspect_card: str,
-                        weapon_card: str, room_card: str):
+                        weapon_card: str, room_card: str,
+                        transaction: Optional[Transaction] = None):
         if self.db_error():
             return 'Database Error'
 
-        cursor = self.connection.cursor()
-        insert_murder_deck = """INSERT INTO "MurderDeck"("GameID", "SuspectCard", "WeaponCard", "RoomCard")
-                                VALUES (%s, %s, %s, %s)"""
-        logging.info(insert_murder_deck, game_id, suspect_card, weapon_card, room_card)
-        cursor.execute(insert_murder_deck, (game_id, suspect_card, weapon_card, room_card))
-        self.connection.commit()
-        cursor.close()
+        with self._transaction(transaction) as transaction:
+            transaction.execute('insert_murder_deck',
+                                (game_id, suspect_card, weapon_card, room_card))
+            # Write-through, once the deck is really in the database
+            transaction.after_commit(lambda: self._cache_murder_deck(
+                game_id, (suspect_card, weapon_card, room_card)))
         return 'Success'
 
+    def forget_game(self, game_id: int) -> None:
+        """Drops a finished game's murder deck from memory."""
+        with self._murder_decks_lock:
+            self._murder_decks.pop(game_id, None)
+
+    def get_murder_deck(self, game_id: int) -> Optional[Tuple[str, str, str]]:
+        """Returns a game's (suspect, weapon, room), from memory if we can."""
+        with self._murder_decks_lock:
+            murder_deck = self._murder_decks.get(game_id)
+            if murder_deck is not None:
+                self._murder_decks.move_to_end(game_id)
+                METRICS.increment('db.murder_deck.hits')
+                return murder_deck
+        METRICS.increment('db.murder_deck.misses')
+        if self.db_error():
+            return None
+        with self.transaction() as transaction:
+            transaction.execute('select_murder_deck', (game_id,))
+            row = transaction.fetchone()
+        if row is None:
+            return None
+        murder_deck = tuple(row)
+        self._cache_murder_deck(game_id, murder_deck)
+        return murder_deck
+
+    def _cache_murder_deck(self, game_id: int,
+                           murder_deck: Tuple[str, str, str]) -> None:
+        with self._murder_decks_lock:
+            self._murder_decks[game_id] = murder_deck
+            self._murder_decks.move_to_end(game_id)
+            while len(self._murder_decks) > MURDER_DECK_CACHE_SIZE:
+                self._murder_decks.popitem(last=False)
+
     def validate_accusation(self, game_id: int, suspect_card: str,
                             weapon_card: str, room_card: str):
         if self.db_error():
             return 'Database Error'
 
-        cursor = self.connection.cursor()
-        select_murder_deck = """SELECT "GameID", "SuspectCard", "WeaponCard", "RoomCard"
-                                FROM "MurderDeck" """
-        cursor.execute(select_murder_deck)
-        result = cursor.fetchone()
-        cursor.close()
-        accusation = (game_id, suspect_card, weapon_card, room_card)
-        logging.info('Comparing: %s==%s', result, accusation)
-        return result == accusation
+        murder_deck = self.get_murder_deck(game_id)
+        accusation = (suspect_card, weapon_card, room_card)
+        logging.info('Comparing: %s==%s', murder_deck, accusation)
+        return murder_deck == accusation
@@ -0,0 +1,95 @@
+from queue import Empty, Full, Queue
+from threading import Thread
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import time
+
+from core.metrics import METRICS
+from server.clueless_db import Clueless_Database
+
+# Most events waiting to be written, before appending starts to push back
+QUEUE_SIZE = 10000
+# Most events written in one transaction, and seconds a partial batch waits
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+
+# Tells the writer thread to flush what it has and stop
+_STOP = object()
+
+
+class EventLog(object):
+    """Write-behind persistence of game events to "GameEvent".
+
+    Games append events to a bounded queue and carry on; a background
+    thread writes them out in batches, one transaction per batch, so a
+    turn never waits on the database. append never blocks: it runs inside
+    a game's turn (on the shared event loop under the async runner), so a
+    full queue drops the event, counted in event_log.dropped, rather than
+    stall the game.
+    """
+
+    def __init__(self, db: Clueless_Database, queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: Queue = Queue(maxsize=queue_size)
+        self._thread = Thread(target=self._run, name='event-log', daemon=True)
+        self._thread.start()
+
+    def append(self, game_id: str, sequence: int, event_type: str,
+               data: Dict[str, Any]) -> bool:
+        """Queues an event for writing, returns False if it was dropped."""
+        event = (game_id, sequence, event_type, data, time.time())
+        try:
+            self._queue.put_nowait(event)
+        except Full:
+            METRICS.increment('event_log.dropped')
+            logging.warning('Event log is full, dropped %s %s #%s',
+                            event_type, game_id, sequence)
+            return False
+        return True
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Writes out every queued event, then stops the writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                event = self._queue.get(timeout=self._flush_interval)
+            except Empty:
+                continue
+            batch = []
+            # Gather whatever else is already queued, up to a full batch
+            while event is not _STOP:
+                batch.append(event)
+                if len(batch) >= self._batch_size:
+                    break
+                try:
+                    event = self._queue.get_nowait()
+                except Empty:
+                    break
+            stopping = event is _STOP
+            if batch:
+                self._write(batch)
+            METRICS.set_gauge('event_log.queued', self._queue.qsize())
+
+    def _write(self, batch: List[Tuple]) -> None:
+        rows = [(game_id, sequence, event_type, json.dumps(data), created_at)
+                for game_id, sequence, event_type, data, created_at in batch]
+        try:
+            with METRICS.timer('event_log.batch'):
+                if self._db.db_error():
+                    raise ConnectionError('Database Error')
+                with self._db.transaction() as transaction:
+                    transaction.execute_many('insert_game_event', rows)
+        except Exception:
+            METRICS.increment('event_log.failed', len(rows))
+            logging.exception('Failed writing %d game events', len(rows))
+            return
+        METRICS.increment('event_log.written', len(rows))
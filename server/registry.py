@@ -0,0 +1,239 @@
+from collections import OrderedDict
+from threading import Condition, Lock
+from typing import Callable, Dict, List, Optional
+import logging
+import time
+
+import attr
+
+from core.client_boundary import Client
+from core.game import Game
+from core.messages import GameUpdatesResponse
+from core.metrics import METRICS
+
+# Seconds a finished game's summary is kept
+ARCHIVE_TTL = 24 * 60 * 60
+# Most finished game summaries kept at once
+ARCHIVE_SIZE = 1000
+# Seconds a waiting client is kept without hearing from it
+LOBBY_TTL = 2 * 60
+
+
+@attr.s(auto_attribs=True, slots=True)
+class GameSummary(object):
+    """What's left of a Game once it's finished and dropped from memory."""
+    game_id: str
+    winner: str
+    murder_deck: List[str]
+    turns: int
+    finished_at: float
+
+
+class Registry(object):
+    """Indexes the server's clients and games for O(1) lookups.
+
+    Clients are keyed by client_id and games by game_id, and the clients
+    waiting for a game are kept in join order. Clients aren't keyed by
+    address, as one client app (or bot host) can play many of them.
+    A waiting client that isn't heard from (see touch) for lobby_ttl is
+    dropped, so it's never seated in a game it has left.
+    """
+
+    def __init__(self, archive_ttl: float = ARCHIVE_TTL,
+                 archive_size: int = ARCHIVE_SIZE,
+                 lobby_ttl: float = LOBBY_TTL):
+        self._archive_ttl = archive_ttl
+        self._archive_size = archive_size
+        self._lobby_ttl = lobby_ttl
+        self._lock = Lock()
+        # Notified whenever a game is added, for clients waiting on one
+        self._game_added = Condition(self._lock)
+        self._clients: Dict[str, Client] = {}
+        self._games: Dict[str, Game] = {}
+        # Dicts keep insertion order, so this doubles as an ordered set
+        self._waiting_clients: Dict[str, Client] = {}
+        # When each waiting client was last heard from, oldest first
+        self._waiting_seen: Dict[str, float] = OrderedDict()
+        # Oldest first, so expired summaries are always at the front
+        self._archive: Dict[str, GameSummary] = OrderedDict()
+        # Each archived client's last game update, by client_id and oldest
+        # first like the archive, for pollers that missed the end
+        self._final_updates: Dict[str, GameUpdatesResponse] = OrderedDict()
+
+    @property
+    def clients(self) -> List[Client]:
+        with self._lock:
+            return list(self._clients.values())
+
+    @property
+    def games(self) -> List[Game]:
+        with self._lock:
+            return list(self._games.values())
+
+    @property
+    def archive(self) -> List[GameSummary]:
+        with self._lock:
+            self._prune_archive()
+            return list(self._archive.values())
+
+    @property
+    def waiting_clients(self) -> List[Client]:
+        with self._lock:
+            self._prune_waiting()
+            return list(self._waiting_clients.values())
+
+    @property
+    def waiting_count(self) -> int:
+        with self._lock:
+            self._prune_waiting()
+            return len(self._waiting_clients)
+
+    def get_client(self, client_id: str) -> Optional[Client]:
+        return self._clients.get(client_id)
+
+    def get_game(self, game_id: str) -> Optional[Game]:
+        return self._games.get(game_id)
+
+    def get_summary(self, game_id: str) -> Optional[GameSummary]:
+        return self._archive.get(game_id)
+
+    def get_final_update(self, client_id: str) -> Optional[GameUpdatesResponse]:
+        """The full final state of an archived client's game, if still kept."""
+        return self._final_updates.get(client_id)
+
+    def add_client(self, client: Client) -> None:
+        with self._lock:
+            self._clients[client.client_id] = client
+            if not client.game_id:
+                self._waiting_clients[client.client_id] = client
+                self._waiting_seen[client.client_id] = time.time()
+
+    def touch(self, client_id: str) -> None:
+        """Notes that a client was heard from, keeping it in the lobby."""
+        with self._lock:
+            if client_id in self._waiting_seen:
+                self._waiting_seen[client_id] = time.time()
+                self._waiting_seen.move_to_end(client_id)
+
+    def remove_client(self, client_id: str) -> Optional[Client]:
+        with self._lock:
+            return self._remove_client(client_id)
+
+    def add_game(self, game: Game) -> None:
+        """Registers a game, its clients are no longer waiting."""
+        with self._lock:
+            self._add_game(game)
+
+    def add_waiting_game(self, client_id: str,
+                         make_game: Callable[[List[Client]], Game],
+                         min_players: int, max_players: int) -> Optional[Game]:
+        """Puts the waiting clients in a new game, None if too few are waiting.
+
+        At most max_players are taken, oldest first, though the client asking
+        (client_id) always gets a seat if it's waiting. Picking the clients
+        and registering make_game's Game happen under one lock, so two
+        requests can't put the same client in two games.
+        """
+        with self._lock:
+            self._prune_waiting()
+            waiting = list(self._waiting_clients.values())
+            if len(waiting) < min_players:
+                return None
+            if len(waiting) > max_players:
+                requester = self._waiting_clients.get(client_id)
+                waiting = [client for client in waiting if client is not requester]
+                if requester:
+                    waiting = waiting[:max_players - 1] + [requester]
+                else:
+                    waiting = waiting[:max_players]
+            game = make_game(waiting)
+            self._add_game(game)
+            return game
+
+    def wait_for_game(self, client: Client,
+                      timeout: Optional[float] = None) -> bool:
+        """Blocks until the client has been put in a game, or timeout."""
+        with self._game_added:
+            return self._game_added.wait_for(lambda: client.game_id, timeout)
+
+    def remove_game(self, game_id: str) -> Optional[Game]:
+        """Drops a game along with every client that was playing in it."""
+        with self._lock:
+            game = self._games.pop(game_id, None)
+            if game:
+                for client in game.clients:
+                    self._remove_client(client.client_id)
+            self._update_metrics()
+            return game
+
+    def archive_game(self, game_id: str) -> Optional[GameSummary]:
+        """Replaces a finished game (and its clients) with a GameSummary."""
+        game = self.remove_game(game_id)
+        if not game:
+            return None
+        summary = GameSummary(game_id=game.game_id,
+                              winner=game.result or '',
+                              murder_deck=[card.name for card in game.murder_deck],
+                              turns=game.turn,
+                              finished_at=time.time())
+        final_updates = {
+            client.client_id: GameUpdatesResponse(
+                game.game_id, game.version, [],
+                client.get_game_state(game.players, game.active_player).to_dict())
+            for client in game.clients}
+        with self._lock:
+            self._archive[game.game_id] = summary
+            self._final_updates.update(final_updates)
+            self._prune_archive()
+            self._update_metrics()
+        return summary
+
+    def _add_game(self, game: Game) -> None:
+        # Callers must hold self._lock
+        self._games[game.game_id] = game
+        for client in game.clients:
+            self._waiting_clients.pop(client.client_id, None)
+            self._waiting_seen.pop(client.client_id, None)
+        self._update_metrics()
+        self._game_added.notify_all()
+
+    def _remove_client(self, client_id: str) -> Optional[Client]:
+        # Callers must hold self._lock
+        client = self._clients.pop(client_id, None)
+        if not client:
+            return None
+        self._waiting_clients.pop(client_id, None)
+        self._waiting_seen.pop(client_id, None)
+        return client
+
+    def _prune_waiting(self) -> None:
+        # Callers must hold self._lock
+        expired = time.time() - self._lobby_ttl
+        while self._waiting_seen:
+            client_id, seen = next(iter(self._waiting_seen.items()))
+            if seen > expired:
+                break
+            client = self._remove_client(client_id)
+            logging.info('Dropped %s from the lobby, not heard from in %ds',
+                         client.player_name, self._lobby_ttl)
+            METRICS.increment('lobby.expired')
+
+    def _prune_archive(self) -> None:
+        # Callers must hold self._lock
+        expired = time.time() - self._archive_ttl
+        while self._archive:
+            game_id, summary = next(iter(self._archive.items()))
+            if (len(self._archive) <= self._archive_size
+                    and summary.finished_at > expired):
+                break
+            del self._archive[game_id]
+        while self._final_updates:
+            client_id, update = next(iter(self._final_updates.items()))
+            if update.game_id in self._archive:
+                break
+            del self._final_updates[client_id]
+
+    def _update_metrics(self) -> None:
+        # Callers must hold self._lock
+        METRICS.set_gauge('games.live', len(self._games))
+        METRICS.set_gauge('games.archived', len(self._archive))
@@ -0,0 +1,110 @@
+from concurrent.futures import Executor, Future
+import asyncio
+from functools import partial
+import logging
+from threading import Lock, Thread
+from typing import Dict
+
+from core.game import Game
+
+
+class GameScheduler(object):
+    """Advances each game one turn at a time, as soon as the last one ends.
+
+    A turn is submitted to the executor only when the previous turn (and so
+    every client response it waited on) has finished, so there's no polling
+    and no worker is held by a game between turns, or while it's paused.
+    """
+
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self._lock = Lock()
+        self._scheduled: Dict[str, bool] = {}  # game_id -> turn in flight
+        self._game_futures: Dict[str, Future] = {}
+
+    def start(self, game: Game) -> Future:
+        """Starts running the game, returns a Future resolved at game over."""
+        game_future = Future()
+        with self._lock:
+            self._game_futures[game.game_id] = game_future
+            self._scheduled[game.game_id] = False
+        self._schedule(game)
+        return game_future
+
+    def pause(self, game: Game) -> None:
+        game.pause()
+
+    def resume(self, game: Game) -> None:
+        game.resume()
+        self._schedule(game)
+
+    def kill(self, game: Game) -> None:
+        game.kill()
+        # A game with a turn in flight is finished off by _turn_done
+        self._schedule(game)
+
+    def _schedule(self, game: Game) -> None:
+        with self._lock:
+            if self._scheduled.get(game.game_id, True):
+                # Unknown, already finished, or a turn is already in flight
+                return
+            if not (game.result or game.killed):
+                if game.paused:
+                    return
+                self._scheduled[game.game_id] = True
+                game_future = None
+            else:
+                game_future = self._pop(game)
+        if game_future:
+            game_future.set_result(game)
+            return
+        turn = self._submit_turn(game)
+        turn.add_done_callback(partial(self._turn_done, game))
+
+    def _submit_turn(self, game: Game) -> Future:
+        return self._executor.submit(self._run_turn, game)
+
+    @staticmethod
+    def _run_turn(game: Game) -> None:
+        # Only this game's lock, other games keep taking turns
+        with game.lock:
+            game.take_turn()
+
+    def _turn_done(self, game: Game, turn: Future) -> None:
+        error = turn.exception()
+        with self._lock:
+            self._scheduled[game.game_id] = False
+            if error:
+                game_future = self._pop(game)
+        if error:
+            logging.error('Game %s failed during turn %s: %r',
+                          game.game_id, game.turn, error)
+            game_future.set_exception(error)
+            return
+        self._schedule(game)
+
+    def _pop(self, game: Game) -> Future:
+        # Callers must hold self._lock
+        del self._scheduled[game.game_id]
+        return self._game_futures.pop(game.game_id)
+
+
+class AsyncGameScheduler(GameScheduler):
+    """Runs every game's turns as coroutines on a single event loop thread.
+
+    Client I/O is awaited instead of blocking a worker, so the number of
+    concurrent games isn't bounded by the size of a thread pool.
+    """
+
+    def __init__(self):
+        super().__init__(executor=None)
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever,
+                              name='game-loop', daemon=True)
+        self._thread.start()
+
+    def _submit_turn(self, game: Game) -> Future:
+        # No game.lock here, the loop thread must never block. Only one turn
+        # per game is ever in flight, so turns still can't interleave.
+        return asyncio.run_coroutine_threadsafe(game.take_turn_async(),
+                                                self._loop)
@@ -1,11 +1,76 @@
 import logging
+import time
 
 from server import app
+from server.registry import Registry
 from core import client_boundary
+from core import game_const
+from core.game import Game
+
+
+def _add_clients(registry: Registry, count: int):
+    clients = [client_boundary.Client(game_const.CHARACTERS[index % 6],
+                                      'localhost')
+               for index in range(count)]
+    for client in clients:
+        registry.add_client(client)
+    return clients
+
+
+def test_registry_seating():
+    registry = Registry()
+    clients = _add_clients(registry, 2)
+    assert not registry.add_waiting_game(clients[0].client_id, Game, 3, 6)
+    clients += _add_clients(registry, 5)
+    # Seven are waiting: the oldest five, and the one asking, get the seats
+    game = registry.add_waiting_game(clients[-1].client_id, Game, 3, 6)
+    assert game.clients == clients[:5] + clients[-1:]
+    assert all(client.game_id == game.game_id for client in game.clients)
+    assert registry.waiting_clients == [clients[5]]
+    assert registry.get_game(game.game_id) is game
+    assert not registry.add_waiting_game(clients[5].client_id, Game, 3, 6)
+
+
+def test_registry_lobby_expiry():
+    registry = Registry(lobby_ttl=0.1)
+    clients = _add_clients(registry, 4)
+    time.sleep(0.15)
+    for client in clients[1:]:
+        registry.touch(client.client_id)
+    # The first client left without a word, so it isn't seated
+    assert registry.waiting_clients == clients[1:]
+    assert not registry.get_client(clients[0].client_id)
+    game = registry.add_waiting_game(clients[1].client_id, Game, 3, 6)
+    assert game.clients == clients[1:]
+
+
+def test_registry_archive():
+    registry = Registry(archive_size=1)
+    clients = _add_clients(registry, 3)
+    game = registry.add_waiting_game(clients[0].client_id, Game, 3, 6)
+    game.result = clients[1].player_name
+    summary = registry.archive_game(game.game_id)
+    assert summary.winner == clients[1].player_name
+    assert registry.get_summary(game.game_id) == summary
+    assert not registry.get_game(game.game_id)
+    assert not registry.get_client(clients[0].client_id)
+    # Pollers that missed the end still get the final state
+    update = registry.get_final_update(clients[0].client_id)
+    assert update.game_id == game.game_id and update.state
+    # Only archive_size summaries (and their final states) are kept
+    clients = _add_clients(registry, 3)
+    next_game = registry.add_waiting_game(clients[0].client_id, Game, 3, 6)
+    registry.archive_game(next_game.game_id)
+    assert [summary.game_id for summary in registry.archive] == [
+        next_game.game_id]
+    assert not registry.get_final_update(update.state['client_id'])
 
 
 def main():
     logging.basicConfig()
+    test_registry_seating()
+    test_registry_lobby_expiry()
+    test_registry_archive()
     client_boundary._set_up_debug()
     app.DEBUG = True
     app.main()
@@ -0,0 +1,117 @@
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import random
+import statistics
+import time
+from typing import Any, Dict, List
+
+from core import bots
+from core import game_const
+from core.game import Game
+
+NO_ONE = 'No one'
+UNFINISHED = 'Unfinished'
+
+
+def play_game(policies: List[str], max_turns: int,
+              rng: random.Random) -> Dict[str, Any]:
+    """Plays one headless game, returns its winner and turn count."""
+    names = rng.sample(game_const.CHARACTERS, len(policies))
+    clients = [bots.BotClient(name, bots.POLICIES[policy](name, rng))
+               for name, policy in zip(names, policies)]
+    game = Game(clients)
+    while not game.result and game.turn < max_turns:
+        game.take_turn()
+    winner = game.result or UNFINISHED
+    policy_by_name = dict(zip(names, policies))
+    return {'winner': winner,
+            'policy': policy_by_name.get(winner, winner),
+            'turns': game.turn}
+
+
+def run_games(games: int, policies: List[str], max_turns: int,
+              seed: int) -> Dict[str, Any]:
+    """Plays a batch of games in this process, for one pool worker."""
+    rng = random.Random(seed)
+    # Game.take_turn draws from the global random, seed it too
+    random.seed(seed)
+    results = [play_game(policies, max_turns, rng) for _ in range(games)]
+    return {'turns': [result['turns'] for result in results],
+            'winners': Counter(result['winner'] for result in results),
+            'policies': Counter(result['policy'] for result in results)}
+
+
+def simulate(games: int, policies: List[str], workers: int,
+             max_turns: int, seed: int, batch_size: int = 1000) -> Dict[str, Any]:
+    # Small enough batches that every worker stays busy
+    batch_size = max(1, min(batch_size, games // (workers * 4)))
+    batches = [min(batch_size, games - start)
+               for start in range(0, games, batch_size)]
+    turns = []
+    winners = Counter()
+    policy_wins = Counter()
+    start = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_games, batch, policies, max_turns,
+                                   seed + index)
+                   for index, batch in enumerate(batches)]
+        for future in futures:
+            result = future.result()
+            turns.extend(result['turns'])
+            winners.update(result['winners'])
+            policy_wins.update(result['policies'])
+    elapsed = time.monotonic() - start
+    return {'games': games, 'elapsed': elapsed, 'turns': turns,
+            'winners': winners, 'policies': policy_wins}
+
+
+def report(stats: Dict[str, Any], policies: List[str]) -> None:
+    games = stats['games']
+    turns = sorted(stats['turns'])
+    print(f'Games:         {games}')
+    print(f'Elapsed:       {stats["elapsed"]:.2f}s')
+    print(f'Games/sec:     {games / stats["elapsed"]:.1f}')
+    print(f'Turns/game:    mean {statistics.mean(turns):.1f}, '
+          f'median {statistics.median(turns):.0f}, '
+          f'p95 {turns[int(len(turns) * 0.95) - 1]}, max {turns[-1]}')
+    print('Wins by policy:')
+    seats = Counter(policies)
+    for policy, wins in stats['policies'].most_common():
+        # Normalize by seats, so policies with more seats aren't favoured
+        per_seat = wins / seats[policy] if policy in seats else wins
+        print(f'  {policy:<15} {wins / games:7.2%}  '
+              f'({per_seat / games:.2%} per seat)')
+    print('Wins by character:')
+    for winner, wins in stats['winners'].most_common():
+        print(f'  {winner:<15} {wins / games:7.2%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Headless Clue-Less simulator: bots play full games in-process.')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--policies', nargs='+',
+                        default=['elimination', 'elimination', 'random'],
+                        help=f'One per seat, any of: {", ".join(bots.POLICIES)}')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-turns', type=int, default=1000,
+                        help=f'Games still going after this count as {UNFINISHED!r}')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    unknown = set(args.policies) - set(bots.POLICIES)
+    if unknown:
+        parser.error(f'Unknown policies: {", ".join(sorted(unknown))}')
+    if not 3 <= len(args.policies) <= len(game_const.CHARACTERS):
+        parser.error('Between 3 and 6 policies (seats) are needed')
+
+    logging.basicConfig(level=logging.WARNING)
+    stats = simulate(args.games, args.policies, args.workers,
+                     args.max_turns, args.seed)
+    report(stats, args.policies)
+
+
+if __name__ == "__main__":
+    main()